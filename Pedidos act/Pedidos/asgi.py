@@ -12,5 +12,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Pedidos.settings')
+# Indica a settings.SERVIDOR_ASGI que el proceso tiene un event loop permanente
+os.environ.setdefault('PEDIDOS_SERVIDOR', 'asgi')
+# Perfil de SQLite para varios workers (WAL, BEGIN IMMEDIATE, busy timeout)
+os.environ.setdefault('SQLITE_PERFIL', 'produccion')
 
 application = get_asgi_application()
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primero, para que la latencia registrada incluya al resto de los middleware
+    'mainApp.middleware.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +54,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Inactivo salvo que SQL_INSTRUMENTACION_HABILITADA sea True
+    'mainApp.middleware.InstrumentacionSQLMiddleware',
 ]
 
 ROOT_URLCONF = 'Pedidos.urls'
@@ -77,13 +81,41 @@ WSGI_APPLICATION = 'Pedidos.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# ✅ Perfil de SQLite para varios workers escribiendo a la vez (comparar con manage.py benchmark_sqlite)
+SQLITE_BUSY_TIMEOUT_MS = 5000  # Espera ante un bloqueo antes de fallar con "database is locked"
+
+SQLITE_OPCIONES_PRODUCCION = {
+    'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+    # Las transacciones toman el bloqueo de escritura al empezar (BEGIN IMMEDIATE), así
+    # esperan el busy timeout en vez de fallar al pasar de lectura a escritura
+    'transaction_mode': 'IMMEDIATE',
+    'init_command': ';'.join([
+        'PRAGMA journal_mode=WAL',  # Los lectores no se bloquean con el escritor
+        'PRAGMA synchronous=NORMAL',  # Seguro con WAL y mucho más rápido que FULL
+        f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}',
+        'PRAGMA mmap_size=134217728',  # 128 MB
+        'PRAGMA cache_size=-20000',  # ~20 MB por conexión
+        'PRAGMA temp_store=MEMORY',
+    ]),
+}
+
+# El perfil de producción es opcional: activa WAL, que cambia el archivo de la base y
+# crea db.sqlite3-wal/-shm. Lo fijan wsgi.py y asgi.py; los trabajadores (manage.py
+# run_worker) deben lanzarse con SQLITE_PERFIL=produccion en el entorno del despliegue
+SQLITE_PERFIL = os.environ.get('SQLITE_PERFIL', 'basico')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': SQLITE_OPCIONES_PRODUCCION if SQLITE_PERFIL == 'produccion' else {},
     }
 }
 
+# Reintentos de las vistas de escritura si la base sigue bloqueada tras el busy timeout
+SQLITE_REINTENTOS = 4
+SQLITE_REINTENTO_BASE_MS = 50
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -130,6 +162,63 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # URL del módulo de Menú (M1)
 MENU_API_URL = 'http://localhost:8001/api'  # Cambiar según tu configuración
+MENU_API_POOL_SIZE = 10  # Conexiones keep-alive hacia M1 por proceso
+MENU_API_CONNECT_TIMEOUT = 3.05  # Segundos para establecer la conexión
+MENU_API_READ_TIMEOUT = 10  # Segundos de espera de la respuesta
+MENU_API_ASYNC_POOL_SIZE = 100  # Conexiones simultáneas del cliente async (requiere httpx)
+
+# True si el proceso lo sirve Pedidos/asgi.py (uvicorn, daphne): hay un event loop que vive
+# lo mismo que el proceso. Bajo WSGI cada vista async corre en un loop nuevo (async_to_sync)
+SERVIDOR_ASGI = os.environ.get('PEDIDOS_SERVIDOR') == 'asgi'
+
+# Agrupación de validaciones de stock concurrentes hacia M1 (solo bajo ASGI, ver SERVIDOR_ASGI)
+MENU_API_COALESCER_HABILITADO = False
+MENU_API_COALESCER_VENTANA_MS = 25  # Espera máxima para completar un lote
+MENU_API_COALESCER_MAX_LOTE = 20  # Solicitudes por lote
+# 'pipeline' (llamadas concurrentes) o 'lote' (/stock/validar-lote, no incluido en la API base de M1)
+MENU_API_COALESCER_MODO = 'pipeline'
+
+# Cantidad de pedidos por página en el tablero principal
+PEDIDOS_POR_PAGINA = 25
+PEDIDOS_LOTE_MAXIMO = 200  # Pedidos por solicitud en el cambio de estado masivo
+
+# Copia local del stock de M1 (manage.py refrescar_stock_m1)
+STOCK_LOCAL_TTL_SEGUNDOS = 60  # Antigüedad máxima para confiar en la copia local
+STOCK_LOCAL_REFRESCO_SEGUNDOS = 30  # Intervalo del refresco periódico que programa run_worker (menor que el TTL)
+
+# Sincronización del menú de M1 con Plato (manage.py sync_menu_m1)
+MENU_M1_SINCRONIZACION_SEGUNDOS = 300  # Intervalo de la sincronización periódica (cola de tareas)
+
+# Cola de tareas en segundo plano (manage.py run_worker)
+TAREAS_MAX_INTENTOS = 5  # Intentos antes de marcar la tarea como fallida
+TAREAS_BACKOFF_BASE = 2  # Segundos de espera del primer reintento (se duplica en cada intento)
+TAREAS_BACKOFF_MAX = 300  # Espera máxima entre reintentos
+TAREAS_BLOQUEO_SEGUNDOS = 60  # Tras este tiempo otra instancia puede retomar una tarea en proceso
+
+# Eventos de pedidos en tiempo real (SSE)
+# Por defecto solo bajo ASGI: bajo WSGI cada conexión abierta ocupa un worker
+# Desactivado, tampoco se registran eventos (nadie los leería ni los podaría)
+EVENTOS_SSE_HABILITADO = SERVIDOR_ASGI
+EVENTOS_DURACION_MAXIMA_SEGUNDOS = 300  # Bajo WSGI se corta la conexión y el navegador reconecta
+EVENTOS_INTERVALO_MS = 500  # Frecuencia con que cada proceso lee eventos nuevos
+EVENTOS_LATIDO_SEGUNDOS = 15  # Comentario SSE para mantener viva la conexión
+EVENTOS_RETENCION_MINUTOS = 60  # Antigüedad de los eventos que se eliminan (una vez por minuto mientras hay conexiones)
+
+# Archivo de pedidos cerrados (manage.py archivar_pedidos)
+ARCHIVO_PEDIDOS_DIR = BASE_DIR / 'archivo'  # Segmentos mensuales comprimidos
+ARCHIVO_DIAS = 1  # Días desde el cierre antes de mover un pedido al archivo
+
+# Instrumentación SQL por solicitud (mainApp.middleware): SQL_INSTRUMENTACION=1 la activa
+SQL_INSTRUMENTACION_HABILITADA = os.environ.get('SQL_INSTRUMENTACION') == '1'
+SQL_PRESUPUESTO_CONSULTAS = 30  # Consultas por solicitud antes de registrar una advertencia
+SQL_PRESUPUESTO_MS = 200  # Tiempo total de SQL por solicitud antes de registrar una advertencia
+SQL_REPETICIONES_MAXIMAS = 5  # Ejecuciones de una misma forma de consulta antes de marcarla como N+1
+
+# Métricas en formato Prometheus (/metrics)
+METRICAS_HABILITADAS = True
+# Un archivo por proceso; vaciarlo al desplegar para reiniciar los contadores
+METRICAS_DIR = Path(os.environ.get('PEDIDOS_METRICAS_DIR', BASE_DIR / 'metricas'))
+METRICAS_INTERVALO_ESCRITURA_S = 1  # Frecuencia máxima con que cada proceso vuelca sus métricas
 
 # Logging para debugging
 LOGGING = {
@@ -10,10 +10,17 @@ urlpatterns = [
     path('editar/<int:id>/', views.editar_pedido, name='editar_pedido'),
     path('eliminar/<int:id>/', views.eliminar_pedido, name='eliminar_pedido'),
     path('mesa/<int:mesa_id>/pedidos/', views.pedidos_por_mesa, name='pedidos_por_mesa'),
+    path('mesa/<int:mesa_id>/cuenta/', views.resumen_cuenta, name='resumen_cuenta'),
     
     # ✅ Rutas para integración con M1 (API)
     path('pedido/<int:id>/validar-stock/', views.validar_stock_pedido, name='validar_stock'),
     path('pedido/<int:id>/enviar-cocina/', views.enviar_a_cocina, name='enviar_cocina'),
     path('pedido/<int:id>/cancelar/', views.cancelar_pedido, name='cancelar_pedido'),
     path('pedido/<int:id>/cambiar-estado/', views.cambiar_estado_pedido, name='cambiar_estado'),
+    path('pedidos/cambiar-estado/', views.cambiar_estado_lote, name='cambiar_estado_lote'),
+    path('tarea/<int:id>/', views.estado_tarea, name='estado_tarea'),
+    path('eventos/', views.eventos_pedidos, name='eventos_pedidos'),
+    path('reportes/ventas/', views.reporte_ventas, name='reporte_ventas'),
+    path('exportar/pedidos/', views.exportar_pedidos, name='exportar_pedidos'),
+    path('metrics', views.metricas_prometheus, name='metricas'),
 ]
\ No newline at end of file
@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Pedidos.settings')
+# Perfil de SQLite para varios workers (WAL, BEGIN IMMEDIATE, busy timeout)
+os.environ.setdefault('SQLITE_PERFIL', 'produccion')
 
 application = get_wsgi_application()
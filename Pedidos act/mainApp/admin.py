@@ -1,11 +1,26 @@
 from django.contrib import admin
-from .models import Pedidos, Mesas, Plato, DetallePedido 
+from .models import Pedidos, Mesas, Plato, DetallePedido, Tarea
+from . import ventas
 
 
 class DetallePedidoInline(admin.TabularInline):
     model = DetallePedido
     extra = 1 
-    readonly_fields = ['subtotal'] 
+    readonly_fields = ['precio_unitario', 'subtotal']  # El precio se toma del plato al guardar la línea
+
+    # Los platos de un pedido entregado ya están en los acumulados de ventas:
+    # se modifican desde editar_pedido, que ajusta los acumulados
+    def _editable(self, obj):
+        return obj is None or obj.estado != 'entregado'
+
+    def has_add_permission(self, request, obj=None):
+        return self._editable(obj) and super().has_add_permission(request, obj)
+
+    def has_change_permission(self, request, obj=None):
+        return self._editable(obj) and super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return self._editable(obj) and super().has_delete_permission(request, obj)
 
 @admin.register(Pedidos)
 class PedidosAdmin(admin.ModelAdmin):
@@ -34,13 +49,24 @@ class PedidosAdmin(admin.ModelAdmin):
             'classes': ('collapse',),
         }),
         ('Cuenta y Descuento (Criterio #26)', {
-            'fields': ('descuento_porcentaje',),
+            'fields': ('descuento_porcentaje', 'total_neto', 'total_final'),
         }),
     )
 
+    readonly_fields = ['total_neto', 'total_final']
+
 
     inlines = [DetallePedidoInline]
 
+    # Los pedidos entregados eliminados se descuentan de los acumulados de ventas
+    def delete_model(self, request, obj):
+        with ventas.ajustar_entregas([obj.id] if obj.estado == 'entregado' else []):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with ventas.ajustar_entregas(list(queryset.filter(estado='entregado').values_list('id', flat=True))):
+            super().delete_queryset(request, queryset)
+
 
     def total_final_display(self, obj):
         return f"${obj.calcular_total_final():.2f}"
@@ -56,4 +82,11 @@ class MesasAdmin(admin.ModelAdmin):
 @admin.register(Plato)
 class PlatoAdmin(admin.ModelAdmin):
     list_display = ['id', 'nombre', 'precio']
-    search_fields = ['nombre']
\ No newline at end of file
+    search_fields = ['nombre']
+
+@admin.register(Tarea)
+class TareaAdmin(admin.ModelAdmin):
+    list_display = ['id', 'tipo', 'pedido', 'estado', 'intentos', 'disponible_desde', 'fecha_actualizacion']
+    list_filter = ['estado', 'tipo']
+    search_fields = ['tipo', 'ultimo_error']
+    readonly_fields = ['trabajador', 'bloqueada_hasta', 'resultado', 'ultimo_error']
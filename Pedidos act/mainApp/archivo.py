@@ -0,0 +1,328 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from .models import Pedidos, DetallePedido
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ============================================
+# ✅ FORMATO DE LOS SEGMENTOS
+# ============================================
+# pedidos-AAAA-MM.seg: bloques [MAGIA (4 bytes) | largo (4 bytes) | JSONL comprimido con zlib]
+# pedidos-AAAA-MM.idx: registros fijos [pedido_id (8 bytes) | posición del bloque en el .seg (8 bytes)]
+# Ambos archivos solo crecen: cada archivado agrega bloques al final. El índice es la
+# referencia: un bloque sin entradas en el índice (corte entre ambas escrituras) no
+# cuenta como archivado y _reparar lo descarta antes del siguiente archivado.
+
+MAGIA = b'PED1'
+CABECERA = struct.Struct('>4sI')
+REGISTRO_INDICE = struct.Struct('>QQ')
+
+ESTADOS_CERRADOS = ['entregado', 'cancelado']
+
+
+class ArchivoError(Exception):
+    """
+    Segmento dañado o archivado concurrente
+    """
+
+
+def directorio():
+    return Path(getattr(settings, 'ARCHIVO_PEDIDOS_DIR', settings.BASE_DIR / 'archivo'))
+
+
+def _rutas(mes):
+    base = directorio()
+    return base / f'pedidos-{mes}.seg', base / f'pedidos-{mes}.idx'
+
+
+def _mapear(ruta):
+    """
+    Abre el archivo como mmap de solo lectura (None si no existe o está vacío)
+    """
+    try:
+        with open(ruta, 'rb') as archivo:
+            if os.fstat(archivo.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+
+
+def _serializar(pedido):
+    return {
+        'id': pedido.id,
+        'nombre': pedido.nombre,
+        'mesa_id': pedido.mesa_id,
+        'mesa': pedido.mesa.numero,
+        'mesero_id': pedido.mesero_id,
+        'mesero': pedido.mesero.username if pedido.mesero else None,
+        'estado': pedido.estado,
+        'notas_cocina': pedido.notas_cocina,
+        'fecha_creacion': pedido.fecha_creacion.isoformat(),
+        'fecha_actualizacion': pedido.fecha_actualizacion.isoformat(),
+        'timestamp_envio_cocina': pedido.timestamp_envio_cocina.isoformat() if pedido.timestamp_envio_cocina else None,
+        'timestamp_entrega': pedido.timestamp_entrega.isoformat() if pedido.timestamp_entrega else None,
+        'reserva_stock_id': pedido.reserva_stock_id,
+        'descuento_porcentaje': str(pedido.descuento_porcentaje),
+        'total_neto': str(pedido.total_neto),
+        'total_final': str(pedido.total_final),
+        'detalles': [
+            {
+                'plato_id': detalle.plato_id,
+                'plato': detalle.plato.nombre,
+                'precio': str(detalle.precio_unitario),
+                'cantidad': detalle.cantidad,
+            }
+            for detalle in pedido.detalles.all()
+        ],
+    }
+
+
+def _mes(pedido):
+    return timezone.localtime(pedido.fecha_creacion).strftime('%Y-%m')
+
+
+def _entradas_indice(mes):
+    """
+    Pares (pedido_id, posición) del índice del mes; ignora un registro final incompleto
+    """
+    _, ruta_indice = _rutas(mes)
+    indice = _mapear(ruta_indice)
+    if indice is None:
+        return []
+    with indice:
+        completos = len(indice) - len(indice) % REGISTRO_INDICE.size
+        return list(REGISTRO_INDICE.iter_unpack(indice[:completos]))
+
+
+def ids_archivados(mes):
+    """
+    IDs de pedidos ya presentes en el segmento del mes, leídos del índice
+    """
+    return {pedido_id for pedido_id, _ in _entradas_indice(mes)}
+
+
+def _reparar(mes):
+    """
+    Deja el segmento y el índice del mes como quedaron tras el último bloque indexado
+
+    Si un archivado se cortó después de escribir el bloque pero antes de su índice,
+    o a mitad de cualquiera de las dos escrituras, se truncan los bytes sobrantes: sus
+    pedidos siguen en la base y se vuelven a archivar, sin quedar duplicados.
+    """
+    ruta_segmento, ruta_indice = _rutas(mes)
+    entradas = _entradas_indice(mes)
+    fin_segmento = 0
+    if entradas:
+        segmento = _mapear(ruta_segmento)
+        if segmento is None:
+            raise ArchivoError(f'El índice de {mes} apunta a un segmento inexistente')
+        with segmento:
+            posicion = max(posicion for _, posicion in entradas)
+            _, largo = CABECERA.unpack_from(segmento, posicion)
+            fin_segmento = posicion + CABECERA.size + largo
+
+    for ruta, largo in ((ruta_segmento, fin_segmento), (ruta_indice, len(entradas) * REGISTRO_INDICE.size)):
+        if ruta.exists() and ruta.stat().st_size > largo:
+            logger.warning(f"Se descartan {ruta.stat().st_size - largo} bytes sin indexar de {ruta.name}")
+            with open(ruta, 'r+b') as archivo:
+                archivo.truncate(largo)
+                os.fsync(archivo.fileno())
+
+
+def _agregar_bloque(mes, registros):
+    """
+    Agrega un bloque comprimido al segmento del mes y luego sus entradas al índice
+    """
+    ruta_segmento, ruta_indice = _rutas(mes)
+    contenido = zlib.compress(
+        '\n'.join(json.dumps(registro, ensure_ascii=False) for registro in registros).encode('utf-8'), 9
+    )
+    with open(ruta_segmento, 'ab') as segmento:
+        posicion = segmento.seek(0, os.SEEK_END)
+        segmento.write(CABECERA.pack(MAGIA, len(contenido)) + contenido)
+        segmento.flush()
+        os.fsync(segmento.fileno())
+    # El índice se escribe después: un pedido indexado siempre tiene su bloque completo en disco
+    with open(ruta_indice, 'ab') as indice:
+        indice.write(b''.join(REGISTRO_INDICE.pack(registro['id'], posicion) for registro in registros))
+        indice.flush()
+        os.fsync(indice.fileno())
+
+
+class _Bloqueo:
+    """
+    Impide dos archivados simultáneos sobre el mismo directorio (archivo de bloqueo con O_EXCL)
+    """
+    def __init__(self, base):
+        self.ruta = base / '.archivando'
+
+    def __enter__(self):
+        try:
+            os.close(os.open(self.ruta, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            raise ArchivoError(f'Hay otro archivado en curso (si no es así, eliminar {self.ruta})')
+        return self
+
+    def __exit__(self, *exc):
+        os.remove(self.ruta)
+
+
+def archivar(dias=None, lote=500, simular=False):
+    """
+    Mueve a los segmentos del archivo los pedidos cerrados hace más de `dias` días
+
+    Primero se escribe el bloque (con fsync) y recién después se eliminan los
+    pedidos de la base; si el proceso se corta entre ambos pasos, la siguiente
+    ejecución detecta por el índice los pedidos ya archivados y solo los elimina.
+
+    Args:
+        dias: Antigüedad mínima desde el cierre (por defecto ARCHIVO_DIAS)
+        lote: Pedidos por bloque comprimido
+        simular: Solo cuenta los pedidos que se archivarían
+
+    Returns:
+        dict: {'success': bool, 'message': str, 'data': {'archivados': int, 'meses': [str]}}
+    """
+    dias = getattr(settings, 'ARCHIVO_DIAS', 1) if dias is None else dias
+    limite = timezone.now() - timedelta(days=dias)
+    candidatos = list(
+        Pedidos.objects.filter(estado__in=ESTADOS_CERRADOS, fecha_actualizacion__lt=limite)
+        .order_by('id').values_list('id', flat=True)
+    )
+    if simular or not candidatos:
+        return {
+            'success': True,
+            'message': f'{len(candidatos)} pedidos cerrados hace más de {dias} días',
+            'data': {'archivados': 0, 'candidatos': len(candidatos), 'meses': []}
+        }
+
+    base = directorio()
+    base.mkdir(parents=True, exist_ok=True)
+    archivados = 0
+    meses = set()
+    ya_archivados = {}
+
+    with _Bloqueo(base):
+        for inicio in range(0, len(candidatos), lote):
+            ids = candidatos[inicio:inicio + lote]
+            pedidos = (
+                Pedidos.objects.filter(id__in=ids)
+                .select_related('mesa', 'mesero')
+                .prefetch_related(Prefetch('detalles', queryset=DetallePedido.objects.select_related('plato')))
+            )
+
+            por_mes = {}
+            for pedido in pedidos:
+                mes = _mes(pedido)
+                if mes not in ya_archivados:
+                    _reparar(mes)
+                    ya_archivados[mes] = ids_archivados(mes)
+                if pedido.id not in ya_archivados[mes]:
+                    por_mes.setdefault(mes, []).append(_serializar(pedido))
+
+            for mes, registros in por_mes.items():
+                _agregar_bloque(mes, registros)
+                ya_archivados[mes].update(registro['id'] for registro in registros)
+                meses.add(mes)
+
+            with transaction.atomic():
+                _, eliminados = Pedidos.objects.filter(id__in=ids, estado__in=ESTADOS_CERRADOS).delete()
+            archivados += eliminados.get(Pedidos._meta.label, 0)
+            logger.info(f"Archivados {archivados} de {len(candidatos)} pedidos")
+
+    return {
+        'success': True,
+        'message': f'{archivados} pedidos archivados',
+        'data': {'archivados': archivados, 'candidatos': len(candidatos), 'meses': sorted(meses)}
+    }
+
+
+# ============================================
+# ✅ LECTURA DEL ARCHIVO
+# ============================================
+
+def meses_archivados():
+    """
+    Meses con segmento en el archivo ('AAAA-MM'), en orden
+    """
+    return sorted(ruta.stem[len('pedidos-'):] for ruta in directorio().glob('pedidos-*.seg'))
+
+
+def _leer_bloque(segmento, posicion):
+    magia, largo = CABECERA.unpack_from(segmento, posicion)
+    if magia != MAGIA:
+        raise ArchivoError(f'Bloque inválido en la posición {posicion}')
+    inicio = posicion + CABECERA.size
+    contenido = zlib.decompress(segmento[inicio:inicio + largo])
+    return [json.loads(linea) for linea in contenido.decode('utf-8').split('\n')], inicio + largo
+
+
+def leer_mes(mes):
+    """
+    Genera los pedidos archivados de un mes recorriendo el segmento mapeado en memoria
+
+    Solo se leen los bloques indexados: un bloque huérfano de un archivado cortado
+    (o uno que se está escribiendo) no aparece hasta tener su índice.
+
+    Args:
+        mes: 'AAAA-MM'
+
+    Yields:
+        dict: Pedido archivado con sus detalles (ver _serializar)
+    """
+    ruta_segmento, _ = _rutas(mes)
+    posiciones = sorted({posicion for _, posicion in _entradas_indice(mes)})
+    if not posiciones:
+        return
+    segmento = _mapear(ruta_segmento)
+    if segmento is None:
+        raise ArchivoError(f'El índice de {mes} apunta a un segmento inexistente')
+    with segmento:
+        for posicion in posiciones:
+            registros, _ = _leer_bloque(segmento, posicion)
+            yield from registros
+
+
+def pedidos_archivados(desde=None, hasta=None):
+    """
+    Genera los pedidos archivados entre dos meses inclusive ('AAAA-MM'), para reportes
+    """
+    for mes in meses_archivados():
+        if (desde and mes < desde) or (hasta and mes > hasta):
+            continue
+        yield from leer_mes(mes)
+
+
+def buscar_pedido(pedido_id):
+    """
+    Busca un pedido archivado por ID recorriendo los índices y descomprimiendo solo su bloque
+
+    Returns:
+        dict o None si el pedido no está archivado
+    """
+    for mes in reversed(meses_archivados()):
+        ruta_segmento, _ = _rutas(mes)
+        posicion = next(
+            (posicion for id_archivado, posicion in _entradas_indice(mes) if id_archivado == pedido_id),
+            None
+        )
+        if posicion is None:
+            continue
+        segmento = _mapear(ruta_segmento)
+        if segmento is None:
+            raise ArchivoError(f'El índice de {mes} apunta a un segmento inexistente')
+        with segmento:
+            registros, _ = _leer_bloque(segmento, posicion)
+        return next((registro for registro in registros if registro['id'] == pedido_id), None)
+    return None
@@ -0,0 +1,45 @@
+import functools
+import random
+import time
+from django.conf import settings
+from django.db import OperationalError, connection
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def es_bloqueo(error):
+    """
+    Indica si el error es un "database is locked" de SQLite que vale la pena reintentar
+    """
+    return isinstance(error, OperationalError) and 'locked' in str(error)
+
+
+def _espera(intento):
+    base = getattr(settings, 'SQLITE_REINTENTO_BASE_MS', 50) / 1000
+    return base * (2 ** intento) * random.uniform(0.5, 1.5)
+
+
+def reintentar_si_bloqueada(funcion):
+    """
+    Decorador que reintenta la función, con espera exponencial y jitter, cuando
+    SQLite responde "database is locked" aun después de agotar el busy timeout
+
+    Solo reintenta fuera de una transacción: la función decorada debe hacer todas
+    sus escrituras dentro de un único transaction.atomic(), así un reintento
+    nunca repite una escritura ya confirmada. Dentro de otra transacción el error
+    se propaga para que la revierta quien la abrió.
+    """
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        intentos = getattr(settings, 'SQLITE_REINTENTOS', 4)
+        for intento in range(intentos + 1):
+            try:
+                return funcion(*args, **kwargs)
+            except OperationalError as e:
+                if not es_bloqueo(e) or connection.in_atomic_block or intento == intentos:
+                    raise
+                espera = _espera(intento)
+                logger.warning(f"Base bloqueada en {funcion.__name__}, reintento {intento + 1} en {espera:.3f}s")
+                time.sleep(espera)
+    return envoltura
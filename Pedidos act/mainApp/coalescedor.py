@@ -0,0 +1,148 @@
+import asyncio
+import time
+import weakref
+from django.conf import settings
+from . import metricas
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Pendiente:
+    """
+    Estado de las solicitudes en espera dentro de un event loop
+    """
+    def __init__(self):
+        self.solicitudes = []  # [(platos, future, instante_encolado)]
+        self.temporizador = None
+        self.tareas = set()  # Referencias fuertes a los lotes en vuelo
+        self.lock = asyncio.Lock()  # Se crea dentro del loop y solo se usa en él
+
+
+class CoalescedorValidacion:
+    """
+    Agrupa las validaciones de stock que llegan casi al mismo tiempo en una sola llamada a M1
+
+    Las solicitudes se acumulan durante una ventana corta (o hasta completar un lote)
+    y se envían juntas; cada vista recibe su propio diccionario de resultado con el
+    mismo contrato que MenuAPIService.validar_stock.
+
+    Las solicitudes en espera son del event loop, así que solo se agrupan las que
+    comparten uno: bajo ASGI todas las del proceso. Bajo WSGI cada vista async corre
+    en un loop propio (async_to_sync) y nunca habría dos en la misma ventana, por
+    eso sin SERVIDOR_ASGI el coalescedor queda deshabilitado.
+
+    Modos:
+        'pipeline': llamadas individuales concurrentes sobre las conexiones keep-alive
+        'lote': un POST a /stock/validar-lote con todas las solicitudes (requiere que
+                M1 exponga ese endpoint, que no forma parte de su API base)
+    """
+    def __init__(self, servicio):
+        self.servicio = servicio
+        self.habilitado = getattr(settings, 'MENU_API_COALESCER_HABILITADO', False)
+        if self.habilitado and not getattr(settings, 'SERVIDOR_ASGI', False):
+            logger.warning("MENU_API_COALESCER_HABILITADO solo tiene efecto bajo ASGI: el coalescedor queda deshabilitado")
+            self.habilitado = False
+        self.ventana = getattr(settings, 'MENU_API_COALESCER_VENTANA_MS', 25) / 1000
+        self.max_lote = getattr(settings, 'MENU_API_COALESCER_MAX_LOTE', 20)
+        self.modo = getattr(settings, 'MENU_API_COALESCER_MODO', 'pipeline')
+
+        self._pendientes = weakref.WeakKeyDictionary()
+        # Solo se modifican desde el event loop, dentro del lock de su _Pendiente
+        self._metricas = {
+            'lotes': 0,
+            'solicitudes': 0,
+            'lote_maximo': 0,
+            'espera_total_ms': 0.0,
+            'espera_maxima_ms': 0.0,
+        }
+
+    async def validar_stock(self, platos):
+        """
+        Valida el stock de un pedido, agrupándolo con otros si el coalescedor está habilitado
+
+        Returns:
+            dict: {'success': bool, 'message': str, 'data': dict}
+        """
+        if not self.habilitado:
+            return await self.servicio.validar_stock(platos)
+
+        loop = asyncio.get_running_loop()
+        pendiente = self._pendientes.get(loop)
+        if pendiente is None:
+            pendiente = self._pendientes[loop] = _Pendiente()
+
+        futuro = loop.create_future()
+        pendiente.solicitudes.append((platos, futuro, time.perf_counter()))
+
+        if len(pendiente.solicitudes) >= self.max_lote:
+            self._despachar(pendiente)
+        elif pendiente.temporizador is None:
+            pendiente.temporizador = loop.call_later(self.ventana, self._despachar, pendiente)
+
+        return await futuro
+
+    def _despachar(self, pendiente):
+        if pendiente.temporizador is not None:
+            pendiente.temporizador.cancel()
+            pendiente.temporizador = None
+        lote, pendiente.solicitudes = pendiente.solicitudes, []
+        if lote:
+            tarea = asyncio.get_running_loop().create_task(self._enviar_lote(pendiente, lote))
+            pendiente.tareas.add(tarea)
+            tarea.add_done_callback(pendiente.tareas.discard)
+
+    async def _enviar_lote(self, pendiente, lote):
+        inicio = time.perf_counter()
+        esperas = [(inicio - encolado) * 1000 for _, _, encolado in lote]
+        async with pendiente.lock:
+            self._registrar(len(lote), esperas)
+        logger.debug(f"Enviando lote de {len(lote)} validaciones a M1 (modo {self.modo})")
+
+        try:
+            if self.modo == 'pipeline' or len(lote) == 1:
+                resultados = await asyncio.gather(
+                    *(self.servicio.validar_stock(platos) for platos, _, _ in lote)
+                )
+            else:
+                resultados = await self.servicio.validar_stock_lote([platos for platos, _, _ in lote])
+        except Exception as e:
+            logger.error(f"Error inesperado en lote de validaciones: {str(e)}")
+            resultados = [{
+                'success': False,
+                'message': f'Error inesperado: {str(e)}',
+                'data': None
+            }] * len(lote)
+
+        sin_respuesta = {
+            'success': False,
+            'message': 'El sistema de menú no respondió esta validación',
+            'data': None
+        }
+        for i, (_, futuro, _) in enumerate(lote):
+            if not futuro.done():
+                futuro.set_result(resultados[i] if i < len(resultados) else sin_respuesta)
+
+    def _registrar(self, tamano, esperas):
+        self._metricas['lotes'] += 1
+        self._metricas['solicitudes'] += tamano
+        self._metricas['lote_maximo'] = max(self._metricas['lote_maximo'], tamano)
+        self._metricas['espera_total_ms'] += sum(esperas)
+        self._metricas['espera_maxima_ms'] = max(self._metricas['espera_maxima_ms'], max(esperas))
+        # Las estadísticas de arriba son del proceso; /metrics suma estas series entre procesos
+        metricas.incrementar('pedidos_m1_coalescedor_lotes_total')
+        metricas.incrementar('pedidos_m1_coalescedor_solicitudes_total', tamano)
+        metricas.observar('pedidos_m1_coalescedor_lote_tamano', tamano, modo=self.modo)
+        for espera in esperas:
+            metricas.observar('pedidos_m1_coalescedor_espera_segundos', espera / 1000, modo=self.modo)
+
+    def estadisticas(self):
+        """
+        Retorna las métricas acumuladas: lotes enviados, tamaño promedio y espera agregada
+        """
+        datos = dict(self._metricas)
+        lotes = datos['lotes'] or 1
+        solicitudes = datos['solicitudes'] or 1
+        datos['lote_promedio'] = datos['solicitudes'] / lotes
+        datos['espera_promedio_ms'] = datos['espera_total_ms'] / solicitudes
+        return datos
@@ -0,0 +1,105 @@
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import models, transaction
+from django.db.models import F, Subquery, Sum, Window
+from django.utils import timezone
+from .models import CENTAVOS, DetallePedido, Mesas, Pedidos
+from . import ventas
+
+
+def _pedidos_cuenta(mesa_id):
+    """
+    Pedidos que forman la cuenta de la mesa: los de su ocupación actual (o la última), salvo los cancelados
+
+    Los clientes anteriores de la misma mesa tienen otra ocupacion_mesa y no entran en la cuenta.
+    """
+    ocupacion = Subquery(Mesas.objects.filter(id=mesa_id).values('ocupada_desde')[:1])
+    return Pedidos.objects.filter(mesa_id=mesa_id, ocupacion_mesa=ocupacion).exclude(estado='cancelado')
+
+
+def resumen(mesa_id, personas=1):
+    """
+    Calcula la cuenta de la mesa con una sola consulta sobre los detalles
+
+    Cada fila trae el subtotal de la línea y, como ventana agrupada por pedido,
+    el total neto de su pedido (Sum(cantidad * precio) calculado por la base).
+    Los pedidos sin platos no aportan nada a la cuenta y no se listan.
+
+    Args:
+        mesa_id: ID de la mesa
+        personas: Cantidad de personas entre las que se divide el total
+
+    Returns:
+        dict: {'pedidos': [{'id', 'mesero', 'descuento_porcentaje', 'neto', 'final', 'lineas'}],
+               'total_neto', 'descuento_monto', 'descuento_porcentaje', 'total_final', 'monto_por_persona'}
+    """
+    importe = models.DecimalField(max_digits=12, decimal_places=2)
+    lineas = (
+        DetallePedido.objects
+        .filter(pedido__in=_pedidos_cuenta(mesa_id).values('id'))
+        .annotate(
+            subtotal_linea=models.ExpressionWrapper(F('cantidad') * F('precio_unitario'), output_field=importe),
+            neto_pedido=Window(Sum(F('cantidad') * F('precio_unitario'), output_field=importe), partition_by=F('pedido_id')),
+        )
+        .values(
+            'pedido_id', 'pedido__mesero__username', 'pedido__descuento_porcentaje',
+            'plato__nombre', 'cantidad', 'subtotal_linea', 'neto_pedido',
+        )
+        .order_by('pedido_id', 'id')
+    )
+
+    pedidos = {}
+    for linea in lineas:
+        pedido = pedidos.get(linea['pedido_id'])
+        if pedido is None:
+            neto = Decimal(linea['neto_pedido']).quantize(CENTAVOS, rounding=ROUND_HALF_UP)
+            pedido = pedidos[linea['pedido_id']] = {
+                'id': linea['pedido_id'],
+                'mesero': linea['pedido__mesero__username'],
+                'descuento_porcentaje': linea['pedido__descuento_porcentaje'],
+                'neto': neto,
+                'final': Pedidos.aplicar_descuento(neto, linea['pedido__descuento_porcentaje']),
+                'lineas': [],
+            }
+        pedido['lineas'].append({
+            'plato': linea['plato__nombre'],
+            'cantidad': linea['cantidad'],
+            'subtotal': Decimal(linea['subtotal_linea']).quantize(CENTAVOS, rounding=ROUND_HALF_UP),
+        })
+
+    total_neto = sum((pedido['neto'] for pedido in pedidos.values()), Decimal('0'))
+    total_final = sum((pedido['final'] for pedido in pedidos.values()), Decimal('0'))
+    descuento_monto = total_neto - total_final
+    porcentajes = {pedido['descuento_porcentaje'] for pedido in pedidos.values()}
+    if len(porcentajes) == 1:
+        descuento_porcentaje = porcentajes.pop()
+    else:
+        # Pedidos con descuentos distintos: se informa el porcentaje efectivo sobre el total
+        descuento_porcentaje = (
+            (descuento_monto * 100 / total_neto).quantize(CENTAVOS, rounding=ROUND_HALF_UP) if total_neto else Decimal('0')
+        )
+    personas = max(int(personas), 1)
+    return {
+        'pedidos': list(pedidos.values()),
+        'total_neto': total_neto,
+        'descuento_monto': descuento_monto,
+        'descuento_porcentaje': descuento_porcentaje,
+        'total_final': total_final,
+        'monto_por_persona': (total_final / personas).quantize(CENTAVOS, rounding=ROUND_HALF_UP),
+    }
+
+
+def aplicar_descuento(mesa_id, porcentaje):
+    """
+    Aplica el mismo porcentaje de descuento a todos los pedidos de la cuenta de la mesa
+
+    Returns:
+        int: Cantidad de pedidos actualizados
+    """
+    with transaction.atomic():
+        ids = list(_pedidos_cuenta(mesa_id).values_list('id', flat=True))
+        # Los pedidos ya entregados están en los acumulados de ventas: se ajustan con la diferencia
+        with ventas.ajustar_entregas(ids):
+            # update() no pasa por Pedidos.save(): los totales se recalculan a mano
+            Pedidos.objects.filter(id__in=ids).update(descuento_porcentaje=porcentaje, fecha_actualizacion=timezone.now())
+            Pedidos.recalcular_totales(ids)
+    return len(ids)
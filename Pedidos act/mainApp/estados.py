@@ -0,0 +1,240 @@
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import DateTimeField, F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Pedidos
+from . import ventas
+
+# Marca de efecto: el campo toma la hora de la transición solo si todavía está vacío
+AHORA = object()
+
+# ============================================
+# ✅ TABLA DE TRANSICIONES
+# ============================================
+# destino: {
+#     'desde': estados de origen permitidos,
+#     'manual': si puede pedirse desde cambiar_estado_pedido (las demás las aplica el sistema),
+#     'efectos': campos que se escriben en el mismo UPDATE,
+#     'al_aplicar': función opcional que recibe los IDs cambiados, en la misma transacción,
+# }
+TRANSICIONES = {
+    'validando_stock': {
+        'desde': ('pendiente', 'validando_stock'),
+        'manual': False,
+        'efectos': {'stock_validado': True},
+    },
+    'enviado_cocina': {
+        'desde': ('validando_stock',),
+        'manual': False,
+        'efectos': {'stock_consumido': True, 'timestamp_envio_cocina': AHORA},
+    },
+    'en_elaboracion': {
+        'desde': ('pendiente', 'validando_stock', 'enviado_cocina'),
+        'manual': True,
+        'efectos': {},
+    },
+    'listo': {
+        'desde': ('enviado_cocina', 'en_elaboracion'),
+        'manual': True,
+        'efectos': {},
+    },
+    'entregado': {
+        'desde': ('enviado_cocina', 'en_elaboracion', 'listo'),
+        'manual': True,
+        'efectos': {'timestamp_entrega': AHORA},
+        'al_aplicar': ventas.registrar_entregas,
+    },
+    # La cancelación pasa por cancelar_pedido para liberar la reserva en M1 y la mesa
+    'cancelado': {
+        'desde': tuple(Pedidos.ESTADOS_ACTIVOS),
+        'manual': False,
+        'efectos': {},
+    },
+}
+
+
+class TransicionInvalida(Exception):
+    """
+    El destino no existe en la tabla o no puede pedirse manualmente
+    """
+
+
+def permitida(origen, destino):
+    """
+    Indica si la tabla admite pasar de origen a destino
+    """
+    regla = TRANSICIONES.get(destino)
+    return regla is not None and origen in regla['desde']
+
+
+def destinos_manuales(origen):
+    """
+    Opciones del selector de estado: el estado actual y los destinos manuales permitidos desde él
+
+    Returns:
+        list: [(estado, etiqueta), ...] en el orden de ESTADO_CHOICES
+    """
+    return [
+        (estado, etiqueta) for estado, etiqueta in Pedidos.ESTADO_CHOICES
+        if estado == origen or (TRANSICIONES.get(estado, {}).get('manual') and permitida(origen, estado))
+    ]
+
+
+def _regla(destino, manual):
+    regla = TRANSICIONES.get(destino)
+    if regla is None:
+        raise TransicionInvalida(f'Estado no válido: {destino}')
+    if manual and not regla['manual']:
+        raise TransicionInvalida(f'El estado "{destino}" solo lo asigna el sistema')
+    return regla
+
+
+def _valores(regla, destino, ahora, campos):
+    valores = {'estado': destino, 'fecha_actualizacion': ahora}
+    for campo, valor in regla['efectos'].items():
+        if valor is AHORA:
+            valor = Coalesce(F(campo), Value(ahora, output_field=DateTimeField()))
+        valores[campo] = valor
+    valores.update(campos)
+    return valores
+
+
+def _consulta(pedido_ids, destino, manual, campos):
+    """
+    Arma el UPDATE ... WHERE id IN (...) AND estado IN (<orígenes>) de una transición
+    """
+    regla = _regla(destino, manual)
+    ahora = timezone.now()
+    consulta = Pedidos.objects.filter(id__in=pedido_ids, estado__in=regla['desde'])
+    return consulta, _valores(regla, destino, ahora, campos), ahora
+
+
+def _aplicar_en_memoria(pedido, destino, ahora, campos):
+    # Refleja en la instancia lo que escribió el UPDATE, sin volver a leer la fila
+    pedido.estado = destino
+    pedido.fecha_actualizacion = ahora
+    for campo, valor in TRANSICIONES[destino]['efectos'].items():
+        if valor is AHORA:
+            if getattr(pedido, campo) is None:
+                setattr(pedido, campo, ahora)
+        else:
+            setattr(pedido, campo, valor)
+    for campo, valor in campos.items():
+        setattr(pedido, campo, valor)
+
+
+def transicionar(pedido, destino, manual=False, **campos):
+    """
+    Aplica una transición con un único UPDATE condicionado al estado de origen
+
+    Si dos usuarios hacen clic a la vez, solo el primer UPDATE encuentra la fila
+    en un estado de origen válido; el segundo no afecta filas y retorna False.
+
+    Args:
+        pedido: Instancia de Pedidos (se actualiza en memoria si la transición se aplica)
+        destino: Estado destino
+        manual: True si la pide un usuario (rechaza destinos reservados al sistema)
+        campos: Campos adicionales a escribir en el mismo UPDATE (ej: reserva_stock_id)
+
+    Returns:
+        bool: True si la transición se aplicó
+    """
+    consulta, valores, ahora = _consulta([pedido.id], destino, manual, campos)
+    al_aplicar = TRANSICIONES[destino].get('al_aplicar')
+    with transaction.atomic():
+        if not consulta.update(**valores):
+            return False
+        if al_aplicar:
+            al_aplicar([pedido.id])
+    _aplicar_en_memoria(pedido, destino, ahora, campos)
+    return True
+
+
+async def atransicionar(pedido, destino, manual=False, **campos):
+    """
+    Versión async de transicionar
+    """
+    if TRANSICIONES.get(destino, {}).get('al_aplicar'):
+        return await sync_to_async(transicionar)(pedido, destino, manual, **campos)
+    consulta, valores, ahora = _consulta([pedido.id], destino, manual, campos)
+    if not await consulta.aupdate(**valores):
+        return False
+    _aplicar_en_memoria(pedido, destino, ahora, campos)
+    return True
+
+
+def transicionar_lote(pedido_ids, destino, manual=False):
+    """
+    Aplica la misma transición a varios pedidos con un único UPDATE
+
+    Dentro de la transacción se leen los pedidos con select_for_update (en SQLite
+    la transacción de escritura ya excluye a los demás escritores) y el UPDATE se
+    limita a los IDs que estaban en un estado de origen válido: los aplicados son
+    exactamente esos, sin deducirlos de lo que quedó escrito.
+
+    Args:
+        pedido_ids: Lista de IDs de pedidos
+        destino: Estado destino
+        manual: True si la pide un usuario
+
+    Returns:
+        tuple: (
+            [Pedidos],  # pedidos a los que se aplicó la transición
+            {pedido_id: {'success': bool, 'estado': str | None, 'message': str}},
+        )
+    """
+    pedido_ids = list(dict.fromkeys(pedido_ids))
+    regla = _regla(destino, manual)
+    with transaction.atomic():
+        pedidos = {
+            pedido.id: pedido for pedido in
+            Pedidos.objects.select_for_update().filter(id__in=pedido_ids)
+            .only('id', 'estado', 'mesa_id', 'mesero_id', *regla['efectos'])
+        }
+        elegibles = [
+            pedido_id for pedido_id in pedido_ids
+            if pedido_id in pedidos and permitida(pedidos[pedido_id].estado, destino)
+        ]
+        consulta, valores, ahora = _consulta(elegibles, destino, manual, {})
+        # La condición de estado del UPDATE se mantiene como resguardo
+        if elegibles and consulta.update(**valores) != len(elegibles):
+            raise RuntimeError('Los pedidos del lote cambiaron de estado durante la transición')
+
+        aplicados, resultados = _resultados_lote(pedido_ids, pedidos, elegibles, destino, ahora)
+        al_aplicar = regla.get('al_aplicar')
+        if aplicados and al_aplicar:
+            al_aplicar([pedido.id for pedido in aplicados])
+    return aplicados, resultados
+
+
+def _resultados_lote(pedido_ids, pedidos, elegibles, destino, ahora):
+    elegibles = set(elegibles)
+    aplicados = []
+    resultados = {}
+    for pedido_id in pedido_ids:
+        pedido = pedidos.get(pedido_id)
+        if pedido is None:
+            resultados[pedido_id] = {'success': False, 'estado': None, 'message': 'El pedido no existe'}
+        elif pedido_id in elegibles:
+            _aplicar_en_memoria(pedido, destino, ahora, {})
+            aplicados.append(pedido)
+            resultados[pedido_id] = {'success': True, 'estado': destino, 'message': 'Actualizado'}
+        else:
+            resultados[pedido_id] = {
+                'success': False,
+                'estado': pedido.estado,
+                'message': mensaje_rechazo(pedido, destino),
+            }
+    return aplicados, resultados
+
+
+def mensaje_rechazo(pedido, destino):
+    """
+    Mensaje para el usuario cuando una transición no se aplicó
+    """
+    etiquetas = dict(Pedidos.ESTADO_CHOICES)
+    return (
+        f'No se puede pasar de "{etiquetas.get(pedido.estado, pedido.estado)}" '
+        f'a "{etiquetas.get(destino, destino)}"'
+    )
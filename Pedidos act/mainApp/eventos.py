@@ -0,0 +1,276 @@
+import asyncio
+import json
+import time
+import weakref
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import EventoPedido
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tipos de evento que publican las vistas y el trabajador
+TIPOS_EVENTO = [
+    'creado',
+    'actualizado',
+    'stock_validado',
+    'enviado_cocina',
+    'listo',
+    'entregado',
+    'cancelado',
+    'eliminado',
+]
+
+
+def _campos(tipo, pedido, datos):
+    return {
+        'tipo': tipo,
+        'pedido_id': pedido.id,
+        'mesa_id': pedido.mesa_id,
+        'mesero_id': pedido.mesero_id,
+        'estado': pedido.estado,
+        'datos': datos,
+    }
+
+
+def _habilitado():
+    # Sin /eventos/ nadie lee ni poda la tabla, así que no se registra nada
+    return getattr(settings, 'EVENTOS_SSE_HABILITADO', True)
+
+
+def publicar(tipo, pedido, **datos):
+    """
+    Registra un evento de pedido para las pantallas suscritas
+
+    Returns:
+        EventoPedido o None si EVENTOS_SSE_HABILITADO está desactivado
+    """
+    if not _habilitado():
+        return None
+    return EventoPedido.objects.create(**_campos(tipo, pedido, datos))
+
+
+async def apublicar(tipo, pedido, **datos):
+    """
+    Versión async de publicar
+    """
+    if not _habilitado():
+        return None
+    return await EventoPedido.objects.acreate(**_campos(tipo, pedido, datos))
+
+
+def publicar_lote(tipo, pedidos, **datos):
+    """
+    Registra el mismo evento para varios pedidos con un único INSERT
+    """
+    if not _habilitado():
+        return []
+    return EventoPedido.objects.bulk_create([
+        EventoPedido(**_campos(tipo, pedido, datos)) for pedido in pedidos
+    ])
+
+
+# Última poda de eventos viejos en este proceso (la comparten el flujo ASGI y el WSGI)
+_ultima_limpieza = None
+
+
+def _limite_limpieza():
+    """
+    Fecha de corte de la poda, o None si ya se podó en el último minuto en este proceso
+    """
+    global _ultima_limpieza
+    ahora = timezone.now()
+    if _ultima_limpieza is not None and ahora - _ultima_limpieza < timedelta(minutes=1):
+        return None
+    _ultima_limpieza = ahora
+    return ahora - timedelta(minutes=getattr(settings, 'EVENTOS_RETENCION_MINUTOS', 60))
+
+
+def limpiar():
+    """
+    Elimina los eventos más antiguos que EVENTOS_RETENCION_MINUTOS, como mucho una vez por minuto
+
+    Returns:
+        int: Eventos eliminados
+    """
+    limite = _limite_limpieza()
+    if limite is None:
+        return 0
+    return EventoPedido.objects.filter(fecha__lt=limite).delete()[0]
+
+
+async def alimpiar():
+    """
+    Versión async de limpiar
+    """
+    limite = _limite_limpieza()
+    if limite is None:
+        return 0
+    return (await EventoPedido.objects.filter(fecha__lt=limite).adelete())[0]
+
+
+def serializar(evento):
+    """
+    Formatea un evento como mensaje SSE
+    """
+    data = json.dumps({
+        'id': evento.id,
+        'tipo': evento.tipo,
+        'pedido_id': evento.pedido_id,
+        'mesa_id': evento.mesa_id,
+        'mesero_id': evento.mesero_id,
+        'estado': evento.estado,
+        'datos': evento.datos,
+        'fecha': evento.fecha.isoformat(),
+    })
+    return f"id: {evento.id}\ndata: {data}\n\n"
+
+
+class Suscripcion:
+    """
+    Cola de eventos de una conexión SSE, con sus filtros
+    """
+    def __init__(self, pedido=None, mesa=None, mesero=None, estados=None, ultimo_id=0):
+        self.pedido = pedido
+        self.mesa = mesa
+        self.mesero = mesero
+        self.estados = set(estados or [])
+        self.ultimo_id = ultimo_id
+        self.cola = asyncio.Queue(maxsize=getattr(settings, 'EVENTOS_COLA_MAXIMA', 200))
+
+    def acepta(self, evento):
+        if evento.id <= self.ultimo_id:
+            return False
+        if self.pedido is not None and evento.pedido_id != self.pedido:
+            return False
+        if self.mesa is not None and evento.mesa_id != self.mesa:
+            return False
+        if self.mesero is not None and evento.mesero_id != self.mesero:
+            return False
+        if self.estados and evento.estado not in self.estados:
+            return False
+        return True
+
+    def entregar(self, evento):
+        if not self.acepta(evento):
+            return
+        self.ultimo_id = evento.id
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            # Un cliente demasiado lento pierde eventos en vez de frenar a los demás
+            logger.warning("Suscriptor SSE saturado, se descarta un evento")
+
+
+class Difusor:
+    """
+    Lee los eventos nuevos de la base de datos una vez por intervalo y los reparte
+    entre todas las conexiones SSE del proceso, en lugar de una consulta por cliente.
+    """
+    def __init__(self):
+        self.suscripciones = set()
+        self.ultimo_id = None
+        self.tarea = None
+
+    async def suscribir(self, suscripcion):
+        if self.ultimo_id is None:
+            ultimo = await EventoPedido.objects.order_by('-id').values_list('id', flat=True).afirst()
+            self.ultimo_id = ultimo or 0
+
+        # Reenvía lo que el cliente se perdió desde su último evento (Last-Event-ID)
+        if suscripcion.ultimo_id:
+            async for evento in EventoPedido.objects.filter(
+                id__gt=suscripcion.ultimo_id, id__lte=self.ultimo_id
+            ).order_by('id')[:500]:
+                suscripcion.entregar(evento)
+        else:
+            suscripcion.ultimo_id = self.ultimo_id
+
+        self.suscripciones.add(suscripcion)
+        if self.tarea is None or self.tarea.done():
+            self.tarea = asyncio.get_running_loop().create_task(self._sondear())
+
+    def desuscribir(self, suscripcion):
+        self.suscripciones.discard(suscripcion)
+
+    async def _sondear(self):
+        intervalo = getattr(settings, 'EVENTOS_INTERVALO_MS', 500) / 1000
+        while self.suscripciones:
+            try:
+                eventos = [
+                    evento async for evento in
+                    EventoPedido.objects.filter(id__gt=self.ultimo_id).order_by('id')[:500]
+                ]
+                for evento in eventos:
+                    for suscripcion in list(self.suscripciones):
+                        suscripcion.entregar(evento)
+                    self.ultimo_id = evento.id
+                await alimpiar()
+            except Exception as e:
+                logger.error(f"Error al leer eventos de pedidos: {str(e)}")
+            await asyncio.sleep(intervalo)
+        self.ultimo_id = None
+
+
+# Un difusor por event loop (un proceso ASGI usa un único loop)
+_difusores = weakref.WeakKeyDictionary()
+
+
+def obtener_difusor():
+    loop = asyncio.get_running_loop()
+    difusor = _difusores.get(loop)
+    if difusor is None:
+        difusor = _difusores[loop] = Difusor()
+    return difusor
+
+
+async def flujo(suscripcion):
+    """
+    Generador async de mensajes SSE para una suscripción, con latidos para mantener viva la conexión
+    """
+    difusor = obtener_difusor()
+    latido = getattr(settings, 'EVENTOS_LATIDO_SEGUNDOS', 15)
+    await difusor.suscribir(suscripcion)
+    try:
+        yield "retry: 2000\n\n"
+        while True:
+            try:
+                evento = await asyncio.wait_for(suscripcion.cola.get(), timeout=latido)
+            except asyncio.TimeoutError:
+                yield ": latido\n\n"
+                continue
+            yield serializar(evento)
+    finally:
+        difusor.desuscribir(suscripcion)
+
+
+def flujo_sincrono(suscripcion):
+    """
+    Generador síncrono de mensajes SSE para servidores WSGI
+
+    Cada conexión consulta la base por su cuenta y ocupa un worker mientras está
+    abierta, así que termina tras EVENTOS_DURACION_MAXIMA_SEGUNDOS; el navegador
+    reconecta solo y retoma desde su Last-Event-ID.
+    """
+    intervalo = getattr(settings, 'EVENTOS_INTERVALO_MS', 500) / 1000
+    latido = getattr(settings, 'EVENTOS_LATIDO_SEGUNDOS', 15)
+    fin = time.monotonic() + getattr(settings, 'EVENTOS_DURACION_MAXIMA_SEGUNDOS', 300)
+    if not suscripcion.ultimo_id:
+        suscripcion.ultimo_id = EventoPedido.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    ultimo_id = suscripcion.ultimo_id
+
+    yield "retry: 2000\n\n"
+    ultimo_mensaje = time.monotonic()
+    while time.monotonic() < fin:
+        for evento in EventoPedido.objects.filter(id__gt=ultimo_id).order_by('id')[:500]:
+            ultimo_id = evento.id
+            if suscripcion.acepta(evento):
+                suscripcion.ultimo_id = evento.id
+                ultimo_mensaje = time.monotonic()
+                yield serializar(evento)
+        limpiar()
+        if time.monotonic() - ultimo_mensaje >= latido:
+            ultimo_mensaje = time.monotonic()
+            yield ": latido\n\n"
+        time.sleep(intervalo)
@@ -0,0 +1,205 @@
+import csv
+import itertools
+import json
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from .models import DetallePedido, Pedidos
+from . import archivo
+
+FORMATOS = ('csv', 'jsonl')
+NIVELES = ('pedidos', 'lineas')
+
+COLUMNAS = {
+    'pedidos': [
+        'pedido_id', 'nombre', 'mesa', 'mesero', 'estado', 'fecha_creacion', 'timestamp_envio_cocina',
+        'timestamp_entrega', 'descuento_porcentaje', 'total_neto', 'total_final',
+    ],
+    'lineas': [
+        'pedido_id', 'fecha_creacion', 'estado', 'mesa', 'mesero',
+        'plato_id', 'plato', 'precio', 'cantidad', 'subtotal',
+    ],
+}
+
+
+class ExportacionError(Exception):
+    """
+    Parámetros de exportación inválidos
+    """
+
+
+def _rango(desde, hasta):
+    """
+    Convierte fechas (inclusive) en el intervalo [inicio, fin) de fecha_creacion
+    """
+    inicio = timezone.make_aware(datetime.combine(desde, time.min)) if desde else None
+    fin = timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min)) if hasta else None
+    return inicio, fin
+
+
+def _filtros(prefijo, inicio, fin, estados):
+    filtros = {}
+    if inicio:
+        filtros[f'{prefijo}fecha_creacion__gte'] = inicio
+    if fin:
+        filtros[f'{prefijo}fecha_creacion__lt'] = fin
+    if estados:
+        filtros[f'{prefijo}estado__in'] = estados
+    return filtros
+
+
+def _filas_base(nivel, inicio, fin, estados, chunk_size):
+    """
+    Filas de las tablas activas, leídas con values() e iterator() para no cargar el resultado completo
+    """
+    if nivel == 'pedidos':
+        consulta = (
+            Pedidos.objects.filter(**_filtros('', inicio, fin, estados))
+            .order_by('id')
+            .values_list(
+                'id', 'nombre', 'mesa__numero', 'mesero__username', 'estado', 'fecha_creacion',
+                'timestamp_envio_cocina', 'timestamp_entrega', 'descuento_porcentaje', 'total_neto', 'total_final',
+            )
+        )
+        yield from consulta.iterator(chunk_size=chunk_size)
+        return
+
+    consulta = (
+        DetallePedido.objects.filter(**_filtros('pedido__', inicio, fin, estados))
+        .order_by('pedido_id', 'id')
+        .values_list(
+            'pedido_id', 'pedido__fecha_creacion', 'pedido__estado', 'pedido__mesa__numero',
+            'pedido__mesero__username', 'plato_id', 'plato__nombre', 'precio_unitario', 'cantidad',
+        )
+    )
+    for fila in consulta.iterator(chunk_size=chunk_size):
+        yield fila + (fila[7] * fila[8],)
+
+
+def _fecha(texto):
+    return datetime.fromisoformat(texto) if texto else None
+
+
+def _filas_archivo(nivel, inicio, fin, estados):
+    """
+    Filas de los pedidos ya movidos a los segmentos del archivo (archivo.py)
+    """
+    desde = timezone.localtime(inicio).strftime('%Y-%m') if inicio else None
+    hasta = timezone.localtime(fin - timedelta(microseconds=1)).strftime('%Y-%m') if fin else None
+    for registro in archivo.pedidos_archivados(desde=desde, hasta=hasta):
+        creado = _fecha(registro['fecha_creacion'])
+        if (inicio and creado < inicio) or (fin and creado >= fin) or (estados and registro['estado'] not in estados):
+            continue
+        if nivel == 'pedidos':
+            yield (
+                registro['id'], registro['nombre'], registro['mesa'], registro['mesero'], registro['estado'],
+                creado, _fecha(registro['timestamp_envio_cocina']), _fecha(registro['timestamp_entrega']),
+                Decimal(registro['descuento_porcentaje']), Decimal(registro['total_neto']), Decimal(registro['total_final']),
+            )
+            continue
+        for detalle in registro['detalles']:
+            precio = Decimal(detalle['precio'])
+            yield (
+                registro['id'], creado, registro['estado'], registro['mesa'], registro['mesero'],
+                detalle['plato_id'], detalle['plato'], precio, detalle['cantidad'], precio * detalle['cantidad'],
+            )
+
+
+def filas(nivel='pedidos', desde=None, hasta=None, estados=None, incluir_archivo=True, chunk_size=2000):
+    """
+    Genera las filas a exportar: primero las archivadas (más antiguas) y luego las activas
+
+    Args:
+        nivel: 'pedidos' (una fila por pedido) o 'lineas' (una fila por detalle)
+        desde, hasta: Fechas de creación (date) inclusive, opcionales
+        estados: Lista de estados a incluir (todas si está vacía)
+        incluir_archivo: Si se leen también los segmentos del archivo
+        chunk_size: Filas por lectura de la base
+
+    Returns:
+        Generador de tuplas con los valores en el orden de COLUMNAS[nivel]
+
+    Raises:
+        ExportacionError: Si el nivel o algún estado no es válido (al llamarla, antes de leer filas)
+    """
+    if nivel not in NIVELES:
+        raise ExportacionError(f'Nivel no válido: {nivel}')
+    validos = dict(Pedidos.ESTADO_CHOICES)
+    invalidos = [estado for estado in estados or [] if estado not in validos]
+    if invalidos:
+        raise ExportacionError(f'Estados no válidos: {", ".join(invalidos)}')
+
+    inicio, fin = _rango(desde, hasta)
+    origenes = [_filas_base(nivel, inicio, fin, estados, chunk_size)]
+    if incluir_archivo:
+        origenes.insert(0, _filas_archivo(nivel, inicio, fin, estados))
+    return itertools.chain.from_iterable(origenes)
+
+
+class _Eco:
+    """
+    Pseudo-archivo para csv.writer: devuelve cada línea en lugar de guardarla
+    """
+    def write(self, valor):
+        return valor
+
+
+def _local(valor):
+    # Fechas en hora local con microsegundos, igual en CSV y JSONL
+    if isinstance(valor, datetime):
+        return timezone.localtime(valor).isoformat() if timezone.is_aware(valor) else valor.isoformat()
+    return valor
+
+
+def serializar(formato, nivel, filas_exportar):
+    """
+    Convierte las filas en líneas de texto CSV (con encabezado) o JSONL
+
+    Returns:
+        Generador de str, una línea por fila
+    """
+    if formato not in FORMATOS:
+        raise ExportacionError(f'Formato no válido: {formato}')
+    return _lineas_csv(COLUMNAS[nivel], filas_exportar) if formato == 'csv' else _lineas_jsonl(COLUMNAS[nivel], filas_exportar)
+
+
+def _lineas_csv(columnas, filas_exportar):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(columnas)
+    for fila in filas_exportar:
+        yield escritor.writerow(['' if valor is None else _local(valor) for valor in fila])
+
+
+def _lineas_jsonl(columnas, filas_exportar):
+    for fila in filas_exportar:
+        yield json.dumps(dict(zip(columnas, map(_local, fila))), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def _bloque(lineas, tamano):
+    return ''.join(itertools.islice(lineas, tamano))
+
+
+async def aiterar(lineas, tamano=500):
+    """
+    Adapta las líneas a un iterador async para StreamingHttpResponse bajo ASGI
+
+    Con un iterador síncrono Django lo consume entero (sync_to_async(list)) antes
+    de enviar el primer byte; aquí cada bloque de `tamano` líneas se pide al hilo
+    síncrono por separado, así que la memoria sigue acotada a un bloque.
+
+    Args:
+        lineas: Generador de str (el resultado de serializar)
+        tamano: Líneas por bloque enviado
+    """
+    siguiente = sync_to_async(_bloque)
+    try:
+        while True:
+            bloque = await siguiente(lineas, tamano)
+            if not bloque:
+                return
+            yield bloque
+    finally:
+        # Si el cliente corta la descarga se cierra el cursor en el mismo hilo que lo abrió
+        await sync_to_async(lineas.close)()
@@ -0,0 +1,372 @@
+# Arnés de carga de manage.py carga_hora_pico y benchmark_sqlite (usa django.test):
+# vive fuera del paquete de la aplicación para que el código de producción nunca lo importe
+import json
+import math
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from mainApp.bloqueos import es_bloqueo
+from mainApp.models import Mesas, Pedidos, Plato
+from mainApp.services import AsyncMenuAPIService, MenuAPIService
+from mainApp import mesas, tareas
+import logging
+
+logger = logging.getLogger(__name__)
+
+PERFILES = {
+    'basico': {},
+    'produccion': settings.SQLITE_OPCIONES_PRODUCCION,
+}
+
+# Pasos del flujo de un pedido, en el orden en que los recorre cada mesero
+ENDPOINTS = ['crear', 'validar_stock', 'enviar_cocina', 'cocina', 'listo', 'entregado']
+
+
+# ============================================
+# ✅ BASE DE DATOS TEMPORAL
+# ============================================
+
+@contextmanager
+def base_temporal(perfil):
+    """
+    Apunta la conexión por defecto a una base SQLite temporal migrada con el perfil indicado
+
+    Los hilos crean sus conexiones a partir del mismo diccionario de configuración,
+    por lo que todos usan la base temporal hasta salir del bloque.
+    """
+    configuracion = connections.settings['default']
+    original = {'NAME': configuracion['NAME'], 'OPTIONS': configuracion['OPTIONS']}
+    with tempfile.TemporaryDirectory() as directorio:
+        connections.close_all()
+        configuracion['NAME'] = os.path.join(directorio, 'carga.sqlite3')
+        configuracion['OPTIONS'] = PERFILES[perfil]
+        try:
+            call_command('migrate', verbosity=0, interactive=False)
+            yield
+        finally:
+            connections.close_all()
+            configuracion.update(original)
+
+
+def reiniciar_mesa(mesa_id):
+    """
+    Cierra el pedido que quedó a medias tras un fallo para que el mesero pueda seguir
+    """
+    try:
+        Pedidos.objects.filter(mesa_id=mesa_id).exclude(estado='entregado').update(estado='entregado')
+        Mesas.objects.filter(id=mesa_id).update(ocupada=False)
+    except OperationalError:
+        pass
+
+
+# ============================================
+# ✅ M1 SIMULADO
+# ============================================
+
+class ServidorM1Simulado:
+    """
+    Servidor HTTP local que responde los endpoints de stock y menú de M1 con una latencia fija
+    """
+    def __init__(self, latencia_ms=0):
+        self.latencia = latencia_ms / 1000
+        self.solicitudes = {}
+        self._lock = threading.Lock()
+        self._servidor = ThreadingHTTPServer(('127.0.0.1', 0), self._manejador())
+        self._servidor.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self._servidor.server_address[1]}/api'
+
+    def _manejador(self):
+        simulador = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, como M1
+
+            def _responder(self):
+                ruta = self.path.split('?', 1)[0][len('/api'):]
+                largo = int(self.headers.get('Content-Length') or 0)
+                cuerpo = json.loads(self.rfile.read(largo) or b'{}')
+                with simulador._lock:
+                    simulador.solicitudes[ruta] = simulador.solicitudes.get(ruta, 0) + 1
+                time.sleep(simulador.latencia)
+
+                if ruta == '/stock/validar':
+                    datos = {'reserva_id': f'R{random.randrange(10 ** 9)}'}
+                elif ruta == '/stock/validar-lote':
+                    datos = {'resultados': [
+                        {'success': True, 'data': {'reserva_id': f'R{random.randrange(10 ** 9)}'}}
+                        for _ in cuerpo.get('solicitudes', [])
+                    ]}
+                elif ruta == '/stock':
+                    datos = {'stock': []}
+                elif ruta == '/menu':
+                    datos = {'platos': []}
+                else:  # /stock/consumir, /stock/cancelar-reserva
+                    datos = {'success': True}
+
+                contenido = json.dumps(datos).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(contenido)))
+                self.end_headers()
+                self.wfile.write(contenido)
+
+            do_GET = _responder
+            do_POST = _responder
+
+            def log_message(self, *args):
+                pass
+
+        return Manejador
+
+    def __enter__(self):
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+        self._originales = []
+        # Los servicios se instancian al importar cada módulo: se redirigen los ya creados
+        from mainApp import menu_m1, stock_local, views
+        for modulo in (views, tareas, stock_local, menu_m1):
+            for servicio in vars(modulo).values():
+                if isinstance(servicio, AsyncMenuAPIService):
+                    servicio = [servicio, servicio._sync]
+                elif isinstance(servicio, MenuAPIService):
+                    servicio = [servicio]
+                else:
+                    continue
+                for instancia in servicio:
+                    self._originales.append((instancia, instancia.base_url))
+                    instancia.base_url = self.url
+        return self
+
+    def __exit__(self, *exc):
+        for instancia, base_url in self._originales:
+            instancia.base_url = base_url
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+# ============================================
+# ✅ SIMULACIÓN DE HORA PICO
+# ============================================
+
+def _percentil(valores, percentil):
+    """
+    Percentil por rango más cercano de una lista ya ordenada
+    """
+    if not valores:
+        return 0
+    return valores[max(math.ceil(percentil / 100 * len(valores)) - 1, 0)]
+
+
+class _Medicion:
+    """
+    Latencias, consultas y errores por endpoint, compartidos entre los hilos de la simulación
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {nombre: {'latencias': [], 'consultas': [], 'errores': 0} for nombre in ENDPOINTS}
+        self.contadores = {'completados': 0, 'bloqueos': 0, 'fallidos': 0}
+
+    def registrar(self, nombre, segundos, consultas, error=False):
+        with self.lock:
+            endpoint = self.endpoints[nombre]
+            endpoint['latencias'].append(segundos * 1000)
+            endpoint['consultas'].append(consultas)
+            endpoint['errores'] += int(error)
+
+    def contar(self, contador):
+        with self.lock:
+            self.contadores[contador] += 1
+
+
+class PasoFallido(Exception):
+    """
+    Un paso del flujo respondió con un estado inesperado
+    """
+
+
+def _medir(medicion, nombre, funcion, *args, esperado=200, **kwargs):
+    inicio = time.perf_counter()
+    with CaptureQueriesContext(connection) as consultas:
+        try:
+            respuesta = funcion(*args, **kwargs)
+        except Exception:
+            medicion.registrar(nombre, time.perf_counter() - inicio, len(consultas), error=True)
+            raise
+    error = respuesta.status_code != esperado
+    medicion.registrar(nombre, time.perf_counter() - inicio, len(consultas), error=error)
+    if error:
+        raise PasoFallido(f'{nombre}: HTTP {respuesta.status_code}')
+    return respuesta
+
+
+def _esperar_cocina(medicion, pedido_id, limite):
+    """
+    Espera a que el trabajador consuma el stock y pase el pedido a cocina (latencia de la cola)
+    """
+    inicio = time.perf_counter()
+    while time.perf_counter() - inicio < limite:
+        if Pedidos.objects.filter(id=pedido_id, estado='enviado_cocina').exists():
+            medicion.registrar('cocina', time.perf_counter() - inicio, 0)
+            return
+        time.sleep(0.005)
+    medicion.registrar('cocina', time.perf_counter() - inicio, 0, error=True)
+    raise PasoFallido(f'cocina: el pedido #{pedido_id} no llegó a cocina en {limite}s')
+
+
+def _mesero(medicion, barrera, mesero_id, mesa_id, platos, pedidos):
+    cliente = Client()
+    barrera.wait()
+    try:
+        for numero in range(pedidos):
+            try:
+                seleccion = random.sample(platos, k=min(3, len(platos)))
+                respuesta = _medir(medicion, 'crear', cliente.post, '/crear/', {
+                    'nombre': f'Cliente {numero}',
+                    'mesa': mesa_id,
+                    'mesero': mesero_id,
+                    'platos[]': seleccion,
+                    'cantidades[]': [random.randint(1, 3) for _ in seleccion],
+                }, esperado=302)
+                if '/detalle/' not in respuesta['Location']:
+                    # La vista redirige al tablero con un mensaje cuando no pudo registrar el pedido
+                    with medicion.lock:
+                        medicion.endpoints['crear']['errores'] += 1
+                    raise PasoFallido('crear: el pedido no se registró')
+                pedido_id = int(respuesta['Location'].rstrip('/').rsplit('/', 1)[1])
+
+                _medir(medicion, 'validar_stock', cliente.post, f'/pedido/{pedido_id}/validar-stock/')
+                _medir(medicion, 'enviar_cocina', cliente.post, f'/pedido/{pedido_id}/enviar-cocina/', esperado=202)
+                _esperar_cocina(medicion, pedido_id, limite=10)
+                for destino in ('listo', 'entregado'):
+                    _medir(medicion, destino, cliente.post, f'/pedido/{pedido_id}/cambiar-estado/', {'estado': destino})
+                # La mesa se libera al cobrar, fuera del flujo medido
+                mesas.liberar(mesa_id)
+                medicion.contar('completados')
+            except (OperationalError, PasoFallido) as e:
+                medicion.contar('bloqueos' if es_bloqueo(e) else 'fallidos')
+                logger.warning(f'Mesa {mesa_id}: {e}')
+                reiniciar_mesa(mesa_id)
+    finally:
+        connection.close()
+
+
+def _trabajador(detener, nombre):
+    try:
+        while not detener.is_set():
+            try:
+                tarea = tareas.reclamar(nombre)
+            except OperationalError:
+                tarea = None
+            if tarea is None:
+                time.sleep(0.005)
+                continue
+            tareas.ejecutar(tarea)
+    finally:
+        connection.close()
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def simular_hora_pico(meseros=8, pedidos=20, trabajadores=2, latencia_m1_ms=20, perfil=None):
+    """
+    Simula N meseros recorriendo a la vez crear → validar stock → enviar a cocina → listo → entregado
+
+    Las solicitudes pasan por las vistas reales (django.test.Client) sobre la base
+    configurada en ese momento; M1 es un servidor local simulado y el consumo de
+    stock lo hacen `trabajadores` hilos con la misma cola que run_worker.
+
+    Args:
+        meseros: Meseros concurrentes, cada uno con su propia mesa
+        pedidos: Pedidos que completa cada mesero
+        trabajadores: Hilos de la cola de tareas
+        latencia_m1_ms: Latencia de cada respuesta del M1 simulado
+        perfil: Nombre del perfil de SQLite, solo para el informe
+
+    Returns:
+        dict: Resultados serializables a JSON (ver management/commands/carga_hora_pico.py)
+    """
+    sufijo = f'{random.randrange(16 ** 5):05x}'  # Nombres únicos aunque la base ya tenga datos
+    mesero_ids = [User.objects.create(username=f'carga-{sufijo}-{i}').id for i in range(meseros)]
+    mesa_ids = [Mesas.objects.create(numero=f'{sufijo}-{i}', ubicacion='Carga').id for i in range(meseros)]
+    platos = [
+        Plato.objects.create(nombre=f'Carga {sufijo} {i}', precio=random.randint(5, 30), plato_id_m1=100000 + i).id
+        for i in range(12)
+    ]
+    connection.close()
+
+    medicion = _Medicion()
+    barrera = threading.Barrier(meseros)
+    detener = threading.Event()
+    # django.test.Client envía Host: testserver
+    hosts = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'])
+    with hosts, ServidorM1Simulado(latencia_m1_ms) as m1:
+        hilos_trabajadores = [
+            threading.Thread(target=_trabajador, args=(detener, f'carga-{i}')) for i in range(trabajadores)
+        ]
+        hilos_meseros = [
+            threading.Thread(target=_mesero, args=(medicion, barrera, mesero_id, mesa_id, platos, pedidos))
+            for mesero_id, mesa_id in zip(mesero_ids, mesa_ids)
+        ]
+        for hilo in hilos_trabajadores:
+            hilo.start()
+        inicio = time.perf_counter()
+        for hilo in hilos_meseros:
+            hilo.start()
+        for hilo in hilos_meseros:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+        detener.set()
+        for hilo in hilos_trabajadores:
+            hilo.join()
+        solicitudes_m1 = dict(m1.solicitudes)
+
+    endpoints = {}
+    for nombre, datos in medicion.endpoints.items():
+        latencias = sorted(datos['latencias'])
+        endpoints[nombre] = {
+            'solicitudes': len(latencias),
+            'errores': datos['errores'],
+            'p50_ms': round(_percentil(latencias, 50), 2),
+            'p95_ms': round(_percentil(latencias, 95), 2),
+            'p99_ms': round(_percentil(latencias, 99), 2),
+            'consultas_promedio': round(sum(datos['consultas']) / len(datos['consultas']), 1) if datos['consultas'] else 0,
+            'consultas_max': max(datos['consultas'], default=0),
+        }
+
+    return {
+        'fecha': timezone.now().isoformat(),
+        'commit': _commit(),
+        'parametros': {
+            'meseros': meseros,
+            'pedidos': pedidos,
+            'trabajadores': trabajadores,
+            'latencia_m1_ms': latencia_m1_ms,
+            'perfil': perfil,
+        },
+        'duracion_s': round(duracion, 3),
+        'pedidos_completados': medicion.contadores['completados'],
+        'pedidos_por_minuto': round(medicion.contadores['completados'] / duracion * 60, 1) if duracion else 0,
+        'bloqueos': medicion.contadores['bloqueos'],
+        'fallidos': medicion.contadores['fallidos'],
+        'endpoints': endpoints,
+        'solicitudes_m1': solicitudes_m1,
+    }
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from mainApp import archivo
+
+
+class Command(BaseCommand):
+    help = 'Mueve los pedidos entregados o cancelados a los segmentos mensuales del archivo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=None, help='Días desde el cierre (por defecto ARCHIVO_DIAS)')
+        parser.add_argument('--lote', type=int, default=500, help='Pedidos por bloque comprimido')
+        parser.add_argument('--simular', action='store_true', help='Solo informa cuántos pedidos se archivarían')
+
+    def handle(self, *args, **options):
+        try:
+            resultado = archivo.archivar(dias=options['dias'], lote=options['lote'], simular=options['simular'])
+        except archivo.ArchivoError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(resultado['message']))
+        for mes in resultado['data']['meses']:
+            self.stdout.write(f"  Segmento {mes} actualizado")
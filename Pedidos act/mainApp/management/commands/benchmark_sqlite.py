@@ -0,0 +1,111 @@
+import statistics
+import threading
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from mainApp.bloqueos import es_bloqueo, reintentar_si_bloqueada
+from mainApp.management.carga import PERFILES, base_temporal, reiniciar_mesa
+from mainApp.models import Mesas, Plato
+from mainApp.pedidos import PedidoError, registrar_pedido
+from mainApp import estados, mesas
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el rendimiento de creación y transición de pedidos con N escritores concurrentes '
+        'para cada perfil de SQLite, sobre una base temporal'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escritores', default='1,4,8', help='Cantidades de escritores separadas por coma')
+        parser.add_argument('--pedidos', type=int, default=50, help='Pedidos por escritor')
+        parser.add_argument('--perfiles', default='basico,produccion', help='Perfiles a comparar')
+
+    def handle(self, *args, **options):
+        try:
+            escritores = [int(n) for n in options['escritores'].split(',')]
+        except ValueError:
+            raise CommandError('--escritores debe ser una lista de enteros')
+        perfiles = options['perfiles'].split(',')
+        desconocidos = [perfil for perfil in perfiles if perfil not in PERFILES]
+        if desconocidos:
+            raise CommandError(f'Perfiles desconocidos: {", ".join(desconocidos)}')
+
+        self.stdout.write(
+            f"{'perfil':<12}{'escritores':>11}{'ops/s':>10}{'pedidos/s':>11}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'bloqueos':>10}{'fallidos':>10}"
+        )
+        for perfil in perfiles:
+            for cantidad in escritores:
+                r = self._medir(perfil, cantidad, options['pedidos'])
+                self.stdout.write(
+                    f"{perfil:<12}{cantidad:>11}{r['ops_s']:>10.1f}{r['pedidos_s']:>11.1f}"
+                    f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['bloqueos']:>10}{r['fallidos']:>10}"
+                )
+
+    def _medir(self, perfil, cantidad, pedidos):
+        """
+        Ejecuta la carga sobre una base temporal configurada con el perfil indicado
+        """
+        with base_temporal(perfil):
+            mesero = User.objects.create(username='benchmark')
+            plato = Plato.objects.create(nombre='Benchmark', precio=10)
+            mesas_ids = [
+                Mesas.objects.create(numero=f'B{i}', ubicacion='Benchmark').id for i in range(cantidad)
+            ]
+            connection.close()
+            return self._ejecutar(perfil, mesas_ids, mesero.id, plato.id, pedidos)
+
+    def _ejecutar(self, perfil, mesas_ids, mesero_id, plato_id, pedidos):
+        latencias = []
+        contadores = {'ops': 0, 'pedidos': 0, 'bloqueos': 0, 'fallidos': 0}
+        lock = threading.Lock()
+        barrera = threading.Barrier(len(mesas_ids))
+
+        def operacion(funcion, *args):
+            # En el perfil de producción cada escritura pasa por el mismo reintento que las vistas
+            if perfil == 'produccion':
+                funcion = reintentar_si_bloqueada(funcion)
+            inicio = time.perf_counter()
+            resultado = funcion(*args)
+            with lock:
+                latencias.append((time.perf_counter() - inicio) * 1000)
+                contadores['ops'] += 1
+            return resultado
+
+        def escritor(mesa_id):
+            barrera.wait()
+            try:
+                for i in range(pedidos):
+                    try:
+                        pedido = operacion(registrar_pedido, f'Cliente {i}', mesa_id, mesero_id, {plato_id: 1})
+                        for destino in ('en_elaboracion', 'listo', 'entregado'):
+                            operacion(estados.transicionar, pedido, destino)
+                        operacion(mesas.liberar, mesa_id)
+                        with lock:
+                            contadores['pedidos'] += 1
+                    except (OperationalError, PedidoError) as e:
+                        with lock:
+                            contadores['bloqueos' if es_bloqueo(e) else 'fallidos'] += 1
+                        reiniciar_mesa(mesa_id)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=escritor, args=(mesa_id,)) for mesa_id in mesas_ids]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+
+        latencias.sort()
+        return {
+            'ops_s': contadores['ops'] / duracion,
+            'pedidos_s': contadores['pedidos'] / duracion,
+            'p50_ms': statistics.median(latencias) if latencias else 0,
+            'p95_ms': latencias[int(len(latencias) * 0.95)] if latencias else 0,
+            'bloqueos': contadores['bloqueos'],
+            'fallidos': contadores['fallidos'],
+        }
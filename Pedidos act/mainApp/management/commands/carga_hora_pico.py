@@ -0,0 +1,85 @@
+import json
+import logging
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from mainApp.management import carga
+
+
+class Command(BaseCommand):
+    help = (
+        'Simula una hora pico: N meseros recorren crear → validar stock → enviar a cocina → listo → entregado '
+        'contra un M1 simulado, sobre una base temporal, y guarda los resultados en JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meseros', type=int, default=8, help='Meseros concurrentes (uno por mesa)')
+        parser.add_argument('--pedidos', type=int, default=20, help='Pedidos que completa cada mesero')
+        parser.add_argument('--trabajadores', type=int, default=2, help='Hilos de la cola de tareas')
+        parser.add_argument('--latencia-m1-ms', type=int, default=20, help='Latencia de cada respuesta de M1')
+        parser.add_argument('--perfil', choices=list(carga.PERFILES), default='produccion', help='Perfil de SQLite')
+        parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto en resultados_carga/)')
+        parser.add_argument('--comparar', help='JSON de una corrida anterior contra el cual comparar')
+
+    def handle(self, *args, **options):
+        anterior = None
+        if options['comparar']:
+            try:
+                anterior = json.loads(Path(options['comparar']).read_text(encoding='utf-8'))
+            except (OSError, ValueError) as e:
+                raise CommandError(f'No se pudo leer {options["comparar"]}: {e}')
+
+        # El log INFO de cada pedido y tarea ensucia la salida y pesa en las latencias
+        registro = logging.getLogger('mainApp')
+        nivel = registro.level
+        if options['verbosity'] < 2:
+            registro.setLevel(logging.WARNING)
+        try:
+            with carga.base_temporal(options['perfil']):
+                resultado = carga.simular_hora_pico(
+                    meseros=options['meseros'],
+                    pedidos=options['pedidos'],
+                    trabajadores=options['trabajadores'],
+                    latencia_m1_ms=options['latencia_m1_ms'],
+                    perfil=options['perfil'],
+                )
+        finally:
+            registro.setLevel(nivel)
+
+        salida = Path(options['salida']) if options['salida'] else (
+            Path(settings.BASE_DIR) / 'resultados_carga'
+            / f"{timezone.localtime():%Y%m%d-%H%M%S}-{resultado['commit'] or 'sin-commit'}.json"
+        )
+        salida.parent.mkdir(parents=True, exist_ok=True)
+        salida.write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding='utf-8')
+
+        self._imprimir(resultado, anterior)
+        self.stdout.write(self.style.SUCCESS(f'Resultados guardados en {salida}'))
+
+    def _imprimir(self, resultado, anterior):
+        previos = anterior['endpoints'] if anterior else {}
+        self.stdout.write(
+            f"{'endpoint':<15}{'solicitudes':>12}{'errores':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+            f"{'consultas':>11}{'Δ p95':>9}"
+        )
+        for nombre, datos in resultado['endpoints'].items():
+            delta = ''
+            if previos.get(nombre, {}).get('p95_ms'):
+                delta = f"{(datos['p95_ms'] / previos[nombre]['p95_ms'] - 1) * 100:+.0f}%"
+            self.stdout.write(
+                f"{nombre:<15}{datos['solicitudes']:>12}{datos['errores']:>9}{datos['p50_ms']:>9.1f}"
+                f"{datos['p95_ms']:>9.1f}{datos['p99_ms']:>9.1f}{datos['consultas_promedio']:>11.1f}{delta:>9}"
+            )
+
+        resumen = (
+            f"{resultado['pedidos_completados']} pedidos en {resultado['duracion_s']:.1f}s: "
+            f"{resultado['pedidos_por_minuto']:.1f} pedidos/min, "
+            f"{resultado['bloqueos']} bloqueos de SQLite, {resultado['fallidos']} fallidos"
+        )
+        if anterior:
+            resumen += (
+                f" (antes {anterior['pedidos_por_minuto']:.1f} pedidos/min"
+                f" en {anterior.get('commit') or 'commit desconocido'})"
+            )
+        self.stdout.write(resumen)
@@ -0,0 +1,54 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from mainApp import exportacion
+
+
+class Command(BaseCommand):
+    help = 'Exporta los pedidos (incluidos los archivados) en CSV o JSONL, fila por fila'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Fecha de creación AAAA-MM-DD inclusive')
+        parser.add_argument('--hasta', help='Fecha de creación AAAA-MM-DD inclusive')
+        parser.add_argument('--estado', default='', help='Estados separados por coma (por defecto, todos)')
+        parser.add_argument('--nivel', choices=exportacion.NIVELES, default='pedidos',
+                            help="'pedidos' o 'lineas' (una fila por plato)")
+        parser.add_argument('--formato', choices=exportacion.FORMATOS, default='csv')
+        parser.add_argument('--salida', help='Archivo de destino (por defecto, la salida estándar)')
+        parser.add_argument('--sin-archivo', action='store_true', help='Omitir los pedidos archivados')
+        parser.add_argument('--lote', type=int, default=2000, help='Filas leídas por consulta')
+
+    def _fecha(self, options, nombre):
+        if not options[nombre]:
+            return None
+        try:
+            return date.fromisoformat(options[nombre])
+        except ValueError:
+            raise CommandError(f'--{nombre} debe tener el formato AAAA-MM-DD')
+
+    def handle(self, *args, **options):
+        try:
+            filas = exportacion.filas(
+                options['nivel'],
+                desde=self._fecha(options, 'desde'),
+                hasta=self._fecha(options, 'hasta'),
+                estados=[estado for estado in options['estado'].split(',') if estado],
+                incluir_archivo=not options['sin_archivo'],
+                chunk_size=options['lote'],
+            )
+        except exportacion.ExportacionError as e:
+            raise CommandError(str(e))
+        lineas = exportacion.serializar(options['formato'], options['nivel'], filas)
+
+        if not options['salida']:
+            for linea in lineas:
+                self.stdout.write(linea, ending='')
+            return
+
+        cantidad = 0
+        with open(options['salida'], 'w', encoding='utf-8', newline='') as destino:
+            for linea in lineas:
+                destino.write(linea)
+                cantidad += 1
+        if options['formato'] == 'csv':
+            cantidad -= 1  # Encabezado
+        self.stderr.write(self.style.SUCCESS(f"{cantidad} filas exportadas a {options['salida']}"))
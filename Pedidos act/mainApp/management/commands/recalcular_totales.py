@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from mainApp.models import Pedidos
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye (o verifica con --verificar) los totales almacenados de los pedidos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Solo compara los totales almacenados con los calculados, sin modificarlos',
+        )
+        parser.add_argument('--lote', type=int, default=500, help='Cantidad de pedidos por lote')
+
+    def handle(self, *args, **options):
+        verificar = options['verificar']
+        lote = options['lote']
+        procesados = 0
+        diferencias = []
+
+        pedidos = Pedidos.objects.order_by('id').values_list('id', 'total_neto', 'total_final')
+        ids_lote = []
+        almacenados = {}
+        for pedido_id, total_neto, total_final in pedidos.iterator(chunk_size=lote):
+            ids_lote.append(pedido_id)
+            almacenados[pedido_id] = (total_neto, total_final)
+            if len(ids_lote) >= lote:
+                diferencias += self._procesar_lote(ids_lote, almacenados, verificar)
+                procesados += len(ids_lote)
+                ids_lote, almacenados = [], {}
+        if ids_lote:
+            diferencias += self._procesar_lote(ids_lote, almacenados, verificar)
+            procesados += len(ids_lote)
+
+        for pedido_id, almacenado, calculado in diferencias:
+            self.stdout.write(
+                f"Pedido #{pedido_id}: almacenado neto={almacenado[0]} final={almacenado[1]}, "
+                f"calculado neto={calculado[0]} final={calculado[1]}"
+            )
+
+        if verificar and diferencias:
+            raise CommandError(f'{len(diferencias)} de {procesados} pedidos tienen totales desactualizados')
+
+        accion = 'verificados' if verificar else 'recalculados'
+        self.stdout.write(self.style.SUCCESS(
+            f'{procesados} pedidos {accion} ({len(diferencias)} con diferencias)'
+        ))
+
+    def _procesar_lote(self, ids, almacenados, verificar):
+        calculados = Pedidos.recalcular_totales(ids, guardar=not verificar)
+        return [
+            (pedido_id, almacenados[pedido_id], calculados[pedido_id])
+            for pedido_id in ids
+            if pedido_id in calculados and almacenados[pedido_id] != calculados[pedido_id]
+        ]
@@ -0,0 +1,22 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from mainApp import ventas
+
+
+class Command(BaseCommand):
+    help = 'Recalcula desde cero los acumulados de ventas por día, plato, mesero y hora'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Fecha AAAA-MM-DD; solo se reemplazan los acumulados desde ese día')
+        parser.add_argument('--lote', type=int, default=500, help='Pedidos leídos por consulta')
+
+    def handle(self, *args, **options):
+        desde = None
+        if options['desde']:
+            try:
+                desde = date.fromisoformat(options['desde'])
+            except ValueError:
+                raise CommandError('--desde debe tener el formato AAAA-MM-DD')
+
+        resultado = ventas.reconstruir(desde=desde, lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(resultado['message']))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from mainApp import stock_local, tareas
+
+
+class Command(BaseCommand):
+    help = 'Actualiza la copia local del stock de M1 usada para descartar platos agotados'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--programar', action='store_true',
+                            help='Solo encola el refresco periódico para run_worker')
+
+    def handle(self, *args, **options):
+        if options['programar']:
+            tarea = tareas.programar_refresco_stock(demora=0)
+            if tarea is None:
+                self.stdout.write('El refresco periódico ya estaba programado')
+            else:
+                self.stdout.write(self.style.SUCCESS(f'Refresco periódico programado (tarea #{tarea.id})'))
+            return
+
+        resultado = stock_local.refrescar()
+        if not resultado['success']:
+            raise CommandError(resultado['message'])
+        self.stdout.write(self.style.SUCCESS(f"{resultado['data']} platos actualizados"))
@@ -0,0 +1,47 @@
+import os
+import signal
+import socket
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from mainApp import tareas
+
+
+class Command(BaseCommand):
+    help = 'Procesa las tareas en segundo plano (consumo de stock en M1, etc.)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Procesa las tareas disponibles y termina')
+        parser.add_argument('--intervalo', type=float, default=1.0, help='Segundos de espera cuando no hay tareas')
+        parser.add_argument('--max-tareas', type=int, default=0, help='Termina tras procesar N tareas (0 = sin límite)')
+
+    def handle(self, *args, **options):
+        trabajador = f"{socket.gethostname()}:{os.getpid()}"
+        self._detener = False
+        signal.signal(signal.SIGTERM, self._senal_detener)
+        signal.signal(signal.SIGINT, self._senal_detener)
+
+        self.stdout.write(f'Trabajador {trabajador} iniciado')
+        # La copia local del stock vence a los STOCK_LOCAL_TTL_SEGUNDOS: el refresco se reprograma solo
+        tareas.programar_refresco_stock(demora=0)
+        procesadas = 0
+        while not self._detener:
+            close_old_connections()
+            tarea = tareas.reclamar(trabajador)
+            if tarea is None:
+                if options['once']:
+                    break
+                time.sleep(options['intervalo'])
+                continue
+
+            estado = tareas.ejecutar(tarea)
+            procesadas += 1
+            self.stdout.write(f'Tarea #{tarea.id} ({tarea.tipo}) -> {estado}')
+            if options['max_tareas'] and procesadas >= options['max_tareas']:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f'Trabajador {trabajador} detenido ({procesadas} tareas procesadas)'))
+
+    def _senal_detener(self, signum, frame):
+        # Se termina la tarea en curso antes de salir
+        self._detener = True
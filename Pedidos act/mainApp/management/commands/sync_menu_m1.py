@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from mainApp import menu_m1, tareas
+
+
+class Command(BaseCommand):
+    help = 'Sincroniza los platos con el catálogo de M1 (incremental por ETag y fecha de modificación)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--completa', action='store_true', help='Trae todo el catálogo, sin ETag ni fecha')
+        parser.add_argument('--lote', type=int, default=500, help='Filas por sentencia de escritura masiva')
+        parser.add_argument('--programar', action='store_true',
+                            help='Solo encola la sincronización periódica para run_worker')
+
+    def handle(self, *args, **options):
+        if options['programar']:
+            tarea = tareas.programar_sincronizacion_menu()
+            if tarea is None:
+                self.stdout.write('La sincronización periódica ya estaba programada')
+            else:
+                self.stdout.write(self.style.SUCCESS(f'Sincronización periódica programada (tarea #{tarea.id})'))
+            return
+
+        resultado = menu_m1.sincronizar(completa=options['completa'], lote=options['lote'])
+        if not resultado['success']:
+            raise CommandError(resultado['message'])
+        datos = resultado['data']
+        self.stdout.write(
+            f"Recibidos: {datos['recibidos']}  Creados: {datos['creados']}  Actualizados: {datos['actualizados']}  "
+            f"Sin cambios: {datos['sin_cambios']}  Conflictos: {datos['conflictos']}  "
+            f"Platos sin ID de M1: {datos['sin_id_m1']}"
+        )
+        self.stdout.write(self.style.SUCCESS(f"{resultado['message']} en {datos['segundos']}s"))
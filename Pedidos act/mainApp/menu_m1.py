@@ -0,0 +1,171 @@
+import time
+import unicodedata
+from decimal import Decimal
+from django.db import transaction
+from django.utils import timezone
+from .bloqueos import reintentar_si_bloqueada
+from .models import Plato, SincronizacionM1
+from .services import MenuAPIService
+from . import referencia
+import logging
+
+logger = logging.getLogger(__name__)
+
+menu_api = MenuAPIService()
+
+RECURSO = 'menu'
+
+
+def normalizar(nombre):
+    """
+    Nombre comparable entre sistemas: sin acentos, sin mayúsculas y con espacios simples
+    """
+    sin_acentos = ''.join(
+        letra for letra in unicodedata.normalize('NFKD', nombre) if not unicodedata.combining(letra)
+    )
+    return ' '.join(sin_acentos.casefold().split())
+
+
+def _conciliar(platos_m1, locales):
+    """
+    Compara el catálogo de M1 con los platos locales, en memoria
+
+    Se busca primero por ID de M1 y, si no hay, por nombre normalizado (así se
+    completa plato_id_m1 de los platos cargados a mano).
+
+    Returns:
+        tuple: (nuevos, actualizados, contadores)
+    """
+    por_id = {}
+    por_nombre = {}
+    for plato in locales:
+        if plato.plato_id_m1 is not None:
+            por_id.setdefault(plato.plato_id_m1, plato)
+        por_nombre.setdefault(normalizar(plato.nombre), plato)
+
+    nuevos = []
+    actualizados = {}
+    contadores = {'sin_cambios': 0, 'conflictos': 0}
+
+    for item in platos_m1:
+        id_m1 = int(item['id'])
+        nombre = item['nombre'].strip()
+        precio = Decimal(str(item['precio']))
+        clave = normalizar(nombre)
+
+        plato = por_id.get(id_m1)
+        if plato is None:
+            plato = por_nombre.get(clave)
+            if plato is not None and plato.plato_id_m1 not in (None, id_m1):
+                # El nombre ya pertenece a otro plato de M1: se deja para revisión manual
+                logger.warning(f"Plato M1 #{id_m1} '{nombre}' coincide con '{plato.nombre}' (M1 #{plato.plato_id_m1})")
+                contadores['conflictos'] += 1
+                continue
+
+        if plato is None:
+            plato = Plato(nombre=nombre, precio=precio, plato_id_m1=id_m1)
+            nuevos.append(plato)
+            por_id[id_m1] = plato
+            por_nombre[clave] = plato
+            continue
+
+        cambio = False
+        if plato.plato_id_m1 != id_m1:
+            plato.plato_id_m1 = id_m1
+            por_id[id_m1] = plato
+            cambio = True
+        if plato.precio != precio:
+            plato.precio = precio
+            cambio = True
+        if plato.nombre != nombre:
+            otro = por_nombre.get(clave)
+            if otro is not None and otro is not plato:
+                logger.warning(f"Plato M1 #{id_m1}: el nombre '{nombre}' ya lo usa otro plato")
+                contadores['conflictos'] += 1
+            else:
+                por_nombre.pop(normalizar(plato.nombre), None)
+                por_nombre[clave] = plato
+                plato.nombre = nombre
+                cambio = True
+
+        if cambio:
+            if plato.pk is not None:
+                actualizados[plato.pk] = plato
+        else:
+            contadores['sin_cambios'] += 1
+
+    return nuevos, list(actualizados.values()), contadores
+
+
+@reintentar_si_bloqueada
+def _guardar(estado, nuevos, actualizados, lote):
+    with transaction.atomic():
+        Plato.objects.bulk_update(actualizados, ['nombre', 'precio', 'plato_id_m1'], batch_size=lote)
+        # Si alguien cargó el mismo nombre mientras tanto, se completa esa fila en lugar de fallar
+        Plato.objects.bulk_create(
+            nuevos,
+            batch_size=lote,
+            update_conflicts=True,
+            unique_fields=['nombre'],
+            update_fields=['precio', 'plato_id_m1'],
+        )
+        estado.save()
+        # Las operaciones masivas no emiten señales: se invalida la caché del menú a mano
+        if nuevos or actualizados:
+            referencia.invalidar('menu')
+
+
+def sincronizar(completa=False, lote=500):
+    """
+    Trae de M1 los platos nuevos o modificados y los aplica a Plato con escrituras masivas
+
+    Args:
+        completa: Ignora el ETag y la fecha de la última sincronización y trae todo el catálogo
+        lote: Filas por sentencia de bulk_create / bulk_update
+
+    Returns:
+        dict: {'success': bool, 'message': str,
+               'data': {'creados', 'actualizados', 'sin_cambios', 'conflictos', 'sin_id_m1', 'recibidos', 'segundos'}}
+    """
+    comienzo = time.perf_counter()
+    estado, _ = SincronizacionM1.objects.get_or_create(recurso=RECURSO)
+    # La marca se toma antes de la consulta: lo modificado durante la descarga vuelve en la próxima
+    inicio = timezone.now()
+
+    resultado = menu_api.obtener_menu(
+        etag=None if completa else estado.etag or None,
+        actualizado_desde=None if completa else estado.actualizado_hasta,
+    )
+    if not resultado['success']:
+        return resultado
+
+    platos_m1 = resultado['data']['platos']
+    nuevos, actualizados = [], []
+    contadores = {'sin_cambios': 0, 'conflictos': 0}
+    if platos_m1:
+        locales = Plato.objects.only('id', 'nombre', 'precio', 'plato_id_m1')
+        nuevos, actualizados, contadores = _conciliar(platos_m1, locales)
+
+    datos = {
+        'creados': len(nuevos),
+        'actualizados': len(actualizados),
+        **contadores,
+        'recibidos': len(platos_m1),
+    }
+    estado.etag = resultado['data']['etag'] or ''
+    estado.actualizado_hasta = inicio
+    _guardar(estado, nuevos, actualizados, lote)
+
+    datos['sin_id_m1'] = Plato.objects.filter(plato_id_m1__isnull=True).count()
+    datos['segundos'] = round(time.perf_counter() - comienzo, 3)
+    SincronizacionM1.objects.filter(id=estado.id).update(resultado=datos)
+
+    if resultado['data']['sin_cambios']:
+        mensaje = 'El menú de M1 no cambió'
+    else:
+        mensaje = (
+            f"{datos['creados']} creados, {datos['actualizados']} actualizados, "
+            f"{datos['conflictos']} conflictos, {datos['sin_id_m1']} platos locales sin ID de M1"
+        )
+    logger.info(f"Sincronización del menú M1: {mensaje} ({datos['segundos']}s)")
+    return {'success': True, 'message': mensaje, 'data': datos}
@@ -0,0 +1,81 @@
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from .models import Mesas, Pedidos
+
+
+def _otros_pedidos_activos(excluir_pedido=None):
+    activos = Pedidos.objects.filter(mesa=OuterRef('pk'), estado__in=Pedidos.ESTADOS_ACTIVOS)
+    if excluir_pedido is not None:
+        activos = activos.exclude(id=excluir_pedido)
+    return Exists(activos)
+
+
+def _liberables(mesa_id, excluir_pedido=None):
+    return Mesas.objects.filter(id=mesa_id, ocupada=True).exclude(_otros_pedidos_activos(excluir_pedido))
+
+
+def ocupar(mesa_id, desde=None):
+    """
+    Ocupa la mesa solo si está libre, con un único UPDATE ... WHERE ocupada = false
+
+    Si dos meseros intentan ocupar la misma mesa a la vez, la base de datos
+    serializa los UPDATE y solo uno de ellos afecta la fila.
+
+    Args:
+        mesa_id: ID de la mesa
+        desde: Inicio de la ocupación (por defecto ahora); los pedidos de esta
+               ocupación lo guardan en ocupacion_mesa para armar su cuenta
+
+    Returns:
+        bool: True si esta llamada ocupó la mesa
+    """
+    return bool(
+        Mesas.objects.filter(id=mesa_id, ocupada=False)
+        .update(ocupada=True, ocupada_desde=desde or timezone.now())
+    )
+
+
+def liberar(mesa_id, excluir_pedido=None):
+    """
+    Libera la mesa si no le queda ningún otro pedido activo, en un único UPDATE
+
+    Args:
+        mesa_id: ID de la mesa
+        excluir_pedido: ID del pedido que se está cerrando o moviendo de mesa (opcional)
+
+    Returns:
+        bool: True si la mesa quedó libre por esta llamada
+    """
+    return bool(_liberables(mesa_id, excluir_pedido).update(ocupada=False))
+
+
+async def aliberar(mesa_id, excluir_pedido=None):
+    """
+    Versión async de liberar
+    """
+    return bool(await _liberables(mesa_id, excluir_pedido).aupdate(ocupada=False))
+
+
+def existe(mesa_id):
+    return Mesas.objects.filter(id=mesa_id).exists()
+
+
+def con_ocupacion(mesas_referencia, incluir=None):
+    """
+    Completa las mesas de la caché de referencia con su ocupación actual
+
+    La ocupación cambia con cada pedido, así que no forma parte de los datos de
+    referencia (que se invalidan solo al editar una mesa): se lee en una consulta.
+
+    Args:
+        mesas_referencia: referencia.obtener('mesas')['mesas']
+        incluir: ID de una mesa a listar aunque esté ocupada (la del pedido que se edita)
+
+    Returns:
+        list: Las mesas libres (y la incluida), como dict con 'id', 'numero', 'ubicacion' y 'ocupada'
+    """
+    ocupadas = set(Mesas.objects.filter(ocupada=True).values_list('id', flat=True))
+    return [
+        {**mesa, 'ocupada': mesa['id'] in ocupadas}
+        for mesa in mesas_referencia if mesa['id'] not in ocupadas or mesa['id'] == incluir
+    ]
@@ -0,0 +1,335 @@
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores (segundos) de los buckets de los histogramas de latencia
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Métricas registradas por los procesos: nombre -> (tipo, descripción)
+METRICAS = {
+    'pedidos_http_duracion_segundos': (
+        'histogram', 'Latencia de las vistas por ruta, método y código de respuesta',
+    ),
+    'pedidos_m1_duracion_segundos': (
+        'histogram', 'Latencia de las llamadas a M1 por operación y resultado (ok, error_http, timeout, conexion, error)',
+    ),
+    'pedidos_m1_coalescedor_lotes_total': (
+        'counter', 'Lotes de validaciones de stock enviados por el coalescedor',
+    ),
+    'pedidos_m1_coalescedor_solicitudes_total': (
+        'counter', 'Validaciones de stock agrupadas por el coalescedor',
+    ),
+    'pedidos_m1_coalescedor_lote_tamano': (
+        'histogram', 'Validaciones de stock por lote enviado a M1',
+    ),
+    'pedidos_m1_coalescedor_espera_segundos': (
+        'histogram', 'Espera de cada validación en el coalescedor hasta el envío de su lote',
+    ),
+}
+
+# Histogramas cuyos valores no encajan en BUCKETS_SEGUNDOS
+BUCKETS_POR_METRICA = {
+    'pedidos_m1_coalescedor_lote_tamano': (1, 2, 3, 5, 10, 20, 50),
+    'pedidos_m1_coalescedor_espera_segundos': (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+}
+
+
+def _buckets(nombre):
+    return BUCKETS_POR_METRICA.get(nombre, BUCKETS_SEGUNDOS)
+
+
+# Series de los procesos terminados, sumadas por _Registro._plegar_terminados
+ACUMULADO = 'acumulado.json'
+
+
+def _proceso_vivo(pid):
+    if os.name == 'nt':
+        return True  # os.kill terminaría el proceso en Windows: no se pliegan sus archivos
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Existe, pero es de otro usuario
+    return True
+
+
+def _sumar(total, volcado):
+    for nombre, etiquetas, valores in volcado:
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        acumulado = total.setdefault(clave, [0] * len(valores))
+        if len(acumulado) != len(valores):
+            continue  # Volcado con otros buckets (versión anterior del código)
+        for i, valor in enumerate(valores):
+            acumulado[i] += valor
+
+
+def _leer_json(ruta, defecto):
+    try:
+        return json.loads(ruta.read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return defecto
+
+
+def _escribir_json(ruta, datos):
+    # Reemplazo atómico: los lectores ven el archivo anterior o el nuevo, nunca uno a medias
+    temporal = ruta.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+    temporal.write_text(json.dumps(datos), encoding='utf-8')
+    os.replace(temporal, ruta)
+
+
+class _Registro:
+    """
+    Contadores e histogramas del proceso, volcados periódicamente a un archivo propio
+
+    Registrar un valor solo toma un lock y suma en memoria. Como máximo una vez cada
+    METRICAS_INTERVALO_ESCRITURA_S segundos, el hilo que registra escribe el estado
+    completo del proceso en METRICAS_DIR/proceso-<pid>-<inicio>.json; /metrics suma los
+    archivos de todos los procesos (gunicorn, uvicorn, run_worker) al exponerlos.
+
+    El inicio en el nombre evita que un proceso nuevo que reutiliza el PID pise el
+    archivo de uno terminado (los contadores retrocederían). Los archivos de procesos
+    terminados se suman a METRICAS_DIR/acumulado.json y se eliminan.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}  # (nombre, etiquetas) -> [buckets..., suma, cuenta] o [valor]
+        self._identificar()
+        self._ultima_escritura = time.monotonic()
+
+    def _identificar(self):
+        self._pid = os.getpid()
+        self._inicio = time.time_ns() // 1_000_000
+
+    def _verificar_fork(self):
+        # Tras un fork el hijo no hereda los valores del padre (el padre los sigue publicando)
+        if self._pid != os.getpid():
+            self._series = {}
+            self._identificar()
+
+    def _serie(self, nombre, etiquetas, tamano):
+        self._verificar_fork()
+        clave = (nombre, tuple(sorted((etiqueta, str(valor)) for etiqueta, valor in etiquetas.items())))
+        serie = self._series.get(clave)
+        if serie is None:
+            serie = self._series[clave] = [0] * tamano
+        return serie
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        with self._lock:
+            self._serie(nombre, etiquetas, 1)[0] += valor
+        self._volcar_si_corresponde()
+
+    def observar(self, nombre, valor, **etiquetas):
+        buckets = _buckets(nombre)
+        with self._lock:
+            serie = self._serie(nombre, etiquetas, len(buckets) + 3)
+            serie[bisect_left(buckets, valor)] += 1  # El último bucket es +Inf
+            serie[-2] += valor
+            serie[-1] += 1
+        self._volcar_si_corresponde()
+
+    def _volcar_si_corresponde(self):
+        intervalo = getattr(settings, 'METRICAS_INTERVALO_ESCRITURA_S', 1)
+        if time.monotonic() - self._ultima_escritura >= intervalo:
+            self.volcar()
+
+    def volcar(self):
+        """
+        Escribe el estado del proceso en su archivo (reemplazo atómico, sin bloquear a los lectores)
+        """
+        directorio = getattr(settings, 'METRICAS_DIR', None)
+        with self._lock:
+            self._verificar_fork()
+            self._ultima_escritura = time.monotonic()
+            if not directorio or not self._series:
+                return
+            series = [[nombre, dict(etiquetas), list(valores)] for (nombre, etiquetas), valores in self._series.items()]
+            nombre_archivo = f'proceso-{self._pid}-{self._inicio}.json'
+        destino = Path(directorio) / nombre_archivo
+        try:
+            destino.parent.mkdir(parents=True, exist_ok=True)
+            _escribir_json(destino, series)
+        except OSError as e:
+            logger.warning(f"No se pudieron guardar las métricas del proceso en {directorio}: {e}")
+
+    def _terminados(self, base):
+        """
+        Archivos de procesos que ya no existen, o cuyo PID reutiliza un proceso más nuevo
+        """
+        procesos = []
+        for ruta in base.glob('proceso-*.json'):
+            partes = ruta.stem.split('-')[1:]
+            try:
+                # Los archivos proceso-<pid>.json de versiones anteriores no tienen inicio
+                procesos.append((int(partes[0]), int(partes[1]) if len(partes) > 1 else 0, ruta))
+            except (IndexError, ValueError):
+                continue
+        ultimo_inicio = {}
+        for pid, inicio, _ in procesos:
+            ultimo_inicio[pid] = max(inicio, ultimo_inicio.get(pid, inicio))
+        return [
+            ruta for pid, inicio, ruta in procesos
+            if (pid, inicio) != (self._pid, self._inicio)
+            and (inicio < ultimo_inicio[pid] or not _proceso_vivo(pid))
+        ]
+
+    def _plegar_terminados(self, base):
+        """
+        Suma los archivos de procesos terminados a acumulado.json y los elimina
+
+        acumulado.json registra qué archivos ya sumó: si el proceso se corta antes de
+        eliminarlos, los lectores los ignoran y el siguiente plegado los elimina.
+        Un archivo de bloqueo (O_EXCL) evita que dos procesos plieguen a la vez.
+        """
+        terminados = self._terminados(base)
+        if not terminados:
+            return
+        bloqueo = base / '.plegando'
+        try:
+            os.close(os.open(bloqueo, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            # Otro proceso está plegando; un bloqueo abandonado se libera al minuto
+            if time.time() - bloqueo.stat().st_mtime > 60:
+                bloqueo.unlink(missing_ok=True)
+            return
+        try:
+            acumulado = _leer_json(base / ACUMULADO, {'series': [], 'plegados': []})
+            plegados = {nombre for nombre in acumulado['plegados'] if (base / nombre).exists()}
+            total = {}
+            _sumar(total, acumulado['series'])
+            for ruta in terminados:
+                if ruta.name not in plegados:
+                    _sumar(total, _leer_json(ruta, []))
+                    plegados.add(ruta.name)
+            _escribir_json(base / ACUMULADO, {
+                'series': [[nombre, dict(etiquetas), valores] for (nombre, etiquetas), valores in total.items()],
+                'plegados': sorted(plegados),
+            })
+            for nombre in plegados:
+                (base / nombre).unlink(missing_ok=True)
+        finally:
+            bloqueo.unlink(missing_ok=True)
+
+    def series(self):
+        """
+        Suma las series de todos los procesos; sin METRICAS_DIR solo las del proceso actual
+        """
+        self.volcar()
+        directorio = getattr(settings, 'METRICAS_DIR', None)
+        total = {}
+        if not directorio:
+            with self._lock:
+                _sumar(total, [[nombre, dict(etiquetas), list(valores)] for (nombre, etiquetas), valores in self._series.items()])
+            return total
+
+        base = Path(directorio)
+        try:
+            self._plegar_terminados(base)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"No se pudieron plegar las métricas de procesos terminados: {e}")
+        # Primero los archivos de los procesos y después el acumulado: si otro proceso
+        # pliega en el medio, el acumulado nuevo ya lista lo que falte de los archivos
+        volcados = {}
+        for archivo in base.glob('proceso-*.json'):
+            try:
+                volcados[archivo.name] = _leer_json(archivo, [])
+            except (OSError, ValueError):
+                continue
+        try:
+            acumulado = _leer_json(base / ACUMULADO, {'series': [], 'plegados': []})
+        except (OSError, ValueError):
+            acumulado = {'series': [], 'plegados': []}
+        _sumar(total, acumulado['series'])
+        for nombre, volcado in volcados.items():
+            if nombre not in acumulado['plegados']:  # Los plegados ya están en el acumulado
+                _sumar(total, volcado)
+        return total
+
+
+_registro = _Registro()
+atexit.register(_registro.volcar)
+
+
+def descartar():
+    """
+    Descarta lo registrado por el proceso sin volcarlo (al terminar las pruebas, antes del volcado de atexit)
+    """
+    with _registro._lock:
+        _registro._series = {}
+
+
+def incrementar(nombre, valor=1, **etiquetas):
+    """
+    Suma `valor` al contador `nombre` con las etiquetas dadas
+    """
+    _registro.incrementar(nombre, valor, **etiquetas)
+
+
+def observar(nombre, valor, **etiquetas):
+    """
+    Registra un valor (por defecto, una duración en segundos) en el histograma `nombre` con las etiquetas dadas
+    """
+    _registro.observar(nombre, valor, **etiquetas)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas(etiquetas):
+    if not etiquetas:
+        return ''
+    return '{' + ','.join(f'{clave}="{_escapar(valor)}"' for clave, valor in etiquetas) + '}'
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def exponer(indicadores=None):
+    """
+    Genera el texto de /metrics en el formato de exposición de Prometheus
+
+    Args:
+        indicadores: Gauges calculados al momento de exponer, con estructura
+                     {nombre: (descripción, [(etiquetas_dict, valor), ...])}
+
+    Returns:
+        str: Métricas en formato de texto 0.0.4
+    """
+    por_metrica = {}
+    for (nombre, etiquetas), valores in sorted(_registro.series().items()):
+        por_metrica.setdefault(nombre, []).append((etiquetas, valores))
+
+    lineas = []
+    for nombre, series in por_metrica.items():
+        tipo, descripcion = METRICAS.get(nombre, ('untyped', nombre))
+        lineas.append(f'# HELP {nombre} {descripcion}')
+        lineas.append(f'# TYPE {nombre} {tipo}')
+        for etiquetas, valores in series:
+            if tipo != 'histogram':
+                lineas.append(f'{nombre}{_etiquetas(etiquetas)} {_numero(valores[0])}')
+                continue
+            acumulado = 0
+            for limite, cantidad in zip(_buckets(nombre) + ('+Inf',), valores[:-2]):
+                acumulado += cantidad
+                lineas.append(f'{nombre}_bucket{_etiquetas(etiquetas + (("le", limite),))} {acumulado}')
+            lineas.append(f'{nombre}_sum{_etiquetas(etiquetas)} {_numero(valores[-2])}')
+            lineas.append(f'{nombre}_count{_etiquetas(etiquetas)} {valores[-1]}')
+
+    for nombre, (descripcion, muestras) in (indicadores or {}).items():
+        lineas.append(f'# HELP {nombre} {descripcion}')
+        lineas.append(f'# TYPE {nombre} gauge')
+        for etiquetas, valor in muestras:
+            lineas.append(f'{nombre}{_etiquetas(sorted(etiquetas.items()))} {_numero(valor)}')
+
+    return '\n'.join(lineas) + '\n'
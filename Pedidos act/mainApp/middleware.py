@@ -0,0 +1,169 @@
+import re
+import time
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from . import metricas
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Listas de parámetros (IN (%s, %s, ...)) y números literales no cambian la forma de la consulta
+_LISTA_PARAMETROS = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+_NUMERO = re.compile(r'\b\d+\b')
+_TABLA = re.compile(r'\bFROM\s+"?(\w+)"?', re.IGNORECASE)
+
+
+def huella(sql):
+    """
+    Forma de una consulta sin sus valores: dos ejecuciones con la misma huella difieren solo en los parámetros
+    """
+    return _NUMERO.sub('?', _LISTA_PARAMETROS.sub('(...)', sql))
+
+
+class _RegistroConsultas:
+    """
+    Envoltura de ejecución (connection.execute_wrapper) que cuenta y cronometra cada consulta
+    """
+    def __init__(self):
+        self.consultas = 0
+        self.segundos = 0.0
+        self.huellas = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if not sql.startswith(('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')):
+                self.consultas += 1
+                self.segundos += time.perf_counter() - inicio
+                forma = huella(sql)
+                self.huellas[forma] = self.huellas.get(forma, 0) + 1
+
+    def repetidas(self, umbral):
+        """
+        Huellas ejecutadas más de `umbral` veces en la solicitud (típico N+1), de la más repetida a la menos
+        """
+        return sorted(
+            ((forma, veces) for forma, veces in self.huellas.items() if veces > umbral),
+            key=lambda item: item[1], reverse=True,
+        )
+
+
+class InstrumentacionSQLMiddleware:
+    """
+    Mide las consultas SQL de cada solicitud y las informa en el encabezado Server-Timing
+
+    Opcional: solo se activa con SQL_INSTRUMENTACION_HABILITADA. Registra en el log
+    las solicitudes que superan SQL_PRESUPUESTO_CONSULTAS o SQL_PRESUPUESTO_MS y
+    las consultas con la misma forma repetidas más de SQL_REPETICIONES_MAXIMAS veces.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SQL_INSTRUMENTACION_HABILITADA', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.presupuesto_consultas = getattr(settings, 'SQL_PRESUPUESTO_CONSULTAS', 30)
+        self.presupuesto_ms = getattr(settings, 'SQL_PRESUPUESTO_MS', 200)
+        self.repeticiones_maximas = getattr(settings, 'SQL_REPETICIONES_MAXIMAS', 5)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        registro = _RegistroConsultas()
+        inicio = time.perf_counter()
+        with ExitStack() as pila:
+            self._instalar(pila, registro)
+            response = self.get_response(request)
+        return self._informar(request, response, registro, inicio)
+
+    async def __acall__(self, request):
+        # Las vistas async consultan la base desde el hilo de sync_to_async de la
+        # solicitud: la envoltura se instala y se quita en ese mismo hilo
+        registro = _RegistroConsultas()
+        inicio = time.perf_counter()
+        pila = ExitStack()
+        await sync_to_async(self._instalar)(pila, registro)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(pila.close)()
+        return self._informar(request, response, registro, inicio)
+
+    @staticmethod
+    def _instalar(pila, registro):
+        for alias in connections:
+            pila.enter_context(connections[alias].execute_wrapper(registro))
+
+    def _informar(self, request, response, registro, inicio):
+        total_ms = (time.perf_counter() - inicio) * 1000
+        sql_ms = registro.segundos * 1000
+        repetidas = registro.repetidas(self.repeticiones_maximas)
+
+        entradas = [
+            f'sql;dur={sql_ms:.1f};desc="{registro.consultas} consultas"',
+            f'app;dur={total_ms:.1f}',
+        ]
+        if repetidas:
+            forma, veces = repetidas[0]
+            tabla = _TABLA.search(forma)
+            entradas.append(f'sql-repetidas;desc="{tabla.group(1) if tabla else "consulta"} x{veces}"')
+        # Las respuestas por streaming solo miden hasta el primer byte
+        response['Server-Timing'] = ', '.join(entradas)
+
+        if registro.consultas > self.presupuesto_consultas or sql_ms > self.presupuesto_ms:
+            logger.warning(
+                f"{request.method} {request.path}: {registro.consultas} consultas en {sql_ms:.1f} ms "
+                f"(presupuesto: {self.presupuesto_consultas} consultas, {self.presupuesto_ms} ms)"
+            )
+        for forma, veces in repetidas:
+            logger.warning(f"{request.method} {request.path}: posible N+1, {veces} veces: {forma[:300]}")
+        return response
+
+
+class MetricasMiddleware:
+    """
+    Registra la latencia de cada solicitud en el histograma pedidos_http_duracion_segundos
+
+    Las etiquetas usan el nombre de la ruta (no la URL) para no crear una serie por ID
+    de pedido o de mesa. Se desactiva con METRICAS_HABILITADAS = False.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICAS_HABILITADAS', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        inicio = time.perf_counter()
+        response = self.get_response(request)
+        self._registrar(request, response, inicio)
+        return response
+
+    async def __acall__(self, request):
+        inicio = time.perf_counter()
+        response = await self.get_response(request)
+        self._registrar(request, response, inicio)
+        return response
+
+    @staticmethod
+    def _registrar(request, response, inicio):
+        # Igual que en Server-Timing, las respuestas por streaming se miden hasta el primer byte
+        vista = request.resolver_match.view_name if request.resolver_match else 'sin_ruta'
+        metricas.observar(
+            'pedidos_http_duracion_segundos', time.perf_counter() - inicio,
+            vista=vista, metodo=request.method, codigo=response.status_code,
+        )
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-18 03:59
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+
+def calcular_totales(apps, schema_editor):
+    Pedidos = apps.get_model('mainApp', 'Pedidos')
+    DetallePedido = apps.get_model('mainApp', 'DetallePedido')
+    centavos = Decimal('0.01')
+
+    netos = {}
+    for pedido_id, cantidad, precio in DetallePedido.objects.values_list('pedido_id', 'cantidad', 'plato__precio').iterator():
+        netos[pedido_id] = netos.get(pedido_id, Decimal('0')) + cantidad * precio
+
+    pedidos = []
+    for pedido in Pedidos.objects.only('id', 'descuento_porcentaje').iterator():
+        neto = netos.get(pedido.id, Decimal('0')).quantize(centavos, rounding=ROUND_HALF_UP)
+        pedido.total_neto = neto
+        pedido.total_final = (neto - neto * pedido.descuento_porcentaje / 100).quantize(centavos, rounding=ROUND_HALF_UP)
+        pedidos.append(pedido)
+    Pedidos.objects.bulk_update(pedidos, ['total_neto', 'total_final'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainApp', '0006_pedidos_stock_consumido_pedidos_stock_validado_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedidos',
+            name='total_final',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Total Final'),
+        ),
+        migrations.AddField(
+            model_name='pedidos',
+            name='total_neto',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Total Neto'),
+        ),
+        migrations.RunPython(calcular_totales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainApp', '0008_tareas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockPlatoM1',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plato_id_m1', models.IntegerField(unique=True, verbose_name='ID Plato en M1')),
+                ('disponible', models.IntegerField(default=0, verbose_name='Disponible')),
+                ('actualizado_en', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Actualizado En')),
+            ],
+            options={
+                'verbose_name': 'Stock de Plato (M1)',
+                'verbose_name_plural': 'Stock de Platos (M1)',
+            },
+        ),
+    ]
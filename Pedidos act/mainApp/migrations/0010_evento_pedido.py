@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainApp', '0009_stock_plato_m1'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoPedido',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=30, verbose_name='Tipo')),
+                ('pedido_id', models.BigIntegerField(verbose_name='ID Pedido')),
+                ('mesa_id', models.BigIntegerField(blank=True, null=True, verbose_name='ID Mesa')),
+                ('mesero_id', models.BigIntegerField(blank=True, null=True, verbose_name='ID Mesero')),
+                ('estado', models.CharField(blank=True, max_length=20, verbose_name='Estado')),
+                ('datos', models.JSONField(blank=True, default=dict, verbose_name='Datos')),
+                ('fecha', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Fecha')),
+            ],
+            options={
+                'verbose_name': 'Evento de Pedido',
+                'verbose_name_plural': 'Eventos de Pedidos',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainApp', '0010_evento_pedido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeneracionCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=30, unique=True, verbose_name='Clave')),
+                ('generacion', models.PositiveBigIntegerField(default=0, verbose_name='Generación')),
+            ],
+            options={
+                'verbose_name': 'Generación de Caché',
+                'verbose_name_plural': 'Generaciones de Caché',
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainApp', '0011_generacion_cache'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pedidos',
+            index=models.Index(fields=['-fecha_creacion', '-id'], name='pedido_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedidos',
+            index=models.Index(fields=['estado', '-fecha_creacion', '-id'], name='pedido_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedidos',
+            index=models.Index(fields=['mesero', '-fecha_creacion', '-id'], name='pedido_mesero_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedidos',
+            index=models.Index(condition=models.Q(('estado', 'entregado'), _negated=True), fields=['mesa', '-fecha_creacion'], name='pedido_mesa_abierto_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedidos',
+            index=models.Index(condition=models.Q(('estado__in', ['pendiente', 'validando_stock', 'en_elaboracion', 'enviado_cocina', 'listo'])), fields=['mesa'], name='pedido_mesa_activo_idx'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainApp', '0012_indices_pedidos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VentaDiariaMesero',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('ingresos', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Ingresos')),
+                ('unidades', models.PositiveIntegerField(default=0, verbose_name='Unidades')),
+                ('descuento', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Descuento')),
+                ('pedidos', models.PositiveIntegerField(default=0, verbose_name='Pedidos')),
+                ('mesero_id', models.BigIntegerField(default=0, verbose_name='ID Mesero')),
+            ],
+            options={
+                'verbose_name': 'Venta Diaria por Mesero',
+                'verbose_name_plural': 'Ventas Diarias por Mesero',
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'mesero_id'), name='venta_mesero_unica')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VentaDiariaPlato',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('ingresos', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Ingresos')),
+                ('unidades', models.PositiveIntegerField(default=0, verbose_name='Unidades')),
+                ('descuento', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Descuento')),
+                ('pedidos', models.PositiveIntegerField(default=0, verbose_name='Pedidos')),
+                ('plato_id', models.BigIntegerField(verbose_name='ID Plato')),
+                ('plato_nombre', models.CharField(max_length=100, verbose_name='Plato')),
+            ],
+            options={
+                'verbose_name': 'Venta Diaria por Plato',
+                'verbose_name_plural': 'Ventas Diarias por Plato',
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'plato_id'), name='venta_plato_unica')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VentaHoraria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('ingresos', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Ingresos')),
+                ('unidades', models.PositiveIntegerField(default=0, verbose_name='Unidades')),
+                ('descuento', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Descuento')),
+                ('pedidos', models.PositiveIntegerField(default=0, verbose_name='Pedidos')),
+                ('hora', models.PositiveSmallIntegerField(verbose_name='Hora')),
+            ],
+            options={
+                'verbose_name': 'Venta por Hora',
+                'verbose_name_plural': 'Ventas por Hora',
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'hora'), name='venta_hora_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainApp', '0013_ventas_agregadas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SincronizacionM1',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recurso', models.CharField(max_length=30, unique=True, verbose_name='Recurso')),
+                ('etag', models.CharField(blank=True, max_length=200, verbose_name='ETag')),
+                ('actualizado_hasta', models.DateTimeField(blank=True, null=True, verbose_name='Actualizado Hasta')),
+                ('resultado', models.JSONField(blank=True, default=dict, verbose_name='Último Resultado')),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True, verbose_name='Última Ejecución')),
+            ],
+            options={
+                'verbose_name': 'Sincronización con M1',
+                'verbose_name_plural': 'Sincronizaciones con M1',
+            },
+        ),
+    ]
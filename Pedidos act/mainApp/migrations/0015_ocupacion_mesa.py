@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:48
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def ocupaciones_actuales(apps, schema_editor):
+    """
+    Abre una ocupación para cada mesa ocupada y le asigna sus pedidos activos
+
+    Los pedidos anteriores quedan sin ocupación y fuera de las cuentas.
+    """
+    Mesas = apps.get_model('mainApp', 'Mesas')
+    Pedidos = apps.get_model('mainApp', 'Pedidos')
+    ahora = timezone.now()
+    mesas = list(Mesas.objects.filter(ocupada=True).values_list('id', flat=True))
+    Mesas.objects.filter(id__in=mesas).update(ocupada_desde=ahora)
+    Pedidos.objects.filter(
+        mesa_id__in=mesas, estado__in=['pendiente', 'validando_stock', 'en_elaboracion', 'enviado_cocina', 'listo']
+    ).update(ocupacion_mesa=ahora)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainApp', '0014_sincronizacion_m1'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mesas',
+            name='ocupada_desde',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Ocupada desde'),
+        ),
+        migrations.AddField(
+            model_name='pedidos',
+            name='ocupacion_mesa',
+            field=models.DateTimeField(blank=True, help_text='Mesas.ocupada_desde de la ocupación a la que pertenece el pedido (agrupa la cuenta)', null=True, verbose_name='Ocupación de la Mesa'),
+        ),
+        migrations.AddIndex(
+            model_name='pedidos',
+            index=models.Index(fields=['mesa', 'ocupacion_mesa'], name='pedido_mesa_ocupacion_idx'),
+        ),
+        migrations.RunPython(ocupaciones_actuales, migrations.RunPython.noop),
+    ]
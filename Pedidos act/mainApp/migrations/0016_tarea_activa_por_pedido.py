@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:49
+
+from django.db import migrations, models
+
+
+def descartar_duplicadas(apps, schema_editor):
+    """
+    Deja activa solo la tarea más antigua de cada (pedido, tipo) antes de crear la restricción
+    """
+    Tarea = apps.get_model('mainApp', 'Tarea')
+    vistas = set()
+    duplicadas = []
+    activas = Tarea.objects.filter(estado__in=['pendiente', 'en_proceso'], pedido__isnull=False)
+    for tarea_id, pedido_id, tipo in activas.order_by('id').values_list('id', 'pedido_id', 'tipo'):
+        if (pedido_id, tipo) in vistas:
+            duplicadas.append(tarea_id)
+        vistas.add((pedido_id, tipo))
+    Tarea.objects.filter(id__in=duplicadas).update(estado='fallida', ultimo_error='Tarea duplicada')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainApp', '0015_ocupacion_mesa'),
+    ]
+
+    operations = [
+        migrations.RunPython(descartar_duplicadas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='tarea',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado__in', ['pendiente', 'en_proceso'])), fields=('pedido', 'tipo'), name='tarea_activa_por_pedido'),
+        ),
+    ]
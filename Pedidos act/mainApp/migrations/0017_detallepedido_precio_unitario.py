@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def precios_actuales(apps, schema_editor):
+    """
+    Completa el precio de las líneas existentes con el precio actual de su plato
+    """
+    DetallePedido = apps.get_model('mainApp', 'DetallePedido')
+    Plato = apps.get_model('mainApp', 'Plato')
+    DetallePedido.objects.update(
+        precio_unitario=Subquery(Plato.objects.filter(id=OuterRef('plato_id')).values('precio')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainApp', '0016_tarea_activa_por_pedido'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detallepedido',
+            name='precio_unitario',
+            field=models.DecimalField(decimal_places=2, max_digits=7, null=True, verbose_name='Precio unitario'),
+        ),
+        migrations.RunPython(precios_actuales, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='detallepedido',
+            name='precio_unitario',
+            field=models.DecimalField(decimal_places=2, max_digits=7, verbose_name='Precio unitario'),
+        ),
+    ]
@@ -1,8 +1,33 @@
-from django.db import models
-from django.db.models.signals import post_delete
+from django.db import models, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
+from django.utils import timezone
+from contextlib import contextmanager
 from datetime import timedelta 
+from decimal import Decimal, ROUND_HALF_UP
+from .bloqueos import reintentar_si_bloqueada
+import threading
+
+CENTAVOS = Decimal('0.01')
+
+_recalculo_totales = threading.local()
+
+
+@contextmanager
+def totales_diferidos():
+    """
+    Suspende el recálculo de totales por señal dentro del bloque.
+    Quien lo usa debe llamar a Pedidos.recalcular_totales() al terminar.
+    """
+    anterior = getattr(_recalculo_totales, 'diferido', False)
+    _recalculo_totales.diferido = True
+    try:
+        yield
+    finally:
+        _recalculo_totales.diferido = anterior
+
 
 class Plato(models.Model):
     nombre = models.CharField(max_length=100, unique=True, verbose_name="Nombre del Plato")
@@ -21,14 +46,22 @@ class DetallePedido(models.Model):
     pedido = models.ForeignKey('Pedidos', on_delete=models.CASCADE, related_name='detalles', verbose_name="Pedido")
     plato = models.ForeignKey(Plato, on_delete=models.PROTECT, verbose_name="Plato")
     cantidad = models.PositiveIntegerField(default=1, verbose_name="Cantidad")
+    # Precio del plato al agregar la línea: un cambio de precio posterior (edición o
+    # sincronización con M1) no altera los pedidos ya tomados ni sus totales
+    precio_unitario = models.DecimalField(max_digits=7, decimal_places=2, verbose_name="Precio unitario")
 
     class Meta:
         verbose_name = "Detalle del Pedido"
         verbose_name_plural = "Detalles del Pedido"
         unique_together = ('pedido', 'plato')
 
+    def save(self, *args, **kwargs):
+        if self.precio_unitario is None:
+            self.precio_unitario = self.plato.precio
+        super().save(*args, **kwargs)
+
     def subtotal(self):
-        return self.cantidad * self.plato.precio
+        return self.cantidad * self.precio_unitario
 
     def __str__(self):
         return f"{self.cantidad} x {self.plato.nombre} para Pedido #{self.pedido.id}"
@@ -37,6 +70,8 @@ class DetallePedido(models.Model):
 class Mesas(models.Model):
     numero = models.CharField(max_length=10, unique=True, verbose_name="Número de Mesa")
     ocupada = models.BooleanField(default=False, verbose_name="Ocupada")
+    # Inicio de la ocupación actual (o de la última): identifica la cuenta de la mesa
+    ocupada_desde = models.DateTimeField(null=True, blank=True, verbose_name="Ocupada desde")
     ubicacion = models.CharField(max_length=100, verbose_name="Ubicación en el Restaurante")
 
     class Meta:
@@ -59,6 +94,9 @@ class Pedidos(models.Model):
         ('cancelado', 'Cancelado'),
     ]
 
+    # Estados que todavía requieren atención del personal (vista por defecto del tablero)
+    ESTADOS_ACTIVOS = ['pendiente', 'validando_stock', 'en_elaboracion', 'enviado_cocina', 'listo']
+
     nombre = models.CharField(max_length=100, verbose_name="Nombre del Cliente")
     mesa = models.ForeignKey(Mesas, on_delete=models.CASCADE, verbose_name="Mesa")
     mesero = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, verbose_name="Mesero")
@@ -77,17 +115,135 @@ class Pedidos(models.Model):
     timestamp_envio_cocina = models.DateTimeField(null=True, blank=True, verbose_name="Envío a Cocina") 
     timestamp_entrega = models.DateTimeField(null=True, blank=True, verbose_name="Fecha de Entrega")      
     reserva_stock_id = models.CharField(max_length=50, null=True, blank=True, verbose_name="ID Reserva M1") 
+    ocupacion_mesa = models.DateTimeField(
+        null=True, blank=True, verbose_name="Ocupación de la Mesa",
+        help_text="Mesas.ocupada_desde de la ocupación a la que pertenece el pedido (agrupa la cuenta)"
+    )
     
     descuento_porcentaje = models.DecimalField(max_digits=5, decimal_places=2, default=0, verbose_name="% Descuento")
     
     # ✅ Nuevos campos para control de stock con M1
     stock_validado = models.BooleanField(default=False, verbose_name="Stock Validado en M1")
     stock_consumido = models.BooleanField(default=False, verbose_name="Stock Consumido en M1")
-    
+
+    # ✅ Totales desnormalizados, mantenidos por recalcular_totales()
+    total_neto = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False, verbose_name="Total Neto")
+    total_final = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False, verbose_name="Total Final")
+
+    CAMPOS_TOTALES = ('total_neto', 'total_final')
+
     class Meta:
         verbose_name = "Pedido"
         verbose_name_plural = "Pedidos"
         ordering = ['-fecha_creacion']
+        # ✅ Índices de las consultas frecuentes (ver PlanConsultasTest en tests.py)
+        indexes = [
+            # Tablero: todos los pedidos, del más reciente al más antiguo (paginación por cursor)
+            models.Index(fields=['-fecha_creacion', '-id'], name='pedido_fecha_idx'),
+            # Tablero filtrado por estado (los activos son un IN sobre este índice) o por mesero
+            models.Index(fields=['estado', '-fecha_creacion', '-id'], name='pedido_estado_fecha_idx'),
+            models.Index(fields=['mesero', '-fecha_creacion', '-id'], name='pedido_mesero_fecha_idx'),
+            # Pedidos de una mesa sin entregar (pedidos_por_mesa)
+            models.Index(
+                fields=['mesa', '-fecha_creacion'],
+                name='pedido_mesa_abierto_idx',
+                condition=~models.Q(estado='entregado'),
+            ),
+            # Cuenta de la ocupación actual de una mesa (cuentas.py)
+            models.Index(fields=['mesa', 'ocupacion_mesa'], name='pedido_mesa_ocupacion_idx'),
+            # Pedidos activos de una mesa (liberación de mesas)
+            models.Index(
+                fields=['mesa'],
+                name='pedido_mesa_activo_idx',
+                condition=models.Q(estado__in=['pendiente', 'validando_stock', 'en_elaboracion', 'enviado_cocina', 'listo']),
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Se recuerda el descuento leído para detectar cambios en save()
+        instance._descuento_original = instance.__dict__.get('descuento_porcentaje')
+        return instance
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Una instancia cargada antes de modificar los detalles tiene totales
+            # desactualizados: un save() completo no debe sobrescribirlos.
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.CAMPOS_TOTALES
+            ]
+        descuento_original = getattr(self, '_descuento_original', None)
+        if descuento_original is None or descuento_original == self.descuento_porcentaje:
+            super().save(*args, **kwargs)
+            self._descuento_original = self.descuento_porcentaje
+            return
+
+        from . import ventas
+        # Un pedido ya entregado está en los acumulados de ventas: se ajustan con la diferencia
+        with ventas.ajustar_entregas([self.pk]):
+            super().save(*args, **kwargs)
+            totales = Pedidos.recalcular_totales([self.pk])
+            self.total_neto, self.total_final = totales.get(self.pk, (self.total_neto, self.total_final))
+        self._descuento_original = self.descuento_porcentaje
+
+    @staticmethod
+    def aplicar_descuento(total_neto, descuento_porcentaje):
+        """
+        Retorna el total final redondeado a centavos
+        """
+        descuento = Decimal(total_neto) * Decimal(descuento_porcentaje) / 100
+        return (Decimal(total_neto) - descuento).quantize(CENTAVOS, rounding=ROUND_HALF_UP)
+
+    @classmethod
+    def recalcular_totales(cls, pedido_ids, guardar=True, detalles_modificados=False):
+        """
+        Recalcula total_neto y total_final de los pedidos indicados a partir de sus detalles
+
+        Solo se escriben los pedidos cuyos totales cambiaron (o todos, si el llamador
+        modificó sus detalles), y solo a esos se les actualiza fecha_actualizacion:
+        es la versión de la página en el GET condicional y el reloj de cierre del archivo.
+
+        Args:
+            pedido_ids: Iterable de IDs de pedidos
+            guardar: Si es False solo calcula, sin escribir en la base de datos
+            detalles_modificados: True si el llamador agregó, cambió o quitó detalles
+
+        Returns:
+            dict: {pedido_id: (total_neto, total_final)}
+        """
+        pedido_ids = set(pedido_ids)
+        if not pedido_ids:
+            return {}
+
+        netos = dict(
+            DetallePedido.objects
+            .filter(pedido_id__in=pedido_ids)
+            .values('pedido_id')
+            .annotate(neto=Sum(
+                F('cantidad') * F('precio_unitario'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            ))
+            .values_list('pedido_id', 'neto')
+        )
+
+        pedidos = cls.objects.filter(id__in=pedido_ids).only('id', 'descuento_porcentaje', *cls.CAMPOS_TOTALES)
+        ahora = timezone.now()
+        totales = {}
+        modificados = []
+        for pedido in pedidos:
+            neto = Decimal(netos.get(pedido.id) or 0).quantize(CENTAVOS, rounding=ROUND_HALF_UP)
+            final = cls.aplicar_descuento(neto, pedido.descuento_porcentaje)
+            totales[pedido.id] = (neto, final)
+            if detalles_modificados or (pedido.total_neto, pedido.total_final) != (neto, final):
+                pedido.total_neto, pedido.total_final = neto, final
+                pedido.fecha_actualizacion = ahora  # bulk_update no aplica auto_now
+                modificados.append(pedido)
+
+        if guardar and modificados:
+            cls.objects.bulk_update(modificados, [*cls.CAMPOS_TOTALES, 'fecha_actualizacion'])
+        return totales
 
     def calcular_tiempo_total(self):
         if self.timestamp_entrega and self.fecha_creacion:
@@ -95,22 +251,34 @@ class Pedidos(models.Model):
         return timedelta(0)
 
     def calcular_total_neto(self):
-        total = sum(detalle.subtotal() for detalle in self.detalles.all())
-        return total
+        return self.total_neto
 
     def calcular_descuento_monto(self):
-        return self.calcular_total_neto() * (self.descuento_porcentaje / 100)
+        return self.total_neto - self.total_final
 
     def calcular_total_final(self):
-        return self.calcular_total_neto() - self.calcular_descuento_monto()
+        return self.total_final
 
     # ✅ Método helper para obtener platos en formato para M1
     def get_platos_para_m1(self):
         """
         Retorna los platos del pedido en formato para enviar a M1
         """
+        return self.platos_para_m1(self.detalles.select_related('plato'))
+
+    async def aget_platos_para_m1(self):
+        """
+        Versión async de get_platos_para_m1
+        """
+        return self.platos_para_m1([detalle async for detalle in self.detalles.select_related('plato')])
+
+    @staticmethod
+    def platos_para_m1(detalles):
+        """
+        Convierte detalles (con su plato cargado) al formato que espera M1
+        """
         platos = []
-        for detalle in self.detalles.all():
+        for detalle in detalles:
             if detalle.plato.plato_id_m1:  # Solo si tiene ID de M1
                 platos.append({
                     'plato_id': detalle.plato.plato_id_m1,
@@ -123,6 +291,225 @@ class Pedidos(models.Model):
 
 @receiver(post_delete, sender=Pedidos)
 def liberar_mesa(sender, instance, **kwargs):
-    if instance.mesa:
-        instance.mesa.ocupada = False
-        instance.mesa.save()
\ No newline at end of file
+    from .mesas import liberar
+    # Un pedido cerrado ya no ocupa la mesa (ej: al archivar pedidos entregados)
+    if instance.mesa_id and instance.estado in Pedidos.ESTADOS_ACTIVOS:
+        liberar(instance.mesa_id)
+
+@receiver(post_save, sender=DetallePedido)
+@receiver(post_delete, sender=DetallePedido)
+def actualizar_totales_pedido(sender, instance, origin=None, **kwargs):
+    # Al borrar el pedido completo sus detalles caen en cascada: no hay nada que recalcular
+    if isinstance(origin, Pedidos) or getattr(origin, 'model', None) is Pedidos:
+        return
+    if getattr(_recalculo_totales, 'diferido', False):
+        return
+    Pedidos.recalcular_totales([instance.pedido_id], detalles_modificados=True)
+
+class Tarea(models.Model):
+    """
+    Trabajo en segundo plano procesado por `manage.py run_worker`
+    """
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('en_proceso', 'En Proceso'),
+        ('completada', 'Completada'),
+        ('fallida', 'Fallida'),  # Agotó sus reintentos (dead-letter)
+    ]
+
+    tipo = models.CharField(max_length=50, verbose_name="Tipo")
+    payload = models.JSONField(default=dict, blank=True, verbose_name="Datos")
+    pedido = models.ForeignKey(Pedidos, on_delete=models.SET_NULL, null=True, blank=True, related_name='tareas', verbose_name="Pedido")
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente', verbose_name="Estado")
+
+    intentos = models.PositiveIntegerField(default=0, verbose_name="Intentos")
+    max_intentos = models.PositiveIntegerField(default=5, verbose_name="Máximo de Intentos")
+    disponible_desde = models.DateTimeField(default=timezone.now, verbose_name="Disponible Desde")
+    bloqueada_hasta = models.DateTimeField(null=True, blank=True, verbose_name="Bloqueada Hasta")
+    trabajador = models.CharField(max_length=100, blank=True, verbose_name="Trabajador")
+
+    resultado = models.JSONField(null=True, blank=True, verbose_name="Resultado")
+    ultimo_error = models.TextField(blank=True, verbose_name="Último Error")
+
+    fecha_creacion = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Creación")
+    fecha_actualizacion = models.DateTimeField(auto_now=True, verbose_name="Última Actualización")
+
+    class Meta:
+        verbose_name = "Tarea"
+        verbose_name_plural = "Tareas"
+        ordering = ['-fecha_creacion']
+        indexes = [
+            models.Index(fields=['estado', 'disponible_desde'], name='tarea_estado_disp_idx'),
+        ]
+        constraints = [
+            # Una sola tarea activa de cada tipo por pedido (tareas.encolar_para_pedido)
+            models.UniqueConstraint(
+                fields=['pedido', 'tipo'],
+                condition=models.Q(estado__in=['pendiente', 'en_proceso']),
+                name='tarea_activa_por_pedido',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Tarea #{self.id} - {self.tipo} ({self.get_estado_display()})"
+
+
+class StockPlatoM1(models.Model):
+    """
+    Copia local del stock informado por M1, usada para descartar platos agotados sin llamar a M1
+    """
+    plato_id_m1 = models.IntegerField(unique=True, verbose_name="ID Plato en M1")
+    disponible = models.IntegerField(default=0, verbose_name="Disponible")
+    actualizado_en = models.DateTimeField(default=timezone.now, verbose_name="Actualizado En")
+
+    class Meta:
+        verbose_name = "Stock de Plato (M1)"
+        verbose_name_plural = "Stock de Platos (M1)"
+
+    def __str__(self):
+        return f"Plato M1 #{self.plato_id_m1}: {self.disponible}"
+
+
+class SincronizacionM1(models.Model):
+    """
+    Punto de partida de la próxima sincronización incremental con M1 (ver menu_m1.py)
+    """
+    recurso = models.CharField(max_length=30, unique=True, verbose_name="Recurso")
+    etag = models.CharField(max_length=200, blank=True, verbose_name="ETag")
+    actualizado_hasta = models.DateTimeField(null=True, blank=True, verbose_name="Actualizado Hasta")
+    resultado = models.JSONField(default=dict, blank=True, verbose_name="Último Resultado")
+    fecha_actualizacion = models.DateTimeField(auto_now=True, verbose_name="Última Ejecución")
+
+    class Meta:
+        verbose_name = "Sincronización con M1"
+        verbose_name_plural = "Sincronizaciones con M1"
+
+    def __str__(self):
+        return f"{self.recurso} (hasta {self.actualizado_hasta})"
+
+
+class EventoPedido(models.Model):
+    """
+    Registro de cambios de pedidos que se difunde a las pantallas por Server-Sent Events.
+    Al ser una tabla compartida, los eventos llegan a todos los procesos del servidor.
+    """
+    tipo = models.CharField(max_length=30, verbose_name="Tipo")
+    pedido_id = models.BigIntegerField(verbose_name="ID Pedido")
+    mesa_id = models.BigIntegerField(null=True, blank=True, verbose_name="ID Mesa")
+    mesero_id = models.BigIntegerField(null=True, blank=True, verbose_name="ID Mesero")
+    estado = models.CharField(max_length=20, blank=True, verbose_name="Estado")
+    datos = models.JSONField(default=dict, blank=True, verbose_name="Datos")
+    fecha = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Fecha")
+
+    class Meta:
+        verbose_name = "Evento de Pedido"
+        verbose_name_plural = "Eventos de Pedidos"
+        ordering = ['id']
+
+    def __str__(self):
+        return f"Evento #{self.id} - {self.tipo} (Pedido #{self.pedido_id})"
+
+
+# ✅ Ventas pre-agregadas, mantenidas por ventas.py al entregar cada pedido
+class VentaBase(models.Model):
+    """
+    Acumulados de ventas de pedidos entregados (por fecha de entrega)
+    """
+    fecha = models.DateField(verbose_name="Fecha")
+    ingresos = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Ingresos")
+    unidades = models.PositiveIntegerField(default=0, verbose_name="Unidades")
+    descuento = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Descuento")
+    pedidos = models.PositiveIntegerField(default=0, verbose_name="Pedidos")
+
+    CAMPOS_ACUMULADOS = ('ingresos', 'unidades', 'descuento', 'pedidos')
+
+    class Meta:
+        abstract = True
+
+
+class VentaDiariaPlato(VentaBase):
+    # IDs sin clave foránea: los acumulados sobreviven al borrado o archivado de platos y pedidos
+    plato_id = models.BigIntegerField(verbose_name="ID Plato")
+    plato_nombre = models.CharField(max_length=100, verbose_name="Plato")
+
+    class Meta:
+        verbose_name = "Venta Diaria por Plato"
+        verbose_name_plural = "Ventas Diarias por Plato"
+        constraints = [models.UniqueConstraint(fields=['fecha', 'plato_id'], name='venta_plato_unica')]
+
+
+class VentaDiariaMesero(VentaBase):
+    mesero_id = models.BigIntegerField(default=0, verbose_name="ID Mesero")  # 0: sin mesero asignado
+
+    class Meta:
+        verbose_name = "Venta Diaria por Mesero"
+        verbose_name_plural = "Ventas Diarias por Mesero"
+        constraints = [models.UniqueConstraint(fields=['fecha', 'mesero_id'], name='venta_mesero_unica')]
+
+
+class VentaHoraria(VentaBase):
+    hora = models.PositiveSmallIntegerField(verbose_name="Hora")
+
+    class Meta:
+        verbose_name = "Venta por Hora"
+        verbose_name_plural = "Ventas por Hora"
+        constraints = [models.UniqueConstraint(fields=['fecha', 'hora'], name='venta_hora_unica')]
+
+
+class GeneracionCache(models.Model):
+    """
+    Contador de versión de un conjunto de datos de referencia (menú, personal, mesas).
+    Cada proceso compara su copia en memoria contra este contador, así una
+    modificación hecha en un worker invalida la caché de todos los demás.
+    """
+    CLAVES = ['menu', 'personal', 'mesas']
+
+    clave = models.CharField(max_length=30, unique=True, verbose_name="Clave")
+    generacion = models.PositiveBigIntegerField(default=0, verbose_name="Generación")
+
+    class Meta:
+        verbose_name = "Generación de Caché"
+        verbose_name_plural = "Generaciones de Caché"
+
+    def __str__(self):
+        return f"{self.clave}: {self.generacion}"
+
+    @classmethod
+    def invalidar(cls, *claves):
+        """
+        Incrementa la generación de las claves indicadas al confirmarse la transacción en curso
+        (si se incrementara antes, otro worker podría recargar y guardar datos aún sin confirmar)
+        """
+        @reintentar_si_bloqueada
+        def incrementar():
+            for clave in claves:
+                if not cls.objects.filter(clave=clave).update(generacion=F('generacion') + 1):
+                    cls.objects.get_or_create(clave=clave, defaults={'generacion': 1})
+        # robust: un fallo al invalidar se registra en el log sin romper la vista que ya confirmó
+        transaction.on_commit(incrementar, robust=True)
+
+
+# ✅ Invalidación de la caché de datos de referencia (ver referencia.py)
+@receiver(post_save, sender=Plato)
+@receiver(post_delete, sender=Plato)
+def invalidar_menu(sender, **kwargs):
+    GeneracionCache.invalidar('menu')
+
+@receiver(post_save, sender=Mesas)
+@receiver(post_delete, sender=Mesas)
+def invalidar_mesas(sender, **kwargs):
+    GeneracionCache.invalidar('mesas')
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidar_personal(sender, update_fields=None, action='post_', **kwargs):
+    # m2m_changed avisa antes y después de cada cambio: basta con el aviso posterior
+    if not action.startswith('post_'):
+        return
+    # Cada inicio de sesión guarda last_login, que no afecta al listado de meseros
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    GeneracionCache.invalidar('personal')
@@ -0,0 +1,181 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from .models import Pedidos, Plato, DetallePedido, totales_diferidos
+from . import mesas, stock_local, ventas
+
+
+class PedidoError(Exception):
+    """
+    Error de validación al crear o modificar un pedido
+    """
+
+
+def parsear_lineas(platos_ids, cantidades):
+    """
+    Convierte las listas paralelas del formulario en un diccionario de líneas
+
+    Los platos repetidos se fusionan sumando sus cantidades y las líneas con
+    cantidad 0 se descartan.
+
+    Args:
+        platos_ids: Lista de IDs de platos (request.POST.getlist('platos[]'))
+        cantidades: Lista de cantidades (request.POST.getlist('cantidades[]'))
+
+    Returns:
+        dict: {plato_id: cantidad}
+    """
+    lineas = {}
+    for i, plato_id in enumerate(platos_ids):
+        if not plato_id:
+            continue
+        try:
+            plato_id = int(plato_id)
+            cantidad = int(cantidades[i]) if i < len(cantidades) and cantidades[i] != '' else 1
+        except ValueError:
+            raise PedidoError('Plato o cantidad con formato inválido')
+        if cantidad < 0:
+            raise PedidoError('La cantidad no puede ser negativa')
+        if cantidad:
+            lineas[plato_id] = lineas.get(plato_id, 0) + cantidad
+    return lineas
+
+
+def _obtener_platos(lineas):
+    """
+    Carga con una sola consulta todos los platos de las líneas
+    """
+    platos = Plato.objects.in_bulk(list(lineas))
+    faltantes = [str(plato_id) for plato_id in lineas if plato_id not in platos]
+    if faltantes:
+        raise PedidoError(f'Platos inexistentes: {", ".join(faltantes)}')
+    return platos
+
+
+def registrar_pedido(nombre, mesa_id, mesero_id, lineas, notas_cocina=''):
+    """
+    Crea un pedido con todos sus detalles y ocupa la mesa en una única transacción
+
+    Args:
+        nombre: Nombre del cliente
+        mesa_id: ID de la mesa
+        mesero_id: ID del mesero
+        lineas: Diccionario {plato_id: cantidad} (ver parsear_lineas)
+        notas_cocina: Notas opcionales para cocina
+
+    Returns:
+        Pedidos: El pedido creado
+    """
+    if not lineas:
+        raise PedidoError('El pedido debe tener al menos un plato')
+
+    with transaction.atomic():
+        platos = _obtener_platos(lineas)
+
+        # Descartar platos agotados según la copia local de stock, sin llamar a M1
+        sin_stock = set(stock_local.agotados([
+            {'plato_id': platos[plato_id].plato_id_m1, 'cantidad': cantidad}
+            for plato_id, cantidad in lineas.items() if platos[plato_id].plato_id_m1
+        ]))
+        if sin_stock:
+            nombres = [plato.nombre for plato in platos.values() if plato.plato_id_m1 in sin_stock]
+            raise PedidoError(f'Sin stock suficiente: {", ".join(nombres)}')
+
+        if not User.objects.filter(id=mesero_id).exists():
+            raise PedidoError('El mesero seleccionado no existe')
+
+        ocupacion = timezone.now()
+        if not mesas.ocupar(mesa_id, desde=ocupacion):
+            if not mesas.existe(mesa_id):
+                raise PedidoError('La mesa seleccionada no existe')
+            raise PedidoError('La mesa seleccionada ya está ocupada')
+
+        # Los totales se calculan con los platos ya cargados, sin otra consulta
+        total_neto = sum(platos[plato_id].precio * cantidad for plato_id, cantidad in lineas.items())
+        pedido = Pedidos.objects.create(
+            nombre=nombre,
+            mesa_id=mesa_id,
+            mesero_id=mesero_id,
+            notas_cocina=notas_cocina,
+            estado='pendiente',
+            ocupacion_mesa=ocupacion,
+            total_neto=total_neto,
+            total_final=Pedidos.aplicar_descuento(total_neto, 0),
+        )
+
+        DetallePedido.objects.bulk_create([
+            DetallePedido(pedido=pedido, plato=platos[plato_id], cantidad=cantidad, precio_unitario=platos[plato_id].precio)
+            for plato_id, cantidad in lineas.items()
+        ])
+
+    return pedido
+
+
+def actualizar_detalles(pedido, lineas):
+    """
+    Sincroniza los detalles del pedido con las líneas recibidas aplicando solo las diferencias
+
+    Las cantidades modificadas se guardan con bulk_update, los platos nuevos con
+    bulk_create y los que ya no vienen se eliminan, todo en una transacción.
+
+    Args:
+        pedido: Instancia de Pedidos
+        lineas: Diccionario {plato_id: cantidad} (ver parsear_lineas)
+
+    Returns:
+        dict: {
+            'creados': [{'plato_id': int, 'cantidad': int}, ...],
+            'actualizados': [{'plato_id': int, 'cantidad_anterior': int, 'cantidad': int}, ...],
+            'eliminados': [{'plato_id': int, 'cantidad': int}, ...],
+            'delta': {plato_id: diferencia de cantidad},
+        }
+    """
+    if not lineas:
+        raise PedidoError('El pedido debe tener al menos un plato')
+
+    cambios = {'creados': [], 'actualizados': [], 'eliminados': [], 'delta': {}}
+
+    # Un pedido ya entregado está en los acumulados de ventas: se ajustan con la diferencia
+    entregado = [pedido.id] if pedido.estado == 'entregado' else []
+    with transaction.atomic(), totales_diferidos(), ventas.ajustar_entregas(entregado):
+        existentes = {detalle.plato_id: detalle for detalle in pedido.detalles.all()}
+
+        nuevos_ids = [plato_id for plato_id in lineas if plato_id not in existentes]
+        platos_nuevos = _obtener_platos({plato_id: lineas[plato_id] for plato_id in nuevos_ids}) if nuevos_ids else {}
+
+        por_crear = []
+        for plato_id in nuevos_ids:
+            plato = platos_nuevos[plato_id]
+            por_crear.append(DetallePedido(pedido=pedido, plato=plato, cantidad=lineas[plato_id], precio_unitario=plato.precio))
+            cambios['creados'].append({'plato_id': plato_id, 'cantidad': lineas[plato_id]})
+            cambios['delta'][plato_id] = lineas[plato_id]
+
+        por_actualizar = []
+        por_eliminar = []
+        for plato_id, detalle in existentes.items():
+            if plato_id not in lineas:
+                por_eliminar.append(detalle.id)
+                cambios['eliminados'].append({'plato_id': plato_id, 'cantidad': detalle.cantidad})
+                cambios['delta'][plato_id] = -detalle.cantidad
+            elif lineas[plato_id] != detalle.cantidad:
+                cambios['actualizados'].append({
+                    'plato_id': plato_id,
+                    'cantidad_anterior': detalle.cantidad,
+                    'cantidad': lineas[plato_id],
+                })
+                cambios['delta'][plato_id] = lineas[plato_id] - detalle.cantidad
+                detalle.cantidad = lineas[plato_id]
+                por_actualizar.append(detalle)
+
+        if por_eliminar:
+            DetallePedido.objects.filter(id__in=por_eliminar).delete()
+        if por_actualizar:
+            DetallePedido.objects.bulk_update(por_actualizar, ['cantidad'])
+        if por_crear:
+            DetallePedido.objects.bulk_create(por_crear)
+
+        if cambios['delta']:
+            totales = Pedidos.recalcular_totales([pedido.id], detalles_modificados=True)
+            pedido.total_neto, pedido.total_final = totales[pedido.id]
+
+    return cambios
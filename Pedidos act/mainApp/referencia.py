@@ -0,0 +1,89 @@
+import threading
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from .models import GeneracionCache, Mesas, Plato
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _cargar_menu():
+    platos = list(Plato.objects.all().order_by('nombre'))
+    con_id_m1 = sum(1 for plato in platos if plato.plato_id_m1 is not None)
+    return {
+        'platos': platos,
+        'con_id_m1': con_id_m1,
+        'sin_id_m1': len(platos) - con_id_m1,
+    }
+
+
+def _cargar_personal():
+    return list(User.objects.filter(groups__name='Meseros').order_by('username'))
+
+
+def _cargar_mesas():
+    # Solo los datos fijos: la ocupación cambia con cada pedido (ver mesas.con_ocupacion)
+    return list(Mesas.objects.values('id', 'numero', 'ubicacion'))
+
+
+_cargadores = {
+    'menu': _cargar_menu,
+    'personal': _cargar_personal,
+    'mesas': _cargar_mesas,
+}
+
+# Copia en memoria del proceso: {clave: (generacion, datos)}
+_cache = {}
+_lock = threading.Lock()
+
+
+def obtener(*claves):
+    """
+    Retorna los datos de referencia pedidos, recargando solo los que cambiaron
+
+    Con una única consulta se leen las generaciones vigentes; si coinciden con las
+    de la copia en memoria no se consulta nada más. Los datos devueltos son
+    compartidos entre requests y deben tratarse como de solo lectura.
+
+    Args:
+        claves: Cualquiera de 'menu', 'personal' o 'mesas'
+
+    Returns:
+        dict: {
+            'menu': {'platos': [Plato], 'con_id_m1': int, 'sin_id_m1': int},
+            'personal': [User],  # meseros
+            'mesas': [{'id', 'numero', 'ubicacion'}],  # Sin la ocupación
+        }
+    """
+    generaciones = dict(
+        GeneracionCache.objects.filter(clave__in=claves).values_list('clave', 'generacion')
+    )
+    datos = {}
+    for clave in claves:
+        generacion = generaciones.get(clave, 0)
+        with _lock:
+            en_cache = _cache.get(clave)
+        if en_cache is not None and en_cache[0] == generacion:
+            datos[clave] = en_cache[1]
+            continue
+
+        logger.debug(f"Recargando datos de referencia '{clave}' (generación {generacion})")
+        datos[clave] = _cargadores[clave]()
+        with _lock:
+            _cache[clave] = (generacion, datos[clave])
+    return datos
+
+
+def invalidar(*claves):
+    """
+    Invalida las claves en todos los workers. Usar tras operaciones que no emiten
+    señales (QuerySet.update, bulk_create, bulk_update).
+    """
+    GeneracionCache.invalidar(*claves)
+
+
+async def ainvalidar(*claves):
+    """
+    Versión async de invalidar
+    """
+    await sync_to_async(GeneracionCache.invalidar)(*claves)
@@ -1,9 +1,90 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
 import requests
+from requests.adapters import HTTPAdapter
 from django.conf import settings
+from . import metricas
 import logging
 
+try:
+    import httpx
+except ImportError:  # Opcional: sin httpx el cliente async delega en el síncrono dentro de un hilo
+    httpx = None
+
 logger = logging.getLogger(__name__)
 
+# Pool de conexiones HTTP hacia M1, compartido por todos los hilos del proceso
+_adaptador = None
+_adaptador_pid = None
+_adaptador_lock = threading.Lock()
+_sesiones = threading.local()
+
+
+def _obtener_adaptador():
+    """
+    Retorna el adaptador con el pool de conexiones keep-alive del proceso.
+    Se recrea si el proceso fue bifurcado (fork) para no compartir sockets con el padre.
+    """
+    global _adaptador, _adaptador_pid
+    pid = os.getpid()
+    if _adaptador is None or _adaptador_pid != pid:
+        with _adaptador_lock:
+            if _adaptador is None or _adaptador_pid != pid:
+                pool_size = getattr(settings, 'MENU_API_POOL_SIZE', 10)
+                _adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+                _adaptador_pid = pid
+    return _adaptador
+
+
+def obtener_sesion():
+    """
+    Retorna la sesión HTTP del hilo actual.
+
+    requests.Session no es seguro para compartir entre hilos, pero su adaptador sí:
+    cada hilo tiene su propia sesión montada sobre el pool común del proceso.
+    """
+    adaptador = _obtener_adaptador()
+    sesion = getattr(_sesiones, 'sesion', None)
+    if sesion is None or sesion.get_adapter('http://') is not adaptador:
+        sesion = requests.Session()
+        sesion.headers.update({'Content-Type': 'application/json', 'Connection': 'keep-alive'})
+        sesion.mount('http://', adaptador)
+        sesion.mount('https://', adaptador)
+        _sesiones.sesion = sesion
+    return sesion
+
+
+def resultados_lote(status_code, data, cantidad):
+    """
+    Traduce la respuesta de /stock/validar-lote al contrato de validar_stock, una entrada por solicitud
+    """
+    if status_code != 200:
+        error_msg = data.get('message', 'Error desconocido')
+        logger.error(f"Error al validar lote de stock: {error_msg}")
+        return [{'success': False, 'message': error_msg, 'data': None}] * cantidad
+
+    resultados = []
+    for item in data.get('resultados', [])[:cantidad]:
+        if item.get('success'):
+            resultados.append({
+                'success': True,
+                'message': 'Stock validado y reservado temporalmente',
+                'data': item.get('data')
+            })
+        else:
+            resultados.append({
+                'success': False,
+                'message': item.get('message', 'Error desconocido'),
+                'data': None
+            })
+    logger.info(f"Lote de {cantidad} validaciones procesado por M1")
+    return resultados
+
+
 class MenuAPIService:
     """
     Servicio para integración con el módulo de Menú (M1)
@@ -11,7 +92,37 @@ class MenuAPIService:
     def __init__(self):
         # URL base del módulo M1 - configurar en settings.py
         self.base_url = getattr(settings, 'MENU_API_URL', 'http://localhost:8001/api')
-        self.timeout = 10  # Timeout en segundos
+        # Timeouts en segundos: (conexión, lectura)
+        self.timeout = (
+            getattr(settings, 'MENU_API_CONNECT_TIMEOUT', 3.05),
+            getattr(settings, 'MENU_API_READ_TIMEOUT', 10),
+        )
+
+    @property
+    def session(self):
+        return obtener_sesion()
+
+    def _solicitar(self, operacion, metodo, url, **kwargs):
+        """
+        Envía la solicitud a M1 y registra su latencia y resultado en las métricas de la operación
+        """
+        inicio = time.perf_counter()
+        resultado = 'error'
+        try:
+            response = self.session.request(metodo, url, timeout=self.timeout, **kwargs)
+            resultado = 'ok' if response.status_code < 400 else 'error_http'
+            return response
+        except requests.exceptions.Timeout:
+            resultado = 'timeout'
+            raise
+        except requests.exceptions.ConnectionError:
+            resultado = 'conexion'
+            raise
+        finally:
+            metricas.observar(
+                'pedidos_m1_duracion_segundos', time.perf_counter() - inicio,
+                operacion=operacion, resultado=resultado,
+            )
     
     def validar_stock(self, platos):
         """
@@ -31,12 +142,7 @@ class MenuAPIService:
         }
         
         try:
-            response = requests.post(
-                url,
-                json=payload,
-                timeout=self.timeout,
-                headers={'Content-Type': 'application/json'}
-            )
+            response = self._solicitar('validar_stock', 'post', url, json=payload)
             
             if response.status_code == 200:
                 data = response.json()
@@ -77,7 +183,7 @@ class MenuAPIService:
                 'data': None
             }
     
-    def consumir_stock(self, pedido_id, platos):
+    def consumir_stock(self, pedido_id, platos, clave_idempotencia=None):
         """
         Consume definitivamente el stock de platos
         
@@ -85,6 +191,8 @@ class MenuAPIService:
             pedido_id: ID del pedido
             platos: Lista de diccionarios con estructura:
                     [{'plato_id': 1, 'cantidad': 2}, ...]
+            clave_idempotencia: Misma clave en cada reintento del mismo consumo (encabezado
+                                Idempotency-Key), para que M1 no lo aplique dos veces
         
         Returns:
             dict: {'success': bool, 'message': str, 'data': dict}
@@ -95,14 +203,10 @@ class MenuAPIService:
             'pedido_id': pedido_id,
             'platos': platos
         }
+        headers = {'Idempotency-Key': clave_idempotencia} if clave_idempotencia else None
         
         try:
-            response = requests.post(
-                url,
-                json=payload,
-                timeout=self.timeout,
-                headers={'Content-Type': 'application/json'}
-            )
+            response = self._solicitar('consumir_stock', 'post', url, json=payload, headers=headers)
             
             if response.status_code == 200:
                 data = response.json()
@@ -143,6 +247,157 @@ class MenuAPIService:
                 'data': None
             }
     
+    def validar_stock_lote(self, solicitudes):
+        """
+        Valida varias reservas de stock en una sola llamada a M1
+        
+        Args:
+            solicitudes: Lista de listas de platos, una por pedido:
+                    [[{'plato_id': 1, 'cantidad': 2}, ...], ...]
+        
+        Returns:
+            list: Un dict {'success': bool, 'message': str, 'data': dict} por solicitud
+        """
+        url = f"{self.base_url}/stock/validar-lote"
+        
+        payload = {
+            'solicitudes': [{'platos': platos} for platos in solicitudes]
+        }
+        
+        try:
+            response = self._solicitar('validar_stock_lote', 'post', url, json=payload)
+            return resultados_lote(response.status_code, response.json(), len(solicitudes))
+                
+        except requests.exceptions.Timeout:
+            logger.error("Timeout al conectar con M1")
+            message = 'Tiempo de espera agotado al conectar con el sistema de menú'
+        except requests.exceptions.ConnectionError:
+            logger.error("Error de conexión con M1")
+            message = 'No se pudo conectar con el sistema de menú'
+        except Exception as e:
+            logger.error(f"Error inesperado: {str(e)}")
+            message = f'Error inesperado: {str(e)}'
+        return [{'success': False, 'message': message, 'data': None}] * len(solicitudes)
+    
+    def obtener_stock(self, plato_ids=None):
+        """
+        Consulta el stock disponible en M1
+        
+        Args:
+            plato_ids: Lista de IDs de platos en M1 (None = todo el catálogo)
+        
+        Returns:
+            dict: {'success': bool, 'message': str, 'data': [{'plato_id': 1, 'disponible': 5}, ...]}
+        """
+        url = f"{self.base_url}/stock"
+        params = {'platos': ','.join(str(plato_id) for plato_id in plato_ids)} if plato_ids else None
+        
+        try:
+            response = self._solicitar('obtener_stock', 'get', url, params=params)
+            
+            if response.status_code == 200:
+                return {
+                    'success': True,
+                    'message': 'Stock obtenido correctamente',
+                    'data': response.json().get('stock', [])
+                }
+            else:
+                error_msg = response.json().get('message', 'Error desconocido')
+                logger.error(f"Error al obtener stock: {error_msg}")
+                return {
+                    'success': False,
+                    'message': error_msg,
+                    'data': None
+                }
+                
+        except requests.exceptions.Timeout:
+            logger.error("Timeout al conectar con M1")
+            return {
+                'success': False,
+                'message': 'Tiempo de espera agotado al conectar con el sistema de menú',
+                'data': None
+            }
+        except requests.exceptions.ConnectionError:
+            logger.error("Error de conexión con M1")
+            return {
+                'success': False,
+                'message': 'No se pudo conectar con el sistema de menú',
+                'data': None
+            }
+        except Exception as e:
+            logger.error(f"Error inesperado: {str(e)}")
+            return {
+                'success': False,
+                'message': f'Error inesperado: {str(e)}',
+                'data': None
+            }
+    
+    def obtener_menu(self, etag=None, actualizado_desde=None):
+        """
+        Consulta el catálogo de platos de M1, completo o solo lo modificado
+
+        Args:
+            etag: ETag de la última respuesta; si el catálogo no cambió M1 responde 304
+            actualizado_desde: datetime; solo se piden los platos modificados desde entonces
+
+        Returns:
+            dict: {'success': bool, 'message': str,
+                   'data': {'platos': [{'id': 1, 'nombre': str, 'precio': str}, ...], 'etag': str, 'sin_cambios': bool}}
+        """
+        url = f"{self.base_url}/menu"
+        params = {'actualizado_desde': actualizado_desde.isoformat()} if actualizado_desde else None
+        headers = {'If-None-Match': etag} if etag else None
+
+        try:
+            response = self._solicitar('obtener_menu', 'get', url, params=params, headers=headers)
+
+            if response.status_code == 304:
+                return {
+                    'success': True,
+                    'message': 'El menú no cambió',
+                    'data': {'platos': [], 'etag': etag, 'sin_cambios': True}
+                }
+            elif response.status_code == 200:
+                return {
+                    'success': True,
+                    'message': 'Menú obtenido correctamente',
+                    'data': {
+                        'platos': response.json().get('platos', []),
+                        'etag': response.headers.get('ETag'),
+                        'sin_cambios': False,
+                    }
+                }
+            else:
+                error_msg = response.json().get('message', 'Error desconocido')
+                logger.error(f"Error al obtener menú: {error_msg}")
+                return {
+                    'success': False,
+                    'message': error_msg,
+                    'data': None
+                }
+
+        except requests.exceptions.Timeout:
+            logger.error("Timeout al conectar con M1")
+            return {
+                'success': False,
+                'message': 'Tiempo de espera agotado al conectar con el sistema de menú',
+                'data': None
+            }
+        except requests.exceptions.ConnectionError:
+            logger.error("Error de conexión con M1")
+            return {
+                'success': False,
+                'message': 'No se pudo conectar con el sistema de menú',
+                'data': None
+            }
+        except Exception as e:
+            logger.error(f"Error inesperado: {str(e)}")
+            return {
+                'success': False,
+                'message': f'Error inesperado: {str(e)}',
+                'data': None
+            }
+
     def cancelar_reserva(self, platos):
         """
         Cancela una reserva temporal de stock
@@ -161,12 +416,7 @@ class MenuAPIService:
         }
         
         try:
-            response = requests.post(
-                url,
-                json=payload,
-                timeout=self.timeout,
-                headers={'Content-Type': 'application/json'}
-            )
+            response = self._solicitar('cancelar_reserva', 'post', url, json=payload)
             
             if response.status_code == 200:
                 return {
@@ -184,4 +434,169 @@ class MenuAPIService:
             return {
                 'success': False,
                 'message': f'Error al cancelar reserva: {str(e)}'
-            }
\ No newline at end of file
+            }
+
+
+# Bajo ASGI, un cliente httpx por event loop: los clientes async no pueden usarse desde otro loop
+_clientes_async = weakref.WeakKeyDictionary()
+
+
+class AsyncMenuAPIService:
+    """
+    Versión asíncrona de MenuAPIService para las vistas async servidas por ASGI.
+    Retorna exactamente los mismos diccionarios de resultado que el servicio síncrono.
+    """
+    def __init__(self):
+        self.base_url = getattr(settings, 'MENU_API_URL', 'http://localhost:8001/api')
+        self.connect_timeout = getattr(settings, 'MENU_API_CONNECT_TIMEOUT', 3.05)
+        self.read_timeout = getattr(settings, 'MENU_API_READ_TIMEOUT', 10)
+        self.pool_size = getattr(settings, 'MENU_API_ASYNC_POOL_SIZE', 100)
+        self._sync = MenuAPIService()
+
+    def _nuevo_cliente(self):
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+            ),
+            headers={'Content-Type': 'application/json'},
+        )
+
+    @asynccontextmanager
+    async def _cliente(self):
+        """
+        Cliente httpx para una llamada
+
+        Bajo ASGI se reutiliza el cliente del loop del servidor (vive lo mismo que el
+        proceso). Bajo WSGI cada request corre en un loop nuevo que muere al terminar,
+        así que el cliente se abre y se cierra con la llamada para no dejar conexiones
+        colgadas de loops muertos.
+        """
+        if not getattr(settings, 'SERVIDOR_ASGI', False):
+            async with self._nuevo_cliente() as cliente:
+                yield cliente
+            return
+        loop = asyncio.get_running_loop()
+        cliente = _clientes_async.get(loop)
+        if cliente is None:
+            cliente = _clientes_async[loop] = self._nuevo_cliente()
+        yield cliente
+
+    async def _post(self, operacion, ruta, payload, headers=None):
+        """
+        Envía el POST a M1, registra su latencia y resultado, y retorna (status_code, json)
+        """
+        inicio = time.perf_counter()
+        resultado = 'error'
+        try:
+            async with self._cliente() as cliente:
+                response = await cliente.post(f"{self.base_url}{ruta}", json=payload, headers=headers)
+            resultado = 'ok' if response.status_code < 400 else 'error_http'
+        except httpx.TimeoutException:
+            resultado = 'timeout'
+            raise
+        except httpx.TransportError:
+            resultado = 'conexion'
+            raise
+        finally:
+            metricas.observar(
+                'pedidos_m1_duracion_segundos', time.perf_counter() - inicio,
+                operacion=operacion, resultado=resultado,
+            )
+        return response.status_code, response.json()
+
+    async def validar_stock(self, platos):
+        """
+        Valida y reserva temporalmente el stock de platos (ver MenuAPIService.validar_stock)
+        """
+        if httpx is None:
+            return await asyncio.to_thread(self._sync.validar_stock, platos)
+
+        try:
+            status, data = await self._post('validar_stock', '/stock/validar', {'platos': platos})
+            if status == 200:
+                logger.info(f"Stock validado correctamente: {data}")
+                return {
+                    'success': True,
+                    'message': 'Stock validado y reservado temporalmente',
+                    'data': data
+                }
+            error_msg = data.get('message', 'Error desconocido')
+            logger.error(f"Error al validar stock: {error_msg}")
+            return {'success': False, 'message': error_msg, 'data': None}
+
+        except Exception as e:
+            return self._resultado_excepcion(e)
+
+    async def consumir_stock(self, pedido_id, platos, clave_idempotencia=None):
+        """
+        Consume definitivamente el stock de platos (ver MenuAPIService.consumir_stock)
+        """
+        if httpx is None:
+            return await asyncio.to_thread(self._sync.consumir_stock, pedido_id, platos, clave_idempotencia)
+
+        try:
+            status, data = await self._post(
+                'consumir_stock', '/stock/consumir', {'pedido_id': pedido_id, 'platos': platos},
+                headers={'Idempotency-Key': clave_idempotencia} if clave_idempotencia else None,
+            )
+            if status == 200:
+                logger.info(f"Stock consumido correctamente para pedido {pedido_id}")
+                return {
+                    'success': True,
+                    'message': 'Stock consumido correctamente',
+                    'data': data
+                }
+            error_msg = data.get('message', 'Error desconocido')
+            logger.error(f"Error al consumir stock: {error_msg}")
+            return {'success': False, 'message': error_msg, 'data': None}
+
+        except Exception as e:
+            return self._resultado_excepcion(e)
+
+    async def validar_stock_lote(self, solicitudes):
+        """
+        Valida varias reservas de stock en una sola llamada a M1 (ver MenuAPIService.validar_stock_lote)
+        """
+        if httpx is None:
+            return await asyncio.to_thread(self._sync.validar_stock_lote, solicitudes)
+
+        try:
+            status, data = await self._post(
+                'validar_stock_lote', '/stock/validar-lote',
+                {'solicitudes': [{'platos': platos} for platos in solicitudes]}
+            )
+            return resultados_lote(status, data, len(solicitudes))
+
+        except Exception as e:
+            return [self._resultado_excepcion(e)] * len(solicitudes)
+
+    async def cancelar_reserva(self, platos):
+        """
+        Cancela una reserva temporal de stock (ver MenuAPIService.cancelar_reserva)
+        """
+        if httpx is None:
+            return await asyncio.to_thread(self._sync.cancelar_reserva, platos)
+
+        try:
+            status, _ = await self._post('cancelar_reserva', '/stock/cancelar-reserva', {'platos': platos})
+            if status == 200:
+                return {'success': True, 'message': 'Reserva cancelada correctamente'}
+            return {'success': False, 'message': 'Error al cancelar reserva'}
+
+        except Exception as e:
+            logger.error(f"Error al cancelar reserva: {str(e)}")
+            return {'success': False, 'message': f'Error al cancelar reserva: {str(e)}'}
+
+    def _resultado_excepcion(self, e):
+        if isinstance(e, httpx.TimeoutException):
+            logger.error("Timeout al conectar con M1")
+            message = 'Tiempo de espera agotado al conectar con el sistema de menú'
+        elif isinstance(e, httpx.TransportError):
+            logger.error("Error de conexión con M1")
+            message = 'No se pudo conectar con el sistema de menú'
+        else:
+            logger.error(f"Error inesperado: {str(e)}")
+            message = f'Error inesperado: {str(e)}'
+        return {'success': False, 'message': message, 'data': None}
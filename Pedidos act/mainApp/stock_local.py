@@ -0,0 +1,96 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, When
+from django.utils import timezone
+from .models import StockPlatoM1
+from .services import MenuAPIService
+import logging
+
+logger = logging.getLogger(__name__)
+
+menu_api = MenuAPIService()
+
+
+def _vigencia():
+    return timezone.now() - timedelta(seconds=getattr(settings, 'STOCK_LOCAL_TTL_SEGUNDOS', 60))
+
+
+def refrescar(plato_ids=None):
+    """
+    Actualiza la copia local con el stock actual de M1 en una sola escritura masiva
+
+    Args:
+        plato_ids: IDs de platos en M1 a refrescar (None = todo el catálogo)
+
+    Returns:
+        dict: {'success': bool, 'message': str, 'data': int (platos actualizados)}
+    """
+    resultado = menu_api.obtener_stock(plato_ids)
+    if not resultado['success']:
+        return resultado
+
+    ahora = timezone.now()
+    filas = [
+        StockPlatoM1(plato_id_m1=item['plato_id'], disponible=item['disponible'], actualizado_en=ahora)
+        for item in resultado['data']
+    ]
+    StockPlatoM1.objects.bulk_create(
+        filas,
+        update_conflicts=True,
+        unique_fields=['plato_id_m1'],
+        update_fields=['disponible', 'actualizado_en'],
+    )
+    logger.info(f"Stock local actualizado para {len(filas)} platos")
+    return {'success': True, 'message': 'Stock local actualizado', 'data': len(filas)}
+
+
+def agotados(platos):
+    """
+    Retorna los IDs de M1 que, según una copia local vigente, no alcanzan la cantidad pedida
+
+    Los platos sin copia local o con copia vencida no se descartan: M1 tiene la última palabra.
+
+    Args:
+        platos: Lista en formato M1: [{'plato_id': 1, 'cantidad': 2}, ...]
+
+    Returns:
+        list: IDs de platos en M1 sin stock suficiente
+    """
+    if not platos:
+        return []
+    cantidades = {}
+    for plato in platos:
+        cantidades[plato['plato_id']] = cantidades.get(plato['plato_id'], 0) + plato['cantidad']
+
+    disponibles = StockPlatoM1.objects.filter(
+        plato_id_m1__in=cantidades, actualizado_en__gte=_vigencia()
+    ).values_list('plato_id_m1', 'disponible')
+    return [plato_id for plato_id, disponible in disponibles if disponible < cantidades[plato_id]]
+
+
+def ids_agotados():
+    """
+    Retorna el conjunto de IDs de M1 que la copia local vigente marca sin stock
+    """
+    return set(
+        StockPlatoM1.objects.filter(disponible__lte=0, actualizado_en__gte=_vigencia())
+        .values_list('plato_id_m1', flat=True)
+    )
+
+
+def descontar(platos):
+    """
+    Descuenta de forma optimista lo que M1 acaba de consumir, sin esperar al próximo refresco
+    """
+    if not platos:
+        return 0
+    cantidades = {}
+    for plato in platos:
+        cantidades[plato['plato_id']] = cantidades.get(plato['plato_id'], 0) + plato['cantidad']
+
+    return StockPlatoM1.objects.filter(plato_id_m1__in=cantidades).update(
+        disponible=Case(
+            *[When(plato_id_m1=plato_id, then=F('disponible') - cantidad) for plato_id, cantidad in cantidades.items()],
+            output_field=IntegerField(),
+        )
+    )
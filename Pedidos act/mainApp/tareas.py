@@ -0,0 +1,302 @@
+import random
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Tarea, Pedidos
+from .services import MenuAPIService
+from . import stock_local, eventos, estados, menu_m1
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Registro de manejadores por tipo de tarea
+_manejadores = {}
+
+
+class TareaFallida(Exception):
+    """
+    Error definitivo: la tarea pasa directo a 'fallida' sin más reintentos
+    """
+
+
+def registrar(tipo):
+    """
+    Decorador que asocia un manejador a un tipo de tarea.
+    El manejador recibe (payload, tarea) y retorna un resultado serializable a JSON.
+    """
+    def decorador(funcion):
+        _manejadores[tipo] = funcion
+        return funcion
+    return decorador
+
+
+def encolar(tipo, payload=None, pedido=None, demora=None):
+    """
+    Registra una tarea para el trabajador
+
+    Args:
+        tipo: Tipo registrado con @registrar
+        payload: Datos serializables a JSON para el manejador
+        pedido: Pedido asociado (opcional)
+        demora: timedelta antes de que la tarea quede disponible (opcional)
+
+    Returns:
+        Tarea: La tarea creada
+    """
+    return Tarea.objects.create(
+        tipo=tipo,
+        payload=payload or {},
+        pedido=pedido,
+        max_intentos=getattr(settings, 'TAREAS_MAX_INTENTOS', 5),
+        disponible_desde=timezone.now() + (demora or timedelta(0)),
+    )
+
+
+def encolar_para_pedido(tipo, pedido, payload=None):
+    """
+    Encola una tarea del pedido, salvo que ya haya una activa del mismo tipo
+
+    La restricción única tarea_activa_por_pedido decide entre dos solicitudes
+    simultáneas: la que pierde reutiliza la tarea creada por la otra.
+
+    Returns:
+        tuple: (Tarea, creada)
+    """
+    activas = Tarea.objects.filter(pedido=pedido, tipo=tipo, estado__in=['pendiente', 'en_proceso'])
+    tarea = activas.first()
+    if tarea is not None:
+        return tarea, False
+    try:
+        with transaction.atomic():
+            return encolar(tipo, payload, pedido=pedido), True
+    except IntegrityError:
+        tarea = activas.first()
+        if tarea is None:
+            raise
+        return tarea, False
+
+
+def _disponibles(ahora):
+    # Pendientes cuyo backoff ya venció, o en proceso cuyo trabajador dejó vencer el bloqueo
+    # sin agotar los intentos (las que los agotaron pasan a 'fallida' en _descartar_agotadas)
+    return (
+        Q(estado='pendiente', disponible_desde__lte=ahora)
+        | Q(estado='en_proceso', bloqueada_hasta__lt=ahora, intentos__lt=F('max_intentos'))
+    )
+
+
+def _descartar_agotadas(ahora):
+    """
+    Marca como fallidas las tareas cuyo trabajador murió en el último intento permitido
+    """
+    agotadas = Tarea.objects.filter(estado='en_proceso', bloqueada_hasta__lt=ahora, intentos__gte=F('max_intentos'))
+    fallidas = agotadas.update(
+        estado='fallida',
+        ultimo_error='El bloqueo venció en el último intento permitido',
+        bloqueada_hasta=None,
+        fecha_actualizacion=ahora,
+    )
+    if fallidas:
+        logger.error(f"{fallidas} tareas agotaron sus intentos sin terminar y pasaron a 'fallida'")
+
+
+def reclamar(trabajador, candidatos=10):
+    """
+    Toma la próxima tarea disponible para este trabajador
+
+    El reclamo es un UPDATE condicional sobre una sola fila: si otro trabajador la
+    tomó primero el UPDATE no afecta filas y se prueba con la siguiente candidata.
+
+    Returns:
+        Tarea o None si no hay tareas disponibles
+    """
+    ahora = timezone.now()
+    bloqueo = timedelta(seconds=getattr(settings, 'TAREAS_BLOQUEO_SEGUNDOS', 60))
+    _descartar_agotadas(ahora)
+
+    ids = list(
+        Tarea.objects.filter(_disponibles(ahora))
+        .order_by('disponible_desde', 'id')
+        .values_list('id', flat=True)[:candidatos]
+    )
+    for tarea_id in ids:
+        tomada = Tarea.objects.filter(_disponibles(ahora), id=tarea_id).update(
+            estado='en_proceso',
+            trabajador=trabajador,
+            bloqueada_hasta=ahora + bloqueo,
+            intentos=F('intentos') + 1,
+            fecha_actualizacion=ahora,
+        )
+        if tomada:
+            return Tarea.objects.get(id=tarea_id)
+    return None
+
+
+def _backoff(intentos):
+    """
+    Espera exponencial con jitter antes del siguiente intento
+    """
+    base = getattr(settings, 'TAREAS_BACKOFF_BASE', 2)
+    maximo = getattr(settings, 'TAREAS_BACKOFF_MAX', 300)
+    espera = min(maximo, base * (2 ** max(intentos - 1, 0)))
+    return timedelta(seconds=espera * random.uniform(0.5, 1.0))
+
+
+def ejecutar(tarea):
+    """
+    Ejecuta una tarea ya reclamada y registra su resultado, reintento o falla definitiva
+
+    Returns:
+        str: Estado final de la tarea ('completada', 'pendiente' o 'fallida')
+    """
+    manejador = _manejadores.get(tarea.tipo)
+    ahora = timezone.now()
+    try:
+        if manejador is None:
+            raise TareaFallida(f'No hay manejador registrado para el tipo "{tarea.tipo}"')
+        resultado = manejador(tarea.payload, tarea)
+
+    except Exception as e:
+        definitiva = isinstance(e, TareaFallida) or tarea.intentos >= tarea.max_intentos
+        estado = 'fallida' if definitiva else 'pendiente'
+        logger.error(f"Tarea #{tarea.id} ({tarea.tipo}) intento {tarea.intentos}: {str(e)}")
+        Tarea.objects.filter(id=tarea.id, trabajador=tarea.trabajador).update(
+            estado=estado,
+            ultimo_error=''.join(traceback.format_exception_only(type(e), e)).strip(),
+            disponible_desde=ahora + _backoff(tarea.intentos),
+            bloqueada_hasta=None,
+            fecha_actualizacion=ahora,
+        )
+        return estado
+
+    Tarea.objects.filter(id=tarea.id, trabajador=tarea.trabajador).update(
+        estado='completada',
+        resultado=resultado,
+        ultimo_error='',
+        bloqueada_hasta=None,
+        fecha_actualizacion=ahora,
+    )
+    logger.info(f"Tarea #{tarea.id} ({tarea.tipo}) completada")
+    return 'completada'
+
+
+# ============================================
+# ✅ MANEJADORES
+# ============================================
+
+menu_api = MenuAPIService()
+
+
+@registrar('consumir_stock')
+def consumir_stock(payload, tarea):
+    """
+    Consume el stock del pedido en M1 y lo marca como enviado a cocina
+
+    Si el trabajador muere a mitad de camino la tarea se vuelve a reclamar, así que
+    cada paso debe poder repetirse: el consumo lleva una clave de idempotencia fija
+    por pedido y, apenas M1 lo confirma, se registra stock_consumido en su propia
+    escritura; un reintento con el stock ya consumido solo completa la transición.
+    """
+    pedido = Pedidos.objects.filter(id=payload.get('pedido_id')).first()
+    if pedido is None:
+        raise TareaFallida('El pedido ya no existe')
+    if pedido.estado == 'enviado_cocina':
+        return {'omitida': True, 'message': 'El pedido ya fue enviado a cocina'}
+
+    datos = {'omitida': True, 'message': 'El stock ya fue consumido para este pedido'}
+    if not pedido.stock_consumido:
+        platos = pedido.get_platos_para_m1()
+        if not platos:
+            raise TareaFallida('No hay platos válidos para enviar')
+
+        resultado = menu_api.consumir_stock(pedido.id, platos, clave_idempotencia=f'consumo-pedido-{pedido.id}')
+        if not resultado['success']:
+            raise Exception(resultado['message'])
+        Pedidos.objects.filter(id=pedido.id).update(stock_consumido=True, fecha_actualizacion=timezone.now())
+        stock_local.descontar(platos)
+        datos = resultado['data']
+
+    if not estados.transicionar(pedido, 'enviado_cocina'):
+        raise TareaFallida('El pedido cambió de estado antes de llegar a cocina')
+    eventos.publicar('enviado_cocina', pedido)
+    return datos
+
+
+@registrar('refrescar_stock_m1')
+def refrescar_stock_m1(payload, tarea):
+    """
+    Actualiza la copia local del stock de M1; con {'periodica': true} deja programado el próximo refresco
+    """
+    if payload.get('periodica'):
+        # Se programa antes de refrescar para que un fallo no corte la cadena
+        programar_refresco_stock(excluir=tarea.id)
+    resultado = stock_local.refrescar(payload.get('plato_ids'))
+    if not resultado['success']:
+        raise Exception(resultado['message'])
+    return {'platos_actualizados': resultado['data']}
+
+
+@registrar('sincronizar_menu_m1')
+def sincronizar_menu_m1(payload, tarea):
+    """
+    Sincroniza el catálogo de M1 con Plato; con {'periodica': true} deja programada la próxima ejecución
+    """
+    if payload.get('periodica'):
+        # Se programa antes de sincronizar para que un fallo no corte la cadena
+        programar_sincronizacion_menu(excluir=tarea.id)
+    resultado = menu_m1.sincronizar(completa=payload.get('completa', False))
+    if not resultado['success']:
+        raise Exception(resultado['message'])
+    return resultado['data']
+
+
+def _programar_periodica(tipo, segundos, excluir=None):
+    """
+    Encola la próxima ejecución de una tarea periódica, salvo que ya haya una pendiente
+
+    Args:
+        tipo: Tipo registrado con @registrar; su manejador se reprograma con {'periodica': true}
+        segundos: Demora hasta la próxima ejecución
+        excluir: ID de la tarea en curso, que todavía figura como en proceso
+
+    Returns:
+        Tarea o None si ya había una programada
+    """
+    pendientes = Tarea.objects.filter(tipo=tipo, estado__in=['pendiente', 'en_proceso'])
+    if excluir is not None:
+        pendientes = pendientes.exclude(id=excluir)
+    if pendientes.exists():
+        return None
+    return encolar(tipo, {'periodica': True}, demora=timedelta(seconds=segundos))
+
+
+def programar_sincronizacion_menu(excluir=None):
+    """
+    Encola la próxima sincronización periódica del menú, salvo que ya haya una pendiente
+
+    Returns:
+        Tarea o None si ya había una programada
+    """
+    intervalo = getattr(settings, 'MENU_M1_SINCRONIZACION_SEGUNDOS', 300)
+    return _programar_periodica('sincronizar_menu_m1', intervalo, excluir=excluir)
+
+
+def programar_refresco_stock(excluir=None, demora=None):
+    """
+    Encola el próximo refresco periódico de la copia local del stock, salvo que ya haya uno pendiente
+
+    El intervalo (STOCK_LOCAL_REFRESCO_SEGUNDOS) debe ser menor que STOCK_LOCAL_TTL_SEGUNDOS
+    para que la copia siga vigente entre dos refrescos.
+
+    Args:
+        excluir: ID de la tarea en curso
+        demora: Segundos hasta el refresco (por defecto, el intervalo)
+
+    Returns:
+        Tarea o None si ya había uno programado
+    """
+    intervalo = getattr(settings, 'STOCK_LOCAL_REFRESCO_SEGUNDOS', 30) if demora is None else demora
+    return _programar_periodica('refrescar_stock_m1', intervalo, excluir=excluir)
@@ -1,3 +1,1671 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import zlib
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+import requests
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .models import (
+    DetallePedido, EventoPedido, GeneracionCache, Mesas, Pedidos, Plato, SincronizacionM1, StockPlatoM1, Tarea,
+    VentaDiariaMesero, VentaDiariaPlato, VentaHoraria, totales_diferidos,
+)
+from .bloqueos import es_bloqueo, reintentar_si_bloqueada
+from .coalescedor import CoalescedorValidacion
+from .pedidos import PedidoError, actualizar_detalles, registrar_pedido
+from .services import AsyncMenuAPIService, MenuAPIService, httpx
+from . import archivo, estados, eventos, exportacion, menu_m1, mesas, metricas, referencia, stock_local, tareas, ventas
 
-# Create your tests here.
+
+def setUpModule():
+    # Las solicitudes de todas las pruebas registran métricas: se vuelcan a un directorio
+    # temporal y se descartan al final, así el volcado de atexit no escribe en METRICAS_DIR
+    directorio = tempfile.TemporaryDirectory()
+    configuracion = override_settings(METRICAS_DIR=Path(directorio.name))
+    configuracion.enable()
+    unittest.addModuleCleanup(directorio.cleanup)
+    unittest.addModuleCleanup(configuracion.disable)
+    unittest.addModuleCleanup(metricas.descartar)
+
+
+class OcupacionMesasConcurrenteTest(TransactionTestCase):
+    """
+    Varios meseros intentan sentar clientes en la misma mesa al mismo tiempo
+    """
+    HILOS = 8
+
+    def setUp(self):
+        self.mesa = Mesas.objects.create(numero='1', ubicacion='Salón')
+        self.mesero = User.objects.create(username='mesero')
+        self.plato = Plato.objects.create(nombre='Milanesa', precio=10)
+
+    def _en_paralelo(self, funcion):
+        barrera = threading.Barrier(self.HILOS)
+        resultados = []
+        lock = threading.Lock()
+
+        def trabajo(i):
+            barrera.wait()
+            try:
+                resultado = funcion(i)
+            except Exception as e:
+                resultado = e
+            finally:
+                connection.close()
+            with lock:
+                resultados.append(resultado)
+
+        hilos = [threading.Thread(target=trabajo, args=(i,)) for i in range(self.HILOS)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        return resultados
+
+    def test_un_solo_hilo_ocupa_la_mesa(self):
+        resultados = self._en_paralelo(lambda i: mesas.ocupar(self.mesa.id))
+
+        self.assertEqual(resultados.count(True), 1)
+        self.mesa.refresh_from_db()
+        self.assertTrue(self.mesa.ocupada)
+
+    def test_sin_pedidos_duplicados_en_la_mesa(self):
+        resultados = self._en_paralelo(lambda i: registrar_pedido(
+            f'Cliente {i}', self.mesa.id, self.mesero.id, {self.plato.id: 1}
+        ))
+
+        creados = [r for r in resultados if isinstance(r, Pedidos)]
+        self.assertEqual(len(creados), 1)
+        self.assertEqual(Pedidos.objects.filter(mesa=self.mesa).count(), 1)
+        # El resto de los intentos falla con error (mesa ocupada o base bloqueada), nunca en silencio
+        self.assertEqual(len(resultados) - len(creados), self.HILOS - 1)
+
+
+class LiberacionMesasTest(TestCase):
+
+    def setUp(self):
+        self.mesa = Mesas.objects.create(numero='1', ubicacion='Salón')
+        self.otra_mesa = Mesas.objects.create(numero='2', ubicacion='Salón')
+        self.mesero = User.objects.create(username='mesero')
+        self.plato = Plato.objects.create(nombre='Milanesa', precio=10)
+        self.pedido = registrar_pedido('Ana', self.mesa.id, self.mesero.id, {self.plato.id: 1})
+
+    def test_mesa_ocupada_rechaza_otro_pedido(self):
+        with self.assertRaises(PedidoError):
+            registrar_pedido('Luis', self.mesa.id, self.mesero.id, {self.plato.id: 1})
+
+    def test_no_libera_con_otro_pedido_activo(self):
+        Pedidos.objects.create(nombre='Luis', mesa=self.mesa, mesero=self.mesero)
+
+        self.assertFalse(mesas.liberar(self.mesa.id, excluir_pedido=self.pedido.id))
+        self.mesa.refresh_from_db()
+        self.assertTrue(self.mesa.ocupada)
+
+    def test_libera_al_eliminar_el_ultimo_pedido(self):
+        self.pedido.delete()
+
+        self.mesa.refresh_from_db()
+        self.assertFalse(self.mesa.ocupada)
+
+    def test_cambio_de_mesa(self):
+        self.assertTrue(mesas.ocupar(self.otra_mesa.id))
+        self.assertFalse(mesas.ocupar(self.otra_mesa.id))
+        self.assertTrue(mesas.liberar(self.mesa.id, excluir_pedido=self.pedido.id))
+
+
+class TransicionesTest(TestCase):
+    """
+    Tabla de transiciones de estados.py
+    """
+    @classmethod
+    def setUpTestData(cls):
+        mesero = User.objects.create(username='mesero')
+        plato = Plato.objects.create(nombre='Milanesa', precio=10)
+        mesa = Mesas.objects.create(numero='1', ubicacion='Salón')
+        cls.pedido_id = registrar_pedido('Cliente', mesa.id, mesero.id, {plato.id: 1}).id
+
+    def test_permitidas_y_prohibidas(self):
+        pedido = Pedidos.objects.get(id=self.pedido_id)
+
+        self.assertFalse(estados.transicionar(pedido, 'listo', manual=True))  # pendiente → listo no existe
+        self.assertEqual(pedido.estado, 'pendiente')
+        self.assertTrue(estados.transicionar(pedido, 'en_elaboracion', manual=True))
+        self.assertTrue(estados.transicionar(pedido, 'listo', manual=True))
+        self.assertTrue(estados.transicionar(pedido, 'entregado', manual=True))
+
+        guardado = Pedidos.objects.get(id=self.pedido_id)
+        self.assertEqual(guardado.estado, 'entregado')
+        self.assertEqual(guardado.timestamp_entrega, pedido.timestamp_entrega)
+        self.assertFalse(estados.transicionar(guardado, 'en_elaboracion', manual=True))
+
+    def test_destinos_reservados_al_sistema(self):
+        pedido = Pedidos.objects.get(id=self.pedido_id)
+        for destino in ('cancelado', 'validando_stock', 'enviado_cocina', 'inexistente'):
+            with self.assertRaises(estados.TransicionInvalida):
+                estados.transicionar(pedido, destino, manual=True)
+
+    def test_carrera_entre_dos_usuarios(self):
+        Pedidos.objects.filter(id=self.pedido_id).update(estado='listo')
+        # Dos pantallas cargaron el pedido en 'listo' y ambas lo marcan entregado
+        primera = Pedidos.objects.get(id=self.pedido_id)
+        segunda = Pedidos.objects.get(id=self.pedido_id)
+
+        self.assertTrue(estados.transicionar(primera, 'entregado', manual=True))
+        self.assertFalse(estados.transicionar(segunda, 'entregado', manual=True))
+        # La venta se acumula una sola vez
+        self.assertEqual(sum(VentaHoraria.objects.values_list('pedidos', flat=True)), 1)
+
+    def test_formulario_solo_ofrece_destinos_permitidos(self):
+        self.assertEqual(
+            [estado for estado, _ in estados.destinos_manuales('pendiente')], ['pendiente', 'en_elaboracion']
+        )
+        respuesta = self.client.get(f'/editar/{self.pedido_id}/')
+        self.assertContains(respuesta, 'value="en_elaboracion"')
+        self.assertNotContains(respuesta, 'value="cancelado"')
+        self.assertNotContains(respuesta, 'value="listo"')
+
+
+class ArchivoPedidosTest(TestCase):
+    """
+    Ida y vuelta por los segmentos del archivo (mainApp.archivo) y reanudación tras un corte
+    """
+    @classmethod
+    def setUpTestData(cls):
+        mesero = User.objects.create(username='mesero')
+        milanesa = Plato.objects.create(nombre='Milanesa', precio=10)
+        flan = Plato.objects.create(nombre='Flan', precio=Decimal('3.50'))
+        cls.pedidos = []
+        for i in range(5):
+            mesa = Mesas.objects.create(numero=str(i), ubicacion='Salón')
+            cls.pedidos.append(registrar_pedido(f'Cliente {i}', mesa.id, mesero.id, {milanesa.id: 1 + i, flan.id: 1}))
+        Pedidos.objects.update(estado='entregado', fecha_actualizacion=timezone.now() - timedelta(days=3))
+        cls.mes = timezone.localtime(cls.pedidos[0].fecha_creacion).strftime('%Y-%m')
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        configuracion = override_settings(ARCHIVO_PEDIDOS_DIR=Path(directorio.name))
+        configuracion.enable()
+        self.addCleanup(configuracion.disable)
+
+    def _archivados(self):
+        return sorted(registro['id'] for registro in archivo.leer_mes(self.mes))
+
+    def test_ida_y_vuelta(self):
+        resultado = archivo.archivar(dias=1, lote=2)
+
+        self.assertEqual(resultado['data']['archivados'], 5)
+        self.assertFalse(Pedidos.objects.exists())
+        self.assertEqual(self._archivados(), [pedido.id for pedido in self.pedidos])
+        registro = archivo.buscar_pedido(self.pedidos[2].id)
+        self.assertEqual((registro['nombre'], registro['total_neto']), ('Cliente 2', str(self.pedidos[2].total_neto)))
+        self.assertEqual([(detalle['plato'], detalle['cantidad']) for detalle in registro['detalles']], [('Milanesa', 3), ('Flan', 1)])
+
+    def test_corte_antes_de_eliminar(self):
+        with mock.patch.object(archivo.transaction, 'atomic', side_effect=RuntimeError('corte')):
+            with self.assertRaises(RuntimeError):
+                archivo.archivar(dias=1, lote=2)
+        self.assertEqual(Pedidos.objects.count(), 5)
+
+        resultado = archivo.archivar(dias=1, lote=2)
+
+        self.assertEqual(resultado['data']['archivados'], 5)
+        self.assertEqual(self._archivados(), [pedido.id for pedido in self.pedidos])
+
+    def test_corte_entre_bloque_e_indice(self):
+        # Un archivado anterior escribió un bloque y se cortó antes de indexarlo
+        ruta_segmento, ruta_indice = archivo._rutas(self.mes)
+        ruta_segmento.parent.mkdir(parents=True, exist_ok=True)
+        huerfano = zlib.compress(json.dumps({'id': self.pedidos[0].id}).encode('utf-8'))
+        ruta_segmento.write_bytes(archivo.CABECERA.pack(archivo.MAGIA, len(huerfano)) + huerfano)
+        self.assertEqual(self._archivados(), [])
+
+        archivo.archivar(dias=1)
+        archivo.archivar(dias=1)
+
+        self.assertEqual(self._archivados(), [pedido.id for pedido in self.pedidos])
+        self.assertEqual(ruta_indice.stat().st_size, 5 * archivo.REGISTRO_INDICE.size)
+
+
+@override_settings(ARCHIVO_PEDIDOS_DIR=Path(tempfile.gettempdir()) / 'pedidos-test-sin-archivo')
+class VentasAcumuladasTest(TestCase):
+    """
+    Los acumulados incrementales deben coincidir con una reconstrucción completa
+    """
+    @classmethod
+    def setUpTestData(cls):
+        mesero = User.objects.create(username='mesero')
+        cls.milanesa = Plato.objects.create(nombre='Milanesa', precio=10)
+        cls.flan = Plato.objects.create(nombre='Flan', precio=Decimal('3.50'))
+        cls.pedidos = []
+        for i in range(2):
+            mesa = Mesas.objects.create(numero=str(i), ubicacion='Salón')
+            pedido = registrar_pedido(f'Cliente {i}', mesa.id, mesero.id, {cls.milanesa.id: 2, cls.flan.id: 1})
+            Pedidos.objects.filter(id=pedido.id).update(estado='listo')
+            pedido.refresh_from_db()
+            estados.transicionar(pedido, 'entregado')
+            cls.pedidos.append(pedido)
+
+    def _acumulados(self):
+        campos = ('fecha', 'ingresos', 'unidades', 'descuento', 'pedidos')
+        return [
+            sorted(VentaDiariaPlato.objects.values_list('plato_id', *campos)),
+            sorted(VentaDiariaMesero.objects.values_list('mesero_id', *campos)),
+            sorted(VentaHoraria.objects.values_list('hora', *campos)),
+        ]
+
+    def assertCoincideConReconstruir(self):
+        incrementales = self._acumulados()
+        ventas.reconstruir()
+        self.assertEqual(incrementales, self._acumulados())
+
+    def test_entregas(self):
+        self.assertEqual(VentaDiariaPlato.objects.get(plato_id=self.milanesa.id).unidades, 4)
+        self.assertCoincideConReconstruir()
+
+    def test_descuento_y_platos_de_pedidos_entregados(self):
+        pedido = Pedidos.objects.get(id=self.pedidos[0].id)
+        pedido.descuento_porcentaje = Decimal('10')
+        pedido.save()
+        # Se quita el flan y se agrega una milanesa a un pedido ya entregado
+        actualizar_detalles(Pedidos.objects.get(id=self.pedidos[1].id), {self.milanesa.id: 3})
+
+        self.assertEqual(VentaDiariaPlato.objects.get(plato_id=self.flan.id).pedidos, 1)
+        self.assertCoincideConReconstruir()
+
+    def test_cambio_de_precio_posterior(self):
+        Plato.objects.filter(id=self.milanesa.id).update(precio=Decimal('99'))
+
+        self.assertEqual(VentaDiariaPlato.objects.get(plato_id=self.milanesa.id).ingresos, Decimal('40.00'))
+        self.assertCoincideConReconstruir()
+
+    def test_eliminar_pedido_entregado(self):
+        self.client.post(f'/eliminar/{self.pedidos[0].id}/')
+
+        self.assertFalse(Pedidos.objects.filter(id=self.pedidos[0].id).exists())
+        self.assertEqual(VentaDiariaPlato.objects.get(plato_id=self.milanesa.id).unidades, 2)
+        self.assertEqual(sum(VentaHoraria.objects.values_list('pedidos', flat=True)), 1)
+        self.assertCoincideConReconstruir()
+
+
+class CambioEstadoLoteTest(TestCase):
+    """
+    Cambio de estado masivo: cada pedido del lote se informa por separado
+    """
+    @classmethod
+    def setUpTestData(cls):
+        mesero = User.objects.create(username='mesero')
+        plato = Plato.objects.create(nombre='Milanesa', precio=10)
+        cls.pedidos = {}
+        for i, estado in enumerate(['listo', 'pendiente', 'en_elaboracion', 'entregado']):
+            mesa = Mesas.objects.create(numero=str(i), ubicacion='Salón')
+            pedido = registrar_pedido(f'Cliente {i}', mesa.id, mesero.id, {plato.id: 1})
+            Pedidos.objects.filter(id=pedido.id).update(estado=estado)
+            cls.pedidos[estado] = pedido.id
+
+    @override_settings(EVENTOS_SSE_HABILITADO=True)
+    def test_lote_mixto(self):
+        ahora = timezone.now()
+        # Un pedido ya entregado con la misma fecha_actualizacion que la transición no cuenta como aplicado
+        Pedidos.objects.filter(id=self.pedidos['entregado']).update(fecha_actualizacion=ahora)
+
+        with mock.patch('mainApp.estados.timezone.now', return_value=ahora):
+            respuesta = self.client.post('/pedidos/cambiar-estado/', {
+                'estado': 'entregado',
+                'pedidos[]': [*self.pedidos.values(), 999999],
+            })
+
+        datos = respuesta.json()
+        self.assertFalse(datos['success'])
+        resultados = datos['data']
+        self.assertTrue(resultados[str(self.pedidos['listo'])]['success'])
+        self.assertTrue(resultados[str(self.pedidos['en_elaboracion'])]['success'])
+        self.assertEqual(resultados[str(self.pedidos['pendiente'])], {
+            'success': False, 'estado': 'pendiente', 'message': 'No se puede pasar de "Pendiente" a "Entregado"',
+        })
+        self.assertFalse(resultados[str(self.pedidos['entregado'])]['success'])
+        self.assertEqual(resultados['999999']['estado'], None)
+
+        self.assertEqual(Pedidos.objects.get(id=self.pedidos['pendiente']).estado, 'pendiente')
+        self.assertEqual(Pedidos.objects.filter(estado='entregado', timestamp_entrega=ahora).count(), 2)
+        # Eventos y acumulados de ventas solo para los dos aplicados
+        self.assertEqual(EventoPedido.objects.filter(tipo='entregado').count(), 2)
+        self.assertEqual(sum(VentaHoraria.objects.values_list('pedidos', flat=True)), 2)
+
+
+class TableroPaginadoTest(TestCase):
+    """
+    Paginación por cursor del tablero (home): páginas completas, sin repetidos y con consultas constantes
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.meseros = [User.objects.create(username=f'mesero{i}') for i in range(2)]
+        plato = Plato.objects.create(nombre='Milanesa', precio=10)
+        cls.pedidos = []
+        for i in range(7):
+            mesa = Mesas.objects.create(numero=str(i), ubicacion='Salón')
+            cls.pedidos.append(registrar_pedido(f'Cliente {i}', mesa.id, cls.meseros[i % 2].id, {plato.id: 1}))
+        # Mismo instante de creación para todos: el ID desempata el orden
+        Pedidos.objects.update(fecha_creacion=timezone.now())
+        Pedidos.objects.filter(id=cls.pedidos[0].id).update(estado='entregado')
+
+    def _recorrer(self, **filtros):
+        ids, cursor = [], None
+        while True:
+            parametros = dict(filtros, **({'cursor': cursor} if cursor else {}))
+            contexto = self.client.get('/', parametros).context
+            ids.extend(pedido.id for pedido in contexto['pedidos'])
+            cursor = contexto['siguiente_cursor']
+            if cursor is None:
+                return ids
+
+    @override_settings(PEDIDOS_POR_PAGINA=3)
+    def test_recorre_todas_las_paginas(self):
+        activos = sorted((pedido.id for pedido in self.pedidos[1:]), reverse=True)
+
+        self.assertEqual(self._recorrer(), activos)
+        self.assertEqual(self._recorrer(estado='todos'), sorted((pedido.id for pedido in self.pedidos), reverse=True))
+        del_mesero = sorted((pedido.id for pedido in self.pedidos if pedido.mesero_id == self.meseros[1].id), reverse=True)
+        self.assertEqual(self._recorrer(estado='todos', mesero=self.meseros[1].id), del_mesero)
+
+    @override_settings(PEDIDOS_POR_PAGINA=3)
+    def test_consultas_constantes_por_pagina(self):
+        primera = self.client.get('/').context
+        self.assertEqual(len(primera['pedidos']), 3)
+
+        # Datos de referencia, mesas ocupadas, stock agotado y una sola consulta de pedidos con mesa y mesero
+        with self.assertNumQueries(4):
+            respuesta = self.client.get('/', {'cursor': primera['siguiente_cursor']})
+        self.assertContains(respuesta, 'mesero1')
+        self.assertEqual(len(respuesta.context['pedidos']), 3)
+
+    def test_cursor_invalido_muestra_la_primera_pagina(self):
+        contexto = self.client.get('/', {'cursor': 'no-es-un-cursor'}).context
+
+        self.assertEqual(contexto['cursor_actual'], '')
+        self.assertEqual(contexto['pedidos'][0].id, self.pedidos[-1].id)
+
+
+class TotalesDenormalizadosTest(TestCase):
+    """
+    total_neto y total_final de Pedidos siguen a sus detalles y al descuento sin consultas por línea
+    """
+    @classmethod
+    def setUpTestData(cls):
+        mesero = User.objects.create(username='mesero')
+        cls.platos = [Plato.objects.create(nombre=f'Plato {i}', precio=Decimal('2.35') * (i + 1)) for i in range(4)]
+        mesas_salon = [Mesas.objects.create(numero=str(i), ubicacion='Salón') for i in range(2)]
+        cls.corto = registrar_pedido('Corto', mesas_salon[0].id, mesero.id, {cls.platos[0].id: 1})
+        cls.largo = registrar_pedido('Largo', mesas_salon[1].id, mesero.id, {plato.id: 2 for plato in cls.platos})
+
+    def test_totales_al_crear(self):
+        self.assertEqual(self.corto.total_neto, Decimal('2.35'))
+        self.assertEqual(self.largo.total_neto, Decimal('47.00'))
+        self.assertEqual(self.largo.total_final, self.largo.total_neto)
+
+    def test_senales_de_detalles(self):
+        detalle = DetallePedido.objects.create(pedido=self.corto, plato=self.platos[3], cantidad=3)
+        self.assertEqual(Pedidos.objects.get(id=self.corto.id).total_neto, Decimal('30.55'))
+
+        detalle.cantidad = 1
+        detalle.save()
+        self.assertEqual(Pedidos.objects.get(id=self.corto.id).total_neto, Decimal('11.75'))
+
+        detalle.delete()
+        self.assertEqual(Pedidos.objects.get(id=self.corto.id).total_neto, Decimal('2.35'))
+
+    def test_totales_diferidos_recalcula_una_vez(self):
+        with totales_diferidos(), self.assertNumQueries(2):
+            DetallePedido.objects.filter(pedido=self.largo).first().delete()
+        self.assertEqual(Pedidos.objects.get(id=self.largo.id).total_neto, Decimal('47.00'))
+
+        Pedidos.recalcular_totales([self.largo.id])
+        self.assertEqual(Pedidos.objects.get(id=self.largo.id).total_neto, Decimal('42.30'))
+
+    def test_descuento_y_instancia_desactualizada(self):
+        vieja = Pedidos.objects.get(id=self.largo.id)
+        DetallePedido.objects.filter(pedido=self.largo, plato=self.platos[3]).delete()
+
+        vieja.descuento_porcentaje = Decimal('10')
+        vieja.save()
+
+        pedido = Pedidos.objects.get(id=self.largo.id)
+        self.assertEqual((pedido.total_neto, pedido.total_final), (Decimal('28.20'), Decimal('25.38')))
+        self.assertEqual((vieja.total_neto, vieja.total_final), (pedido.total_neto, pedido.total_final))
+
+    def test_cambio_de_precio_no_altera_pedidos_tomados(self):
+        # Como la sincronización con M1: un UPDATE masivo, sin señales
+        Plato.objects.update(precio=Decimal('100'))
+        Pedidos.recalcular_totales([self.largo.id, self.corto.id])
+
+        largo = Pedidos.objects.get(id=self.largo.id)
+        self.assertEqual(largo.total_neto, Decimal('47.00'))
+        self.assertEqual(sum(detalle.subtotal() for detalle in largo.detalles.all()), largo.total_neto)
+
+        # Las líneas nuevas toman el precio vigente; las existentes conservan el suyo
+        actualizar_detalles(self.corto, {self.platos[0].id: 2, self.platos[1].id: 1})
+        self.assertEqual(Pedidos.objects.get(id=self.corto.id).total_neto, Decimal('104.70'))
+
+    def test_detalle_sin_consultas_por_linea(self):
+        def consultas(pedido):
+            with CaptureQueriesContext(connection) as capturadas:
+                respuesta = self.client.get(f'/detalle/{pedido.id}/')
+            self.assertContains(respuesta, f'${pedido.total_final:.2f}'.replace('.', ','))  # Formato local
+            return len(capturadas)
+
+        self.assertEqual(consultas(self.largo), consultas(self.corto))
+
+
+class CreacionPedidoTest(TestCase):
+    """
+    registrar_pedido / crear_pedido: una transacción con consultas fijas, sin importar la cantidad de líneas
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.mesero = User.objects.create(username='mesero')
+        cls.platos = [Plato.objects.create(nombre=f'Plato {i}', precio=i + 1) for i in range(6)]
+        cls.mesas = [Mesas.objects.create(numero=str(i), ubicacion='Salón') for i in range(3)]
+
+    def _registrar(self, mesa, cantidad_platos):
+        lineas = {plato.id: 2 for plato in self.platos[:cantidad_platos]}
+        with CaptureQueriesContext(connection) as consultas:
+            pedido = registrar_pedido('Cliente', mesa.id, self.mesero.id, lineas)
+        return pedido, len(consultas)
+
+    def test_consultas_independientes_de_las_lineas(self):
+        corto, consultas_corto = self._registrar(self.mesas[0], 1)
+        # Savepoint, platos, mesero, ocupar la mesa, pedido, detalles y fin del savepoint
+        with self.assertNumQueries(7):
+            largo, consultas_largo = self._registrar(self.mesas[1], 6)
+
+        self.assertEqual(consultas_corto, consultas_largo)
+        self.assertEqual(largo.detalles.count(), 6)
+        self.assertEqual(largo.total_neto, Decimal('42.00'))
+
+    def test_platos_repetidos_se_fusionan(self):
+        plato = self.platos[0]
+        respuesta = self.client.post('/crear/', {
+            'nombre': 'Cliente', 'mesa': self.mesas[0].id, 'mesero': self.mesero.id,
+            'platos[]': [plato.id, plato.id, self.platos[1].id], 'cantidades[]': ['1', '2', '0'],
+        })
+
+        pedido = Pedidos.objects.get()
+        self.assertRedirects(respuesta, f'/detalle/{pedido.id}/', fetch_redirect_response=False)
+        self.assertEqual(list(pedido.detalles.values_list('plato_id', 'cantidad')), [(plato.id, 3)])
+
+    def test_error_no_deja_la_mesa_ocupada(self):
+        with self.assertRaises(PedidoError):
+            registrar_pedido('Cliente', self.mesas[0].id, self.mesero.id, {self.platos[0].id: 1, 999999: 1})
+
+        with mock.patch.object(DetallePedido.objects, 'bulk_create', side_effect=RuntimeError('corte')):
+            with self.assertRaises(RuntimeError):
+                registrar_pedido('Cliente', self.mesas[0].id, self.mesero.id, {self.platos[0].id: 1})
+
+        self.assertFalse(Pedidos.objects.exists())
+        self.assertFalse(Mesas.objects.get(id=self.mesas[0].id).ocupada)
+
+
+class DetallesDiferencialesTest(TestCase):
+    """
+    actualizar_detalles solo escribe las líneas que cambiaron y conserva la identidad de las demás
+    """
+    @classmethod
+    def setUpTestData(cls):
+        mesero = User.objects.create(username='mesero')
+        cls.platos = [Plato.objects.create(nombre=f'Plato {i}', precio=i + 1) for i in range(4)]
+        mesa = Mesas.objects.create(numero='1', ubicacion='Salón')
+        cls.pedido = registrar_pedido('Cliente', mesa.id, mesero.id, {plato.id: 1 for plato in cls.platos[:3]})
+
+    def _detalles(self):
+        return dict(DetallePedido.objects.filter(pedido=self.pedido).values_list('plato_id', 'id'))
+
+    def test_sin_cambios_no_escribe(self):
+        pedido = Pedidos.objects.get(id=self.pedido.id)
+        lineas = {plato.id: 1 for plato in self.platos[:3]}
+
+        # Solo se leen los detalles actuales, entre los savepoints de la transacción y del ajuste de ventas
+        with self.assertNumQueries(5):
+            cambios = actualizar_detalles(pedido, lineas)
+
+        self.assertEqual(cambios['delta'], {})
+
+    def test_una_cantidad_una_escritura(self):
+        antes = self._detalles()
+        pedido = Pedidos.objects.get(id=self.pedido.id)
+        lineas = {self.platos[0].id: 5, self.platos[1].id: 1, self.platos[2].id: 1}
+
+        with CaptureQueriesContext(connection) as consultas:
+            cambios = actualizar_detalles(pedido, lineas)
+
+        escrituras = [c['sql'] for c in consultas.captured_queries if c['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(len([sql for sql in escrituras if DetallePedido._meta.db_table in sql]), 1)
+        self.assertEqual(cambios['actualizados'], [{'plato_id': self.platos[0].id, 'cantidad_anterior': 1, 'cantidad': 5}])
+        self.assertEqual(self._detalles(), antes)
+        self.assertEqual(Pedidos.objects.get(id=self.pedido.id).total_neto, Decimal('10.00'))
+
+    def test_alta_baja_y_modificacion(self):
+        antes = self._detalles()
+        pedido = Pedidos.objects.get(id=self.pedido.id)
+        lineas = {self.platos[0].id: 1, self.platos[1].id: 3, self.platos[3].id: 2}
+
+        cambios = actualizar_detalles(pedido, lineas)
+
+        self.assertEqual(cambios['delta'], {self.platos[3].id: 2, self.platos[2].id: -1, self.platos[1].id: 2})
+        despues = self._detalles()
+        self.assertEqual(despues[self.platos[0].id], antes[self.platos[0].id])
+        self.assertEqual(despues[self.platos[1].id], antes[self.platos[1].id])
+        self.assertNotIn(self.platos[2].id, despues)
+        self.assertEqual((pedido.total_neto, Pedidos.objects.get(id=pedido.id).total_neto), (Decimal('15.00'), Decimal('15.00')))
+
+    def test_plato_inexistente_no_modifica_nada(self):
+        antes = self._detalles()
+
+        with self.assertRaises(PedidoError):
+            actualizar_detalles(Pedidos.objects.get(id=self.pedido.id), {self.platos[0].id: 9, 999999: 1})
+
+        self.assertEqual(self._detalles(), antes)
+        self.assertEqual(DetallePedido.objects.get(id=antes[self.platos[0].id]).cantidad, 1)
+
+
+class StockLocalTest(TestCase):
+    """
+    Copia local del stock de M1 (mainApp.stock_local): refresco masivo, vigencia y descuento optimista
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.mesero = User.objects.create(username='mesero')
+        cls.milanesa = Plato.objects.create(nombre='Milanesa', precio=10, plato_id_m1=1)
+        cls.flan = Plato.objects.create(nombre='Flan', precio=4, plato_id_m1=2)
+        cls.mesa = Mesas.objects.create(numero='1', ubicacion='Salón')
+
+    def _refrescar(self, stock):
+        respuesta = {'success': True, 'message': '', 'data': [
+            {'plato_id': plato_id, 'disponible': disponible} for plato_id, disponible in stock.items()
+        ]}
+        with mock.patch.object(stock_local.menu_api, 'obtener_stock', return_value=respuesta):
+            return stock_local.refrescar()
+
+    def test_refresco_en_una_escritura(self):
+        self._refrescar({1: 5, 2: 0})
+
+        with self.assertNumQueries(1):
+            self._refrescar({1: 3, 2: 8, 3: 1})
+
+        self.assertEqual(dict(StockPlatoM1.objects.values_list('plato_id_m1', 'disponible')), {1: 3, 2: 8, 3: 1})
+
+    def test_agotados_solo_con_copia_vigente(self):
+        self._refrescar({1: 2, 2: 0})
+        pedido = [{'plato_id': 1, 'cantidad': 1}, {'plato_id': 1, 'cantidad': 2}, {'plato_id': 2, 'cantidad': 1}, {'plato_id': 9, 'cantidad': 1}]
+
+        with self.assertNumQueries(1):
+            self.assertEqual(sorted(stock_local.agotados(pedido)), [1, 2])
+        self.assertEqual(stock_local.ids_agotados(), {2})
+
+        StockPlatoM1.objects.filter(plato_id_m1=2).update(actualizado_en=timezone.now() - timedelta(hours=1))
+        self.assertEqual(stock_local.agotados(pedido), [1])
+        self.assertEqual(stock_local.ids_agotados(), set())
+
+    def test_descuento_optimista(self):
+        self._refrescar({1: 5, 2: 4})
+
+        with self.assertNumQueries(1):
+            stock_local.descontar([{'plato_id': 1, 'cantidad': 2}, {'plato_id': 2, 'cantidad': 1}, {'plato_id': 1, 'cantidad': 1}])
+
+        self.assertEqual(dict(StockPlatoM1.objects.values_list('plato_id_m1', 'disponible')), {1: 2, 2: 3})
+
+    @override_settings(STOCK_LOCAL_REFRESCO_SEGUNDOS=30)
+    def test_refresco_periodico_se_reprograma(self):
+        respuesta = {'success': True, 'message': '', 'data': [{'plato_id': 1, 'disponible': 7}]}
+        salida = io.StringIO()
+        with mock.patch.object(stock_local.menu_api, 'obtener_stock', return_value=respuesta):
+            # run_worker programa el primer refresco y lo ejecuta enseguida
+            call_command('run_worker', once=True, stdout=salida)
+
+        self.assertIn('(refrescar_stock_m1) -> completada', salida.getvalue())
+        self.assertEqual(StockPlatoM1.objects.get(plato_id_m1=1).disponible, 7)
+        siguiente = Tarea.objects.get(tipo='refrescar_stock_m1', estado='pendiente')
+        self.assertEqual(siguiente.payload, {'periodica': True})
+        self.assertAlmostEqual((siguiente.disponible_desde - timezone.now()).total_seconds(), 30, delta=5)
+        self.assertIsNone(tareas.programar_refresco_stock())
+
+    def test_pedido_con_plato_agotado_no_llega_a_m1(self):
+        self._refrescar({1: 5, 2: 0})
+
+        with self.assertRaisesMessage(PedidoError, 'Sin stock suficiente: Flan'):
+            registrar_pedido('Cliente', self.mesa.id, self.mesero.id, {self.milanesa.id: 1, self.flan.id: 1})
+        self.assertFalse(Mesas.objects.get(id=self.mesa.id).ocupada)
+
+        Pedidos.objects.all().delete()
+        pedido = registrar_pedido('Cliente', self.mesa.id, self.mesero.id, {self.milanesa.id: 1})
+        StockPlatoM1.objects.filter(plato_id_m1=1).update(disponible=0)
+        with mock.patch('mainApp.views.menu_api_async.validar_stock') as validar:
+            respuesta = self.client.post(f'/pedido/{pedido.id}/validar-stock/')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('Sin stock suficiente: Milanesa', respuesta.json()['message'])
+        validar.assert_not_called()
+
+
+class ReferenciaCacheTest(TestCase):
+    """
+    Caché de menú, meseros y mesas (mainApp.referencia) invalidada por generación entre workers
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.meseros = Group.objects.create(name='Meseros')
+        User.objects.create(username='mesero').groups.add(cls.meseros)
+        Plato.objects.create(nombre='Milanesa', precio=10, plato_id_m1=1)
+        Mesas.objects.create(numero='1', ubicacion='Salón')
+
+    def setUp(self):
+        copia = mock.patch.dict(referencia._cache, clear=True)
+        copia.start()
+        self.addCleanup(copia.stop)
+
+    def test_sin_cambios_una_consulta(self):
+        referencia.obtener('menu', 'personal', 'mesas')
+
+        with self.assertNumQueries(1):
+            datos = referencia.obtener('menu', 'personal', 'mesas')
+
+        self.assertEqual((datos['menu']['con_id_m1'], datos['menu']['sin_id_m1']), (1, 0))
+        self.assertEqual([mesero.username for mesero in datos['personal']], ['mesero'])
+
+    def test_senal_invalida_solo_su_clave_al_confirmar(self):
+        referencia.obtener('menu', 'mesas')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            Plato.objects.create(nombre='Flan', precio=4)
+        # Hasta confirmar la transacción la generación no cambia
+        with self.assertNumQueries(1):
+            referencia.obtener('menu', 'mesas')
+        for callback in callbacks:
+            callback()
+
+        # Generaciones y menú; las mesas siguen en memoria
+        with self.assertNumQueries(2):
+            datos = referencia.obtener('menu', 'mesas')
+        self.assertEqual([plato.nombre for plato in datos['menu']['platos']], ['Flan', 'Milanesa'])
+        self.assertEqual(datos['menu']['sin_id_m1'], 1)
+
+    def test_cambio_desde_otro_worker(self):
+        referencia.obtener('mesas')
+        # Otro proceso modificó las mesas con update() e incrementó la generación
+        Mesas.objects.update(ubicacion='Terraza')
+        GeneracionCache.objects.update_or_create(clave='mesas', defaults={'generacion': 41})
+
+        self.assertEqual(referencia.obtener('mesas')['mesas'][0]['ubicacion'], 'Terraza')
+
+    def test_ocupar_y_liberar_no_invalidan_las_mesas(self):
+        mesa = Mesas.objects.get()
+        referencia.obtener('mesas')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertTrue(mesas.ocupar(mesa.id))
+        self.assertEqual(callbacks, [])
+
+        # La caché sigue vigente y la ocupación se lee aparte
+        with self.assertNumQueries(2):
+            disponibles = mesas.con_ocupacion(referencia.obtener('mesas')['mesas'])
+        self.assertEqual(disponibles, [])
+        self.assertEqual(
+            mesas.con_ocupacion(referencia.obtener('mesas')['mesas'], incluir=mesa.id),
+            [{'id': mesa.id, 'numero': '1', 'ubicacion': 'Salón', 'ocupada': True}]
+        )
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertTrue(mesas.liberar(mesa.id))
+        self.assertEqual(callbacks, [])
+        self.assertEqual([m['ocupada'] for m in mesas.con_ocupacion(referencia.obtener('mesas')['mesas'])], [False])
+
+    def test_grupos_invalidan_el_personal(self):
+        referencia.obtener('personal')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create(username='nuevo').groups.add(self.meseros)
+
+        self.assertEqual([mesero.username for mesero in referencia.obtener('personal')['personal']], ['mesero', 'nuevo'])
+
+
+class BloqueosSQLiteTest(SimpleTestCase):
+    """
+    Perfil de producción de SQLite y reintento de @reintentar_si_bloqueada ante "database is locked"
+    """
+    def setUp(self):
+        espera = mock.patch('mainApp.bloqueos.time.sleep')
+        self.dormir = espera.start()
+        self.addCleanup(espera.stop)
+        fuera_de_transaccion = mock.patch('mainApp.bloqueos.connection', in_atomic_block=False)
+        self.conexion = fuera_de_transaccion.start()
+        self.addCleanup(fuera_de_transaccion.stop)
+
+    def _decorada(self, errores):
+        funcion = mock.Mock(side_effect=[*errores, 'ok'], __name__='escribir')
+        return funcion, reintentar_si_bloqueada(funcion)
+
+    def test_reintenta_hasta_lograrlo(self):
+        funcion, decorada = self._decorada([OperationalError('database is locked')] * 2)
+
+        with mock.patch('mainApp.bloqueos.random.uniform', return_value=1), self.assertLogs('mainApp.bloqueos', 'WARNING'):
+            self.assertEqual(decorada(), 'ok')
+        self.assertEqual(funcion.call_count, 3)
+        self.assertEqual([llamada.args[0] for llamada in self.dormir.call_args_list], [0.05, 0.1])  # Espera exponencial
+
+    @override_settings(SQLITE_REINTENTOS=2)
+    def test_agota_los_reintentos(self):
+        funcion, decorada = self._decorada([OperationalError('database is locked')] * 5)
+
+        with self.assertRaises(OperationalError), self.assertLogs('mainApp.bloqueos', 'WARNING'):
+            decorada()
+        self.assertEqual(funcion.call_count, 3)
+
+    def test_no_reintenta_otros_errores_ni_dentro_de_una_transaccion(self):
+        funcion, decorada = self._decorada([OperationalError('no such table: x')])
+        with self.assertRaises(OperationalError):
+            decorada()
+        self.assertEqual(funcion.call_count, 1)
+
+        self.conexion.in_atomic_block = True
+        funcion, decorada = self._decorada([OperationalError('database is locked')])
+        with self.assertRaises(OperationalError):
+            decorada()
+        self.assertEqual(funcion.call_count, 1)
+        self.dormir.assert_not_called()
+
+    def test_perfil_de_produccion_solo_en_los_servidores(self):
+        # manage.py (check, migrate, pruebas) no debe pasar a WAL la base del repositorio
+        entorno = {nombre: valor for nombre, valor in os.environ.items() if nombre != 'SQLITE_PERFIL'}
+        entorno['DJANGO_SETTINGS_MODULE'] = 'Pedidos.settings'
+
+        def perfil(importar):
+            codigo = f'{importar}; from django.conf import settings; print(settings.SQLITE_PERFIL)'
+            return subprocess.run(
+                [sys.executable, '-c', codigo], cwd=settings.BASE_DIR, env=entorno,
+                check=True, capture_output=True, text=True,
+            ).stdout.strip()
+
+        self.assertEqual(perfil('import django; django.setup()'), 'basico')
+        self.assertEqual(perfil('import Pedidos.wsgi'), 'produccion')
+        self.assertEqual(perfil('import Pedidos.asgi'), 'produccion')
+
+    def test_perfil_de_produccion(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            def conectar(**opciones):
+                configuracion = dict(connection.settings_dict, NAME=os.path.join(directorio, 'perfil.sqlite3'))
+                configuracion['OPTIONS'] = dict(settings.SQLITE_OPCIONES_PRODUCCION, **opciones)
+                return connections['default'].__class__(configuracion, alias='perfil')
+
+            escritor, lector = conectar(), conectar(timeout=0.05, init_command='PRAGMA busy_timeout=50')
+            try:
+                with escritor.cursor() as cursor:
+                    cursor.execute('CREATE TABLE prueba (id INTEGER)')
+                    pragmas = [cursor.execute(f'PRAGMA {pragma}').fetchone()[0] for pragma in ('journal_mode', 'synchronous', 'busy_timeout')]
+                self.assertEqual(pragmas, ['wal', 1, settings.SQLITE_BUSY_TIMEOUT_MS])
+
+                # Con el escritor dentro de BEGIN IMMEDIATE, otro escritor falla con un error reintentable
+                escritor.set_autocommit(False)
+                with escritor.cursor() as cursor:
+                    cursor.execute('INSERT INTO prueba VALUES (1)')
+                with self.assertRaises(OperationalError) as error, lector.cursor() as cursor:
+                    cursor.execute('INSERT INTO prueba VALUES (2)')
+                self.assertTrue(es_bloqueo(error.exception))
+                # WAL: los lectores no esperan al escritor
+                with lector.cursor() as cursor:
+                    self.assertEqual(cursor.execute('SELECT COUNT(*) FROM prueba').fetchone()[0], 0)
+                escritor.rollback()
+            finally:
+                escritor.close()
+                lector.close()
+
+
+class ExportacionPedidosTest(TestCase):
+    """
+    Exportación por streaming (mainApp.exportacion): archivo y tablas activas, CSV y JSONL
+    """
+    @classmethod
+    def setUpTestData(cls):
+        mesero = User.objects.create(username='mesero')
+        cls.milanesa = Plato.objects.create(nombre='Milanesa', precio=10)
+        cls.flan = Plato.objects.create(nombre='Flan', precio=Decimal('3.50'))
+        cls.pedidos = []
+        for i in range(3):
+            mesa = Mesas.objects.create(numero=str(i), ubicacion='Salón')
+            cls.pedidos.append(registrar_pedido(f'Cliente {i}', mesa.id, mesero.id, {cls.milanesa.id: 1 + i, cls.flan.id: 1}))
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        configuracion = override_settings(ARCHIVO_PEDIDOS_DIR=Path(directorio.name))
+        configuracion.enable()
+        self.addCleanup(configuracion.disable)
+        self.directorio = Path(directorio.name)
+
+        # El primer pedido ya está en el archivo; los otros dos siguen en la base
+        Pedidos.objects.filter(id=self.pedidos[0].id).update(
+            estado='entregado', fecha_actualizacion=timezone.now() - timedelta(days=3)
+        )
+        archivo.archivar(dias=1)
+
+    def _descargar(self, parametros=None):
+        respuesta = self.client.get('/exportar/pedidos/', parametros or {})
+        self.assertTrue(respuesta.streaming)
+        return respuesta, b''.join(respuesta.streaming_content).decode('utf-8')
+
+    def test_csv_incluye_los_archivados(self):
+        with self.assertNumQueries(1):  # El archivo no consulta la base; las activas, una sola lectura
+            respuesta, contenido = self._descargar()
+
+        self.assertEqual(respuesta['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="pedidos-pedidos-inicio-', respuesta['Content-Disposition'])
+        encabezado, *filas = list(csv.reader(io.StringIO(contenido)))
+        self.assertEqual(encabezado, exportacion.COLUMNAS['pedidos'])
+        self.assertEqual(
+            [(int(fila[0]), fila[1], fila[4], fila[9]) for fila in filas],
+            [(pedido.id, pedido.nombre, estado, '%.2f' % pedido.total_neto)
+             for pedido, estado in zip(self.pedidos, ['entregado', 'pendiente', 'pendiente'])]
+        )
+
+    def test_jsonl_por_linea_con_filtros(self):
+        with self.assertNumQueries(1):
+            respuesta, contenido = self._descargar({'nivel': 'lineas', 'formato': 'jsonl', 'estado': 'entregado'})
+
+        self.assertEqual(respuesta['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        lineas = [json.loads(linea) for linea in contenido.splitlines()]
+        self.assertEqual(
+            [(linea['pedido_id'], linea['plato'], linea['cantidad'], linea['subtotal']) for linea in lineas],
+            [(self.pedidos[0].id, 'Milanesa', 1, '10.00'), (self.pedidos[0].id, 'Flan', 1, '3.50')]
+        )
+
+        manana = (timezone.localdate() + timedelta(days=1)).isoformat()
+        _, contenido = self._descargar({'formato': 'jsonl', 'desde': manana})
+        self.assertEqual(contenido, '')
+
+    @override_settings(SERVIDOR_ASGI=True)
+    async def test_asgi_envia_por_bloques(self):
+        respuesta = await self.async_client.get('/exportar/pedidos/', {'formato': 'jsonl'})
+
+        self.assertTrue(respuesta.is_async)
+        contenido = ''.join([bloque.decode('utf-8') async for bloque in respuesta.streaming_content])
+        self.assertEqual([json.loads(linea)['pedido_id'] for linea in contenido.splitlines()], [pedido.id for pedido in self.pedidos])
+
+    def test_aiterar_no_lee_mas_de_un_bloque_por_adelantado(self):
+        producidas = []
+
+        def lineas():
+            for i in range(5):
+                producidas.append(i)
+                yield f'{i}\n'
+
+        async def primer_bloque():
+            flujo = exportacion.aiterar(lineas(), tamano=2)
+            bloque = await anext(flujo)
+            await flujo.aclose()
+            return bloque
+
+        self.assertEqual(async_to_sync(primer_bloque)(), '0\n1\n')
+        self.assertEqual(producidas, [0, 1])
+
+    def test_lecturas_por_lotes(self):
+        for i in range(3, 6):
+            registrar_pedido(f'Cliente {i}', Mesas.objects.create(numero=str(i), ubicacion='Salón').id,
+                             self.pedidos[0].mesero_id, {self.flan.id: 1})
+        filas = exportacion.filas('lineas', incluir_archivo=False, chunk_size=2)
+
+        with self.assertNumQueries(1):  # iterator() recorre el cursor sin volver a consultar
+            primera = next(filas)
+        with self.assertNumQueries(0):
+            resto = list(filas)
+        self.assertEqual(len(resto) + 1, 2 * 2 + 3)
+        self.assertEqual(primera[5:], (self.milanesa.id, 'Milanesa', Decimal('10.00'), 2, Decimal('20.00')))
+
+    def test_parametros_invalidos(self):
+        for parametros in ({'estado': 'perdido'}, {'nivel': 'platos'}, {'formato': 'xml'}, {'desde': '18/10/2026'}):
+            with self.subTest(parametros=parametros):
+                respuesta = self.client.get('/exportar/pedidos/', parametros)
+                self.assertEqual(respuesta.status_code, 400)
+                self.assertFalse(respuesta.json()['success'])
+
+    def test_comando(self):
+        salida = self.directorio / 'lineas.csv'
+        errores = io.StringIO()
+        call_command('exportar_pedidos', nivel='lineas', sin_archivo=True, salida=str(salida), stderr=errores)
+
+        self.assertIn('4 filas exportadas', errores.getvalue())
+        with open(salida, encoding='utf-8', newline='') as exportado:
+            filas = list(csv.DictReader(exportado))
+        self.assertEqual({int(fila['pedido_id']) for fila in filas}, {self.pedidos[1].id, self.pedidos[2].id})
+
+        estandar = io.StringIO()
+        call_command('exportar_pedidos', formato='jsonl', stdout=estandar)
+        self.assertEqual(len(estandar.getvalue().splitlines()), 3)
+
+
+class PlanConsultasTest(TestCase):
+    """
+    Las consultas frecuentes sobre pedidos deben resolverse con los índices de
+    Pedidos.Meta.indexes y nunca recorrer la tabla completa
+    """
+    TABLA = Pedidos._meta.db_table
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.mesero = User.objects.create(username='mesero')
+        plato = Plato.objects.create(nombre='Milanesa', precio=10)
+        cls.mesas = [Mesas.objects.create(numero=str(i), ubicacion='Salón') for i in range(5)]
+        for mesa in cls.mesas:
+            registrar_pedido('Cliente', mesa.id, cls.mesero.id, {plato.id: 1})
+
+    def _planes(self, funcion):
+        """
+        Ejecuta la función y retorna el EXPLAIN QUERY PLAN de cada consulta que toca la tabla de pedidos
+        """
+        with CaptureQueriesContext(connection) as consultas:
+            funcion()
+        planes = []
+        with connection.cursor() as cursor:
+            for consulta in consultas.captured_queries:
+                if self.TABLA not in consulta['sql'] or consulta['sql'].startswith(('SAVEPOINT', 'RELEASE')):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + consulta['sql'])
+                planes.append([fila[-1] for fila in cursor.fetchall()])
+        self.assertTrue(planes, 'No se ejecutaron consultas sobre pedidos')
+        return planes
+
+    def _assert_usa_indice(self, funcion, indice):
+        planes = self._planes(funcion)
+        detalle = [paso for plan in planes for paso in plan]
+        self.assertTrue(any(f'INDEX {indice}' in paso for paso in detalle), detalle)
+        for paso in detalle:
+            # "SCAN mainApp_pedidos" sin índice es un recorrido completo de la tabla
+            self.assertFalse(paso.rstrip() in (f'SCAN {self.TABLA}', f'SCAN TABLE {self.TABLA}'), detalle)
+
+    def test_tablero_activos(self):
+        self._assert_usa_indice(lambda: self.client.get('/'), 'pedido_estado_fecha_idx')
+
+    def test_tablero_por_estado(self):
+        self._assert_usa_indice(lambda: self.client.get('/', {'estado': 'listo'}), 'pedido_estado_fecha_idx')
+
+    def test_tablero_todos(self):
+        self._assert_usa_indice(lambda: self.client.get('/', {'estado': 'todos'}), 'pedido_fecha_idx')
+
+    def test_tablero_por_mesero(self):
+        self._assert_usa_indice(
+            lambda: self.client.get('/', {'estado': 'todos', 'mesero': self.mesero.id}), 'pedido_mesero_fecha_idx'
+        )
+
+    def test_pedidos_por_mesa(self):
+        self._assert_usa_indice(
+            lambda: self.client.get(f'/mesa/{self.mesas[0].id}/pedidos/'), 'pedido_mesa_abierto_idx'
+        )
+
+    def test_liberar_mesa(self):
+        self._assert_usa_indice(lambda: mesas.liberar(self.mesas[0].id), 'pedido_mesa_activo_idx')
+
+    def test_condicion_de_indices_activos(self):
+        # La condición del índice parcial repite la lista de estados activos: deben coincidir
+        indice = next(i for i in Pedidos._meta.indexes if i.name == 'pedido_mesa_activo_idx')
+        self.assertEqual(dict(indice.condition.children)['estado__in'], Pedidos.ESTADOS_ACTIVOS)
+
+
+class SincronizacionMenuM1Test(TestCase):
+    """
+    Conciliación del catálogo de M1 con Plato (menu_m1.sincronizar), sin llamar a M1
+    """
+    def _sincronizar(self, platos, etag='"v1"', sin_cambios=False):
+        respuesta = {
+            'success': True,
+            'message': '',
+            'data': {'platos': platos, 'etag': etag, 'sin_cambios': sin_cambios},
+        }
+        with mock.patch.object(menu_m1.menu_api, 'obtener_menu', return_value=respuesta) as obtener:
+            with self.captureOnCommitCallbacks(execute=True):
+                resultado = menu_m1.sincronizar()
+        return resultado['data'], obtener
+
+    def test_concilia_por_id_y_por_nombre(self):
+        Plato.objects.create(nombre='Milanesa Napolitana', precio=10)
+        Plato.objects.create(nombre='Flan', precio=4, plato_id_m1=7)
+        Plato.objects.create(nombre='Plato local', precio=1)
+
+        datos, _ = self._sincronizar([
+            {'id': 3, 'nombre': 'milanesa  napolitána', 'precio': '12.50'},
+            {'id': 7, 'nombre': 'Flan casero', 'precio': '4.00'},
+            {'id': 9, 'nombre': 'Tarta', 'precio': '6'},
+        ])
+
+        self.assertEqual((datos['creados'], datos['actualizados'], datos['sin_id_m1']), (1, 2, 1))
+        milanesa = Plato.objects.get(plato_id_m1=3)
+        self.assertEqual(milanesa.nombre, 'milanesa  napolitána')
+        self.assertEqual(milanesa.precio, Decimal('12.50'))
+        self.assertEqual(Plato.objects.get(plato_id_m1=7).nombre, 'Flan casero')
+        self.assertTrue(Plato.objects.filter(nombre='Tarta', plato_id_m1=9).exists())
+        self.assertEqual(GeneracionCache.objects.get(clave='menu').generacion, 1)
+
+    def test_nombre_de_otro_plato_m1_es_conflicto(self):
+        Plato.objects.create(nombre='Flan', precio=4, plato_id_m1=7)
+
+        datos, _ = self._sincronizar([{'id': 8, 'nombre': 'FLAN', 'precio': '5'}])
+
+        self.assertEqual((datos['creados'], datos['conflictos']), (0, 1))
+        self.assertEqual(Plato.objects.get().plato_id_m1, 7)
+
+    def test_siguiente_sincronizacion_es_incremental(self):
+        self._sincronizar([{'id': 1, 'nombre': 'Tarta', 'precio': '6'}])
+        estado = SincronizacionM1.objects.get(recurso=menu_m1.RECURSO)
+
+        datos, obtener = self._sincronizar([], sin_cambios=True)
+
+        obtener.assert_called_once_with(etag='"v1"', actualizado_desde=estado.actualizado_hasta)
+        self.assertEqual((datos['creados'], datos['actualizados']), (0, 0))
+
+
+class ColaTareasTest(TestCase):
+    """
+    Reclamo, reintentos, dead-letter y deduplicación de la cola de tareas (mainApp.tareas)
+    """
+    @classmethod
+    def setUpTestData(cls):
+        mesero = User.objects.create(username='mesero')
+        plato = Plato.objects.create(nombre='Milanesa', precio=10)
+        mesa = Mesas.objects.create(numero='1', ubicacion='Salón')
+        cls.pedido = registrar_pedido('Cliente', mesa.id, mesero.id, {plato.id: 1})
+
+    def setUp(self):
+        self.manejador = mock.Mock(return_value={'ok': True})
+        registro = mock.patch.dict(tareas._manejadores, {'prueba': lambda payload, tarea: self.manejador(payload)})
+        registro.start()
+        self.addCleanup(registro.stop)
+
+    def test_una_tarea_se_reclama_una_sola_vez(self):
+        tarea = tareas.encolar('prueba', {'n': 1})
+
+        reclamada = tareas.reclamar('trabajador-1')
+
+        self.assertEqual((reclamada.id, reclamada.estado, reclamada.intentos), (tarea.id, 'en_proceso', 1))
+        self.assertIsNone(tareas.reclamar('trabajador-2'))
+        self.assertEqual(tareas.ejecutar(reclamada), 'completada')
+        self.assertEqual(Tarea.objects.get(id=tarea.id).resultado, {'ok': True})
+
+    def test_error_reintenta_con_backoff(self):
+        self.manejador.side_effect = Exception('M1 no responde')
+        tarea = tareas.encolar('prueba')
+
+        self.assertEqual(tareas.ejecutar(tareas.reclamar('trabajador')), 'pendiente')
+
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.intentos, tarea.trabajador), (1, 'trabajador'))
+        self.assertIn('M1 no responde', tarea.ultimo_error)
+        self.assertGreater(tarea.disponible_desde, timezone.now())
+        self.assertIsNone(tareas.reclamar('trabajador'))  # Sigue esperando su backoff
+
+    def test_ultimo_intento_pasa_a_fallida(self):
+        self.manejador.side_effect = Exception('M1 no responde')
+        tarea = tareas.encolar('prueba')
+        Tarea.objects.filter(id=tarea.id).update(intentos=tarea.max_intentos - 1)
+
+        self.assertEqual(tareas.ejecutar(tareas.reclamar('trabajador')), 'fallida')
+        self.assertEqual(Tarea.objects.get(id=tarea.id).estado, 'fallida')
+
+    def test_bloqueo_vencido_sin_intentos_pasa_a_fallida(self):
+        vencido = timezone.now() - timedelta(minutes=5)
+        agotada = tareas.encolar('prueba')
+        reintento = tareas.encolar('prueba')
+        Tarea.objects.filter(id=agotada.id).update(estado='en_proceso', bloqueada_hasta=vencido, intentos=agotada.max_intentos)
+        Tarea.objects.filter(id=reintento.id).update(estado='en_proceso', bloqueada_hasta=vencido, intentos=1)
+
+        reclamada = tareas.reclamar('trabajador')
+
+        self.assertEqual((reclamada.id, reclamada.intentos), (reintento.id, 2))
+        self.assertEqual(Tarea.objects.get(id=agotada.id).estado, 'fallida')
+        self.assertIsNone(tareas.reclamar('trabajador'))
+
+    def test_reintento_tras_un_corte_no_consume_dos_veces(self):
+        plato = Plato.objects.create(nombre='Flan', precio=4, plato_id_m1=7)
+        pedido = registrar_pedido('Otro', Mesas.objects.create(numero='2', ubicacion='Salón').id, self.pedido.mesero_id, {plato.id: 2})
+        Pedidos.objects.filter(id=pedido.id).update(estado='validando_stock', stock_validado=True)
+        tarea, _ = tareas.encolar_para_pedido('consumir_stock', pedido, {'pedido_id': pedido.id})
+        respuesta = mock.Mock(status_code=200)
+        respuesta.json.return_value = {'consumido': True}
+
+        with mock.patch.object(tareas.menu_api.session, 'request', return_value=respuesta) as m1:
+            # M1 acepta el consumo y el trabajador se corta antes de terminar la tarea
+            with mock.patch('mainApp.tareas.estados.transicionar', side_effect=RuntimeError('corte')):
+                self.assertEqual(tareas.ejecutar(tareas.reclamar('trabajador-1')), 'pendiente')
+            Tarea.objects.filter(id=tarea.id).update(disponible_desde=timezone.now())
+
+            self.assertEqual(tareas.ejecutar(tareas.reclamar('trabajador-2')), 'completada')
+
+        m1.assert_called_once()
+        self.assertEqual(m1.call_args.kwargs['headers'], {'Idempotency-Key': f'consumo-pedido-{pedido.id}'})
+        pedido.refresh_from_db()
+        self.assertEqual((pedido.estado, pedido.stock_consumido), ('enviado_cocina', True))
+        self.assertEqual(Tarea.objects.get(id=tarea.id).resultado['omitida'], True)
+
+    def test_una_tarea_activa_por_pedido(self):
+        tarea, creada = tareas.encolar_para_pedido('prueba', self.pedido)
+        repetida, repetida_creada = tareas.encolar_para_pedido('prueba', self.pedido)
+
+        self.assertTrue(creada)
+        self.assertEqual((repetida.id, repetida_creada), (tarea.id, False))
+
+        # Dos solicitudes que pasan la verificación a la vez: la restricción única decide
+        with mock.patch('mainApp.tareas.Tarea.objects.filter') as filtro:
+            filtro.return_value.first.side_effect = [None, tarea]
+            carrera, carrera_creada = tareas.encolar_para_pedido('prueba', self.pedido)
+        self.assertEqual((carrera.id, carrera_creada), (tarea.id, False))
+        self.assertEqual(Tarea.objects.filter(pedido=self.pedido, tipo='prueba').count(), 1)
+
+        # Terminada la anterior, se puede volver a encolar
+        Tarea.objects.filter(id=tarea.id).update(estado='completada')
+        nueva, nueva_creada = tareas.encolar_para_pedido('prueba', self.pedido)
+        self.assertTrue(nueva_creada)
+        self.assertNotEqual(nueva.id, tarea.id)
+
+
+class ResumenCuentaTest(TestCase):
+    """
+    La cuenta de la mesa reúne los pedidos de la ocupación actual, con una consulta
+    por la mesa y otra por los detalles
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.mesero = User.objects.create(username='mesero')
+        cls.platos = [Plato.objects.create(nombre=f'Plato {i}', precio=Decimal('3.35') * (i + 1)) for i in range(4)]
+        cls.mesa = Mesas.objects.create(numero='1', ubicacion='Salón')
+        # Cliente anterior: ocupó la mesa, recibió su pedido y la liberó
+        cls.anterior = cls._sentar('Cliente anterior', 0)
+        Pedidos.objects.filter(id=cls.anterior.id).update(estado='entregado')
+        Mesas.objects.filter(id=cls.mesa.id).update(ocupada=False)
+        # Ocupación actual: varios pedidos (uno cancelado) comparten la ocupación
+        cls.pedidos = [cls._sentar(f'Cliente {i}', i) for i in range(4)]
+        actual = cls.pedidos[-1].ocupacion_mesa
+        Pedidos.objects.filter(id__in=[pedido.id for pedido in cls.pedidos]).update(ocupacion_mesa=actual)
+        Pedidos.objects.filter(id=cls.pedidos[0].id).update(estado='cancelado')
+
+    @classmethod
+    def _sentar(cls, nombre, i):
+        Mesas.objects.filter(id=cls.mesa.id).update(ocupada=False)
+        lineas = {plato.id: 1 + (i + j) % 3 for j, plato in enumerate(cls.platos[:1 + i % 4])}
+        return registrar_pedido(nombre, cls.mesa.id, cls.mesero.id, lineas)
+
+    def test_totales_en_dos_consultas(self):
+        with self.assertNumQueries(2):
+            respuesta = self.client.get(f'/mesa/{self.mesa.id}/cuenta/')
+
+        cuenta = respuesta.context
+        validos = Pedidos.objects.filter(id__in=[pedido.id for pedido in self.pedidos[1:]])
+        self.assertEqual([pedido['id'] for pedido in cuenta['pedidos']], sorted(validos.values_list('id', flat=True)))
+        self.assertEqual(cuenta['total_neto'], sum(validos.values_list('total_neto', flat=True)))
+        self.assertEqual(cuenta['total_final'], cuenta['total_neto'])
+
+    def test_ocupaciones_separadas_tienen_cuentas_separadas(self):
+        Pedidos.objects.filter(mesa=self.mesa).exclude(id=self.anterior.id).update(estado='entregado')
+        Mesas.objects.filter(id=self.mesa.id).update(ocupada=False)
+        nuevo = self._sentar('Cliente nuevo', 2)
+
+        cuenta = self.client.get(f'/mesa/{self.mesa.id}/cuenta/').context
+        self.assertEqual([pedido['id'] for pedido in cuenta['pedidos']], [nuevo.id])
+        self.assertEqual(cuenta['total_neto'], nuevo.total_neto)
+
+    def test_descuento_recalcula_los_pedidos(self):
+        self.client.post(f'/mesa/{self.mesa.id}/cuenta/', {'aplicar_descuento': 'true', 'descuento_porcentaje': '10'})
+
+        cuenta = self.client.get(f'/mesa/{self.mesa.id}/cuenta/').context
+        validos = Pedidos.objects.filter(id__in=[pedido.id for pedido in self.pedidos[1:]])
+        self.assertEqual(cuenta['descuento_porcentaje'], Decimal('10.00'))
+        self.assertEqual(cuenta['total_final'], sum(validos.values_list('total_final', flat=True)))
+        # El pedido entregado del cliente anterior no cambia
+        anterior = Pedidos.objects.get(id=self.anterior.id)
+        self.assertEqual(anterior.descuento_porcentaje, Decimal('0'))
+        self.assertEqual(anterior.total_final, self.anterior.total_final)
+
+
+class InstrumentacionSQLTest(TestCase):
+    """
+    Server-Timing y detección de consultas repetidas (mainApp.middleware)
+    """
+    @classmethod
+    def setUpTestData(cls):
+        mesero = User.objects.create(username='mesero')
+        plato = Plato.objects.create(nombre='Milanesa', precio=10)
+        cls.mesa = Mesas.objects.create(numero='1', ubicacion='Salón')
+        cls.pedidos = []
+        for i in range(7):
+            Mesas.objects.filter(id=cls.mesa.id).update(ocupada=False)
+            cls.pedidos.append(registrar_pedido(f'Cliente {i}', cls.mesa.id, mesero.id, {plato.id: 1}))
+
+    def test_deshabilitada_por_defecto(self):
+        respuesta = self.client.get(f'/mesa/{self.mesa.id}/pedidos/')
+        self.assertNotIn('Server-Timing', respuesta)
+
+    @override_settings(SQL_INSTRUMENTACION_HABILITADA=True, SQL_REPETICIONES_MAXIMAS=5)
+    def test_marca_consultas_repetidas(self):
+        # La plantilla recorre los detalles de cada pedido: una consulta por pedido
+        with self.assertLogs('mainApp.middleware', 'WARNING') as registros:
+            respuesta = self.client.get(f'/mesa/{self.mesa.id}/pedidos/')
+
+        self.assertRegex(respuesta['Server-Timing'], r'sql;dur=[\d.]+;desc="\d+ consultas"')
+        self.assertIn('sql-repetidas;desc="mainApp_detallepedido x7"', respuesta['Server-Timing'])
+        self.assertTrue(any('posible N+1, 7 veces' in linea for linea in registros.output), registros.output)
+
+    @override_settings(SQL_INSTRUMENTACION_HABILITADA=True)
+    async def test_vista_async(self):
+        respuesta = await self.async_client.post(f'/pedido/{self.pedidos[0].id}/validar-stock/')
+
+        self.assertEqual(respuesta.status_code, 400)  # El plato no tiene ID de M1
+        consultas = int(respuesta['Server-Timing'].split('desc="', 1)[1].split(' ', 1)[0])
+        self.assertGreater(consultas, 0)
+
+
+class EventosSSETest(TestCase):
+    """
+    /eventos/ solo se sirve con EVENTOS_SSE_HABILITADO; bajo WSGI con un flujo síncrono de duración acotada
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.mesero = User.objects.create(username='mesero')
+        cls.plato = Plato.objects.create(nombre='Milanesa', precio=10)
+        cls.mesa = Mesas.objects.create(numero='1', ubicacion='Salón')
+        cls.pedido = registrar_pedido('Cliente', cls.mesa.id, cls.mesero.id, {cls.plato.id: 1})
+
+    @override_settings(EVENTOS_SSE_HABILITADO=False)
+    def test_deshabilitado_no_abre_el_flujo(self):
+        self.assertEqual(self.client.get('/eventos/').status_code, 204)
+        self.assertNotContains(self.client.get('/'), 'EventSource')
+        self.assertNotContains(self.client.get(f'/detalle/{self.pedido.id}/'), 'EventSource')
+
+        # Sin suscriptores posibles no se acumulan eventos
+        self.assertIsNone(eventos.publicar('listo', self.pedido))
+        self.assertEqual(eventos.publicar_lote('listo', [self.pedido]), [])
+        self.assertFalse(EventoPedido.objects.exists())
+
+    @override_settings(EVENTOS_SSE_HABILITADO=True, EVENTOS_RETENCION_MINUTOS=60)
+    def test_poda_los_eventos_viejos_una_vez_por_minuto(self):
+        viejo, nuevo = eventos.publicar('creado', self.pedido), eventos.publicar('listo', self.pedido)
+        EventoPedido.objects.filter(id=viejo.id).update(fecha=timezone.now() - timedelta(hours=2))
+
+        with mock.patch.object(eventos, '_ultima_limpieza', None):
+            self.assertEqual(eventos.limpiar(), 1)
+            EventoPedido.objects.filter(id=nuevo.id).update(fecha=timezone.now() - timedelta(hours=2))
+            self.assertEqual(eventos.limpiar(), 0)
+        self.assertEqual(list(EventoPedido.objects.values_list('id', flat=True)), [nuevo.id])
+
+    @override_settings(
+        EVENTOS_SSE_HABILITADO=True, SERVIDOR_ASGI=False, EVENTOS_INTERVALO_MS=10,
+        EVENTOS_LATIDO_SEGUNDOS=0.02, EVENTOS_DURACION_MAXIMA_SEGUNDOS=0.1,
+    )
+    def test_wsgi_usa_un_flujo_sincrono_que_termina(self):
+        self.assertContains(self.client.get('/'), 'EventSource')
+        otro = Mesas.objects.create(numero='2', ubicacion='Salón')
+        respuesta = self.client.get(f'/eventos/?mesa={self.mesa.id}')
+        self.assertEqual(respuesta['Content-Type'], 'text/event-stream')
+        self.assertFalse(respuesta.is_async)
+
+        mensajes = []
+        for mensaje in respuesta.streaming_content:
+            if not mensajes:
+                eventos.publicar('actualizado', registrar_pedido('Otra mesa', otro.id, self.mesero.id, {self.plato.id: 1}))
+                eventos.publicar('listo', self.pedido)
+            mensajes.append(mensaje.decode())
+        respuesta.close()
+
+        datos = [json.loads(mensaje.split('data: ', 1)[1]) for mensaje in mensajes if 'data: ' in mensaje]
+        self.assertEqual(mensajes[0], 'retry: 2000\n\n')
+        self.assertEqual([(dato['pedido_id'], dato['tipo']) for dato in datos], [(self.pedido.id, 'listo')])
+        self.assertIn(': latido\n\n', mensajes)
+
+
+class MetricasTest(TestCase):
+    """
+    Endpoint /metrics: histogramas sumados entre procesos y gauges de pedidos y mesas
+    """
+    @classmethod
+    def setUpTestData(cls):
+        mesero = User.objects.create(username='mesero')
+        plato = Plato.objects.create(nombre='Milanesa', precio=10)
+        cls.mesa = Mesas.objects.create(numero='1', ubicacion='Salón')
+        Mesas.objects.create(numero='2', ubicacion='Salón')
+        registrar_pedido('Cliente', cls.mesa.id, mesero.id, {plato.id: 1})
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.directorio = Path(directorio.name)
+        configuracion = override_settings(METRICAS_DIR=self.directorio)
+        configuracion.enable()
+        self.addCleanup(configuracion.disable)
+
+    def _valor(self, serie):
+        texto = self.client.get('/metrics').content.decode()
+        encontrado = re.search(rf'^{re.escape(serie)} (\S+)$', texto, re.MULTILINE)
+        return float(encontrado.group(1)) if encontrado else 0
+
+    def test_suma_los_procesos(self):
+        serie = 'pedidos_http_duracion_segundos_count{codigo="200",metodo="GET",vista="pedidos_por_mesa"}'
+        antes = self._valor(serie)
+        self.client.get(f'/mesa/{self.mesa.id}/pedidos/')
+        # Volcado de otro proceso con 3 solicitudes a la misma vista
+        (self.directorio / 'proceso-999999.json').write_text(json.dumps([[
+            'pedidos_http_duracion_segundos',
+            {'codigo': '200', 'metodo': 'GET', 'vista': 'pedidos_por_mesa'},
+            [3] + [0] * len(metricas.BUCKETS_SEGUNDOS) + [0.003, 3],
+        ]]), encoding='utf-8')
+
+        self.assertEqual(self._valor(serie), antes + 4)
+        self.assertEqual(self._valor('pedidos_por_estado{estado="pendiente"}'), 1)
+        self.assertEqual(self._valor('pedidos_por_estado{estado="entregado"}'), 0)
+        self.assertEqual(self._valor('pedidos_mesas_ocupadas'), 1)
+        self.assertEqual(self._valor('pedidos_mesas_total'), 2)
+
+    def test_pliega_los_procesos_terminados(self):
+        serie = 'pedidos_m1_coalescedor_lotes_total{modo="lote"}'
+        antes = self._valor(serie)
+        volcado = lambda valor: json.dumps([['pedidos_m1_coalescedor_lotes_total', {'modo': 'lote'}, [valor]]])
+        # Un proceso terminado y otro anterior que tuvo el mismo PID que este
+        (self.directorio / 'proceso-999999-1.json').write_text(volcado(3), encoding='utf-8')
+        (self.directorio / f'proceso-{os.getpid()}-0.json').write_text(volcado(4), encoding='utf-8')
+
+        self.assertEqual(self._valor(serie), antes + 7)
+        self.assertEqual(self._valor(serie), antes + 7)  # Sin sumarlos dos veces
+        self.assertFalse((self.directorio / 'proceso-999999-1.json').exists())
+        self.assertFalse((self.directorio / f'proceso-{os.getpid()}-0.json').exists())
+        self.assertTrue((self.directorio / metricas.ACUMULADO).exists())
+
+    @override_settings(METRICAS_INTERVALO_ESCRITURA_S=60)
+    def test_las_solicitudes_no_escriben_el_archivo_cada_vez(self):
+        metricas._registro.volcar()
+
+        with mock.patch('mainApp.metricas._escribir_json') as escribir:
+            for _ in range(5):
+                self.client.get(f'/mesa/{self.mesa.id}/pedidos/')
+            escribir.assert_not_called()
+            # /metrics vuelca antes de sumar, así que siempre incluye lo último
+            self._valor('pedidos_mesas_total')
+            escribir.assert_called_once()
+
+    def test_resultado_de_las_llamadas_a_m1(self):
+        timeout = 'pedidos_m1_duracion_segundos_count{operacion="validar_stock",resultado="timeout"}'
+        conexion = 'pedidos_m1_duracion_segundos_count{operacion="cancelar_reserva",resultado="conexion"}'
+        antes = self._valor(timeout), self._valor(conexion)
+        servicio = MenuAPIService()
+
+        with mock.patch.object(requests.Session, 'request', side_effect=requests.exceptions.Timeout):
+            self.assertFalse(servicio.validar_stock([{'plato_id': 1, 'cantidad': 1}])['success'])
+        with mock.patch.object(requests.Session, 'request', side_effect=requests.exceptions.ConnectionError):
+            self.assertFalse(servicio.cancelar_reserva([{'plato_id': 1, 'cantidad': 1}])['success'])
+
+        self.assertEqual((self._valor(timeout), self._valor(conexion)), (antes[0] + 1, antes[1] + 1))
+
+
+class CoalescedorTest(TestCase):
+    """
+    Las validaciones de stock simultáneas viajan a M1 en un solo lote (mainApp.coalescedor)
+    """
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        configuracion = override_settings(
+            METRICAS_DIR=Path(directorio.name), MENU_API_COALESCER_HABILITADO=True, SERVIDOR_ASGI=True,
+            MENU_API_COALESCER_VENTANA_MS=50,
+        )
+        configuracion.enable()
+        self.addCleanup(configuracion.disable)
+
+    def _servicio(self):
+        servicio = mock.Mock()
+        servicio.validar_stock_lote = mock.AsyncMock(side_effect=lambda lote: [
+            {'success': True, 'message': '', 'data': {'platos': platos}} for platos in lote
+        ])
+        servicio.validar_stock = mock.AsyncMock(side_effect=lambda platos: {'success': True, 'message': '', 'data': {'platos': platos}})
+        return servicio
+
+    @override_settings(MENU_API_COALESCER_MODO='lote')
+    def test_validaciones_concurrentes_en_una_llamada(self):
+        servicio = self._servicio()
+        coalescedor = CoalescedorValidacion(servicio)
+        pedidos = [[{'plato_id': i, 'cantidad': 1}] for i in range(3)]
+
+        async def validar():
+            return await asyncio.gather(*(coalescedor.validar_stock(platos) for platos in pedidos))
+
+        resultados = async_to_sync(validar)()
+
+        servicio.validar_stock_lote.assert_awaited_once_with(pedidos)
+        servicio.validar_stock.assert_not_called()
+        self.assertEqual([resultado['data']['platos'] for resultado in resultados], pedidos)
+        self.assertEqual((coalescedor.estadisticas()['lotes'], coalescedor.estadisticas()['lote_maximo']), (1, 3))
+
+        texto = self.client.get('/metrics').content.decode()
+        self.assertIn('pedidos_m1_coalescedor_lote_tamano_bucket{modo="lote",le="3"} 1', texto)
+        self.assertIn('pedidos_m1_coalescedor_lote_tamano_bucket{modo="lote",le="2"} 0', texto)
+        self.assertIn('pedidos_m1_coalescedor_espera_segundos_count{modo="lote"} 3', texto)
+
+    def test_sin_asgi_no_agrupa(self):
+        servicio = self._servicio()
+        with override_settings(SERVIDOR_ASGI=False), self.assertLogs('mainApp.coalescedor', 'WARNING'):
+            coalescedor = CoalescedorValidacion(servicio)
+
+        resultado = async_to_sync(coalescedor.validar_stock)([{'plato_id': 1, 'cantidad': 1}])
+
+        self.assertFalse(coalescedor.habilitado)
+        self.assertTrue(resultado['success'])
+        servicio.validar_stock.assert_awaited_once()
+        servicio.validar_stock_lote.assert_not_called()
+
+    def test_modo_por_defecto_pipeline(self):
+        servicio = self._servicio()
+        coalescedor = CoalescedorValidacion(servicio)
+        pedidos = [[{'plato_id': i, 'cantidad': 1}] for i in range(2)]
+
+        async def validar():
+            return await asyncio.gather(*(coalescedor.validar_stock(platos) for platos in pedidos))
+
+        async_to_sync(validar)()
+
+        self.assertEqual(coalescedor.modo, 'pipeline')
+        self.assertEqual(servicio.validar_stock.await_count, 2)
+        servicio.validar_stock_lote.assert_not_called()
+        self.assertEqual(coalescedor.estadisticas()['lotes'], 1)
+
+
+class _ServidorM1(BaseHTTPRequestHandler):
+    """
+    M1 mínimo con keep-alive que anota el puerto de origen de cada solicitud (una conexión por puerto)
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.puertos.append(self.client_address[1])
+        cuerpo = json.dumps({'ok': True}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+class SesionesM1Test(SimpleTestCase):
+    """
+    MenuAPIService: una requests.Session por hilo sobre el pool de conexiones común del proceso
+    """
+    def setUp(self):
+        servidor = ThreadingHTTPServer(('127.0.0.1', 0), _ServidorM1)
+        servidor.puertos = []
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        self.addCleanup(servidor.server_close)
+        self.addCleanup(servidor.shutdown)
+        self.servidor = servidor
+        configuracion = override_settings(MENU_API_URL=f'http://127.0.0.1:{servidor.server_port}/api')
+        configuracion.enable()
+        self.addCleanup(configuracion.disable)
+
+    def _llamar_en_hilo(self, veces):
+        sesiones, resultados = [], []
+
+        def llamar():
+            servicio = MenuAPIService()
+            for _ in range(veces):
+                resultados.append(servicio.validar_stock([{'plato_id': 1, 'cantidad': 1}])['success'])
+                sesiones.append(servicio.session)
+
+        hilo = threading.Thread(target=llamar)
+        hilo.start()
+        hilo.join()
+        self.assertEqual(resultados, [True] * veces)
+        return sesiones
+
+    def test_sesion_por_hilo_y_conexiones_compartidas(self):
+        primer_hilo = self._llamar_en_hilo(3)
+        segundo_hilo = self._llamar_en_hilo(2)
+
+        self.assertEqual(len({id(sesion) for sesion in primer_hilo}), 1)
+        self.assertEqual(len({id(sesion) for sesion in segundo_hilo}), 1)
+        self.assertIsNot(primer_hilo[0], segundo_hilo[0])
+        self.assertIs(primer_hilo[0].get_adapter('http://'), segundo_hilo[0].get_adapter('http://'))
+        # Las cinco solicitudes usan la misma conexión keep-alive, también desde el otro hilo
+        self.assertEqual(len(self.servidor.puertos), 5)
+        self.assertEqual(len(set(self.servidor.puertos)), 1)
+
+
+@unittest.skipIf(httpx is None, 'httpx no está instalado')
+class ClienteAsyncM1Test(SimpleTestCase):
+    """
+    Ciclo de vida del cliente httpx de AsyncMenuAPIService según el servidor
+    """
+    def _llamar(self, veces):
+        clientes = []
+
+        def nuevo_cliente(servicio):
+            transporte = httpx.MockTransport(lambda request: httpx.Response(200, json={'ok': True}))
+            clientes.append(httpx.AsyncClient(transport=transporte))
+            return clientes[-1]
+
+        async def llamadas():
+            servicio = AsyncMenuAPIService()
+            for _ in range(veces):
+                self.assertTrue((await servicio.validar_stock([{'plato_id': 1, 'cantidad': 1}]))['success'])
+
+        with mock.patch.object(AsyncMenuAPIService, '_nuevo_cliente', nuevo_cliente):
+            async_to_sync(llamadas)()
+        return clientes
+
+    @override_settings(SERVIDOR_ASGI=False)
+    def test_wsgi_cierra_el_cliente_de_cada_llamada(self):
+        clientes = self._llamar(2)
+
+        self.assertEqual(len(clientes), 2)
+        self.assertTrue(all(cliente.is_closed for cliente in clientes))
+
+    @override_settings(SERVIDOR_ASGI=True)
+    def test_asgi_reutiliza_el_cliente_del_loop(self):
+        clientes = self._llamar(3)
+
+        self.assertEqual(len(clientes), 1)
+        self.assertFalse(clientes[0].is_closed)
+        async_to_sync(clientes[0].aclose)()
+
+
+class GetCondicionalTest(TestCase):
+    """
+    ETag / Last-Modified en detalle_pedido y pedidos_por_mesa
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.mesero = User.objects.create(username='mesero')
+        cls.plato = Plato.objects.create(nombre='Milanesa', precio=10)
+        cls.mesa = Mesas.objects.create(numero='1', ubicacion='Salón')
+        cls.pedido = registrar_pedido('Cliente', cls.mesa.id, cls.mesero.id, {cls.plato.id: 1})
+
+    def _revalidar(self, url):
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+        return etag
+
+    def test_editar_detalles_cambia_la_version(self):
+        url = f'/detalle/{self.pedido.id}/'
+        etag = self._revalidar(url)
+
+        actualizar_detalles(self.pedido, {self.plato.id: 3})
+
+        respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], etag)
+        self.assertIn('Last-Modified', respuesta)
+
+    def test_pedidos_de_la_mesa(self):
+        url = f'/mesa/{self.mesa.id}/pedidos/'
+        etag = self._revalidar(url)
+
+        # Entregar el pedido lo saca de la lista
+        Pedidos.objects.filter(id=self.pedido.id).update(estado='entregado')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_recalcular_sin_cambios_conserva_la_version(self):
+        url = f'/detalle/{self.pedido.id}/'
+        etag = self._revalidar(url)
+        fecha = Pedidos.objects.get(id=self.pedido.id).fecha_actualizacion
+
+        call_command('recalcular_totales', stdout=io.StringIO())
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # El reloj de cierre del archivo (fecha_actualizacion) tampoco se reinicia
+        self.assertEqual(Pedidos.objects.get(id=self.pedido.id).fecha_actualizacion, fecha)
+
+    def test_cambio_del_menu_cambia_la_version(self):
+        url = f'/detalle/{self.pedido.id}/'
+        etag = self._revalidar(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Plato.objects.filter(id=self.plato.id).update(precio=12)
+            GeneracionCache.invalidar('menu')
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@tag('carga')
+@unittest.skipUnless(os.environ.get('PEDIDOS_CARGA'), 'Definir PEDIDOS_CARGA=1 para correr la prueba de carga')
+class HoraPicoTest(SimpleTestCase):
+    """
+    Corrida corta de manage.py carga_hora_pico: PEDIDOS_CARGA=1 python manage.py test mainApp --tag carga
+
+    Se ejecuta en otro proceso porque necesita una base en archivo: la base en
+    memoria de las pruebas bloquea tablas enteras y no admite escritores concurrentes.
+    """
+    def test_flujo_completo_sin_errores(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            salida = Path(directorio) / 'carga.json'
+            subprocess.run(
+                [sys.executable, 'manage.py', 'carga_hora_pico', '--meseros', '4', '--pedidos', '5',
+                 '--latencia-m1-ms', '5', '--salida', str(salida)],
+                cwd=settings.BASE_DIR, check=True, capture_output=True,
+                env={**os.environ, 'PEDIDOS_METRICAS_DIR': str(Path(directorio) / 'metricas')},
+            )
+            resultado = json.loads(salida.read_text(encoding='utf-8'))
+
+        self.assertEqual(resultado['pedidos_completados'], 20, resultado)
+        self.assertEqual(resultado['fallidos'], 0)
+        for nombre, endpoint in resultado['endpoints'].items():
+            self.assertEqual(endpoint['errores'], 0, nombre)
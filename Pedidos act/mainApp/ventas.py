@@ -0,0 +1,279 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import transaction
+from django.db.models import Max, Prefetch, Q, Sum
+from django.utils import timezone
+from .models import CENTAVOS, DetallePedido, Pedidos, VentaDiariaMesero, VentaDiariaPlato, VentaHoraria
+from . import archivo
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# ✅ ACUMULACIÓN
+# ============================================
+
+def _venta_de_pedido(pedido):
+    """
+    Normaliza un pedido entregado (con detalles y platos precargados)
+
+    Las líneas se valoran con el precio guardado en el detalle, igual que los
+    totales del pedido, y no con el precio actual del plato.
+    """
+    return {
+        'entrega': pedido.timestamp_entrega,
+        'mesero_id': pedido.mesero_id,
+        'total_neto': pedido.total_neto,
+        'total_final': pedido.total_final,
+        'descuento_porcentaje': pedido.descuento_porcentaje,
+        'detalles': [
+            (detalle.plato_id, detalle.plato.nombre, detalle.precio_unitario, detalle.cantidad)
+            for detalle in pedido.detalles.all()
+        ],
+    }
+
+
+def _venta_de_archivo(registro):
+    """
+    Normaliza un pedido leído de los segmentos del archivo
+    """
+    return {
+        'entrega': datetime.fromisoformat(registro['timestamp_entrega']),
+        'mesero_id': registro['mesero_id'],
+        'total_neto': Decimal(registro['total_neto']),
+        'total_final': Decimal(registro['total_final']),
+        'descuento_porcentaje': Decimal(registro['descuento_porcentaje']),
+        'detalles': [
+            (detalle['plato_id'], detalle['plato'], Decimal(detalle['precio']), detalle['cantidad'])
+            for detalle in registro['detalles']
+        ],
+    }
+
+
+def _sumar(acumulados, modelo, clave, extra, ingresos, unidades, descuento, pedidos):
+    fila = acumulados.setdefault(modelo, {}).setdefault(clave, {
+        **extra, 'ingresos': Decimal('0'), 'unidades': 0, 'descuento': Decimal('0'), 'pedidos': 0,
+    })
+    fila['ingresos'] += ingresos
+    fila['unidades'] += unidades
+    fila['descuento'] += descuento
+    fila['pedidos'] += pedidos
+
+
+def _acumular(acumulados, venta):
+    """
+    Suma una venta en los tres acumulados: (día, plato), (día, mesero) y (día, hora)
+    """
+    entrega = timezone.localtime(venta['entrega'])
+    fecha = entrega.date()
+    porcentaje = venta['descuento_porcentaje'] / Decimal('100')
+
+    for plato_id, nombre, precio, cantidad in venta['detalles']:
+        bruto = precio * cantidad
+        descuento = (bruto * porcentaje).quantize(CENTAVOS, rounding=ROUND_HALF_UP)
+        _sumar(acumulados, VentaDiariaPlato, (fecha, plato_id), {'plato_nombre': nombre},
+               bruto - descuento, cantidad, descuento, 1)
+
+    unidades = sum(cantidad for _, _, _, cantidad in venta['detalles'])
+    descuento = venta['total_neto'] - venta['total_final']
+    _sumar(acumulados, VentaDiariaMesero, (fecha, venta['mesero_id'] or 0), {},
+           venta['total_final'], unidades, descuento, 1)
+    _sumar(acumulados, VentaHoraria, (fecha, entrega.hour), {},
+           venta['total_final'], unidades, descuento, 1)
+
+
+# Campo que acompaña a la fecha en la clave única de cada acumulado
+_CAMPO_CLAVE = {
+    VentaDiariaPlato: 'plato_id',
+    VentaDiariaMesero: 'mesero_id',
+    VentaHoraria: 'hora',
+}
+
+
+def _guardar(acumulados, sumar):
+    """
+    Escribe los acumulados con un upsert por tabla
+
+    Con sumar=True se leen antes las filas existentes de esas claves y se suman;
+    debe llamarse dentro de una transacción (BEGIN IMMEDIATE en el perfil de
+    producción) para que otro worker no acumule sobre los mismos valores. Las
+    filas que quedan sin pedidos (por un ajuste negativo) se eliminan.
+    """
+    for modelo, filas in acumulados.items():
+        campo = _CAMPO_CLAVE[modelo]
+        if sumar:
+            existentes = modelo.objects.filter(
+                fecha__in={fecha for fecha, _ in filas},
+                **{f'{campo}__in': {valor for _, valor in filas}}
+            )
+            for existente in existentes:
+                fila = filas.get((existente.fecha, getattr(existente, campo)))
+                if fila is not None:
+                    for acumulado in modelo.CAMPOS_ACUMULADOS:
+                        fila[acumulado] += getattr(existente, acumulado)
+
+            vacias = [clave for clave, fila in filas.items() if fila['pedidos'] <= 0]
+            if vacias:
+                condicion = Q()
+                for fecha, valor in vacias:
+                    condicion |= Q(fecha=fecha, **{campo: valor})
+                modelo.objects.filter(condicion).delete()
+                filas = {clave: fila for clave, fila in filas.items() if fila['pedidos'] > 0}
+
+        modelo.objects.bulk_create(
+            [modelo(fecha=fecha, **{campo: valor}, **fila) for (fecha, valor), fila in filas.items()],
+            update_conflicts=True,
+            unique_fields=['fecha', campo],
+            update_fields=list(modelo.CAMPOS_ACUMULADOS) + (['plato_nombre'] if modelo is VentaDiariaPlato else []),
+        )
+
+
+def _pedidos_entregados():
+    return (
+        Pedidos.objects.filter(estado='entregado', timestamp_entrega__isnull=False)
+        .only('id', 'timestamp_entrega', 'mesero_id', 'total_neto', 'total_final', 'descuento_porcentaje')
+        .prefetch_related(Prefetch('detalles', queryset=DetallePedido.objects.select_related('plato')))
+    )
+
+
+def _acumulados_entregados(pedido_ids):
+    acumulados = {}
+    for pedido in _pedidos_entregados().filter(id__in=pedido_ids):
+        _acumular(acumulados, _venta_de_pedido(pedido))
+    return acumulados
+
+
+def _diferencia(nuevos, anteriores):
+    """
+    Resta los acumulados anteriores de los nuevos y descarta las filas sin cambios
+    """
+    for modelo, filas in anteriores.items():
+        for clave, fila in filas.items():
+            destino = nuevos.setdefault(modelo, {}).setdefault(
+                clave, {**fila, **dict.fromkeys(modelo.CAMPOS_ACUMULADOS, 0)}
+            )
+            for campo in modelo.CAMPOS_ACUMULADOS:
+                destino[campo] -= fila[campo]
+    return {
+        modelo: {
+            clave: fila for clave, fila in filas.items()
+            if any(fila[campo] for campo in modelo.CAMPOS_ACUMULADOS)
+        }
+        for modelo, filas in nuevos.items()
+    }
+
+
+def registrar_entregas(pedido_ids):
+    """
+    Suma a los acumulados los pedidos recién entregados
+
+    Lo llama la tabla de transiciones (estados.py) en la misma transacción que
+    pasa los pedidos a 'entregado', por lo que cada pedido se cuenta una sola vez.
+    """
+    acumulados = _acumulados_entregados(pedido_ids)
+    with transaction.atomic():
+        _guardar(acumulados, sumar=True)
+
+
+@contextmanager
+def ajustar_entregas(pedido_ids):
+    """
+    Mantiene los acumulados al modificar o eliminar pedidos ya entregados (descuento o detalles)
+
+    Antes del bloque se calcula lo que aportan a los acumulados los pedidos
+    entregados entre `pedido_ids`; al terminar se suma la diferencia con lo que
+    aportan después del cambio, en la misma transacción que la modificación.
+    """
+    with transaction.atomic():
+        anteriores = _acumulados_entregados(pedido_ids)
+        yield
+        if anteriores:
+            _guardar(_diferencia(_acumulados_entregados(pedido_ids), anteriores), sumar=True)
+
+
+def reconstruir(desde=None, lote=500):
+    """
+    Recalcula desde cero los acumulados (desde una fecha, o todos), incluyendo los pedidos archivados
+
+    Args:
+        desde: date opcional; se reemplazan solo los acumulados desde esa fecha
+        lote: Pedidos leídos por consulta
+
+    Returns:
+        dict: {'success': bool, 'message': str, 'data': {'pedidos': int, 'archivados': int}}
+    """
+    acumulados = {}
+    contados = {'pedidos': 0, 'archivados': 0}
+
+    def incluir(venta):
+        return desde is None or timezone.localtime(venta['entrega']).date() >= desde
+
+    for pedido in _pedidos_entregados().order_by('id').iterator(chunk_size=lote):
+        venta = _venta_de_pedido(pedido)
+        if incluir(venta):
+            _acumular(acumulados, venta)
+            contados['pedidos'] += 1
+
+    # Los segmentos se organizan por mes de creación: se incluye el mes anterior
+    # por los pedidos creados a fin de mes y entregados después
+    mes_archivo = (desde.replace(day=1) - timedelta(days=1)).strftime('%Y-%m') if desde else None
+    for registro in archivo.pedidos_archivados(desde=mes_archivo):
+        if registro['estado'] != 'entregado' or not registro['timestamp_entrega']:
+            continue
+        venta = _venta_de_archivo(registro)
+        if incluir(venta):
+            _acumular(acumulados, venta)
+            contados['archivados'] += 1
+
+    with transaction.atomic():
+        for modelo in _CAMPO_CLAVE:
+            filas = modelo.objects.all() if desde is None else modelo.objects.filter(fecha__gte=desde)
+            filas.delete()
+        _guardar(acumulados, sumar=False)
+
+    logger.info(f"Acumulados de ventas reconstruidos: {contados}")
+    return {
+        'success': True,
+        'message': f"{contados['pedidos']} pedidos y {contados['archivados']} archivados acumulados",
+        'data': contados
+    }
+
+
+# ============================================
+# ✅ CONSULTAS PARA REPORTES
+# ============================================
+
+def resumen(desde, hasta):
+    """
+    Resumen de ventas entre dos fechas inclusive, leído de los acumulados
+
+    Returns:
+        dict: {
+            'totales': {'ingresos', 'unidades', 'descuento', 'pedidos'},
+            'por_dia': [...], 'por_plato': [...], 'por_mesero': [...], 'por_hora': [...],
+        }
+    """
+    sumas = {campo: Sum(campo) for campo in VentaHoraria.CAMPOS_ACUMULADOS}
+    horas = VentaHoraria.objects.filter(fecha__range=(desde, hasta))
+    platos = VentaDiariaPlato.objects.filter(fecha__range=(desde, hasta))
+    meseros = VentaDiariaMesero.objects.filter(fecha__range=(desde, hasta))
+
+    totales = horas.aggregate(**sumas)
+    return {
+        'totales': _redondear({campo: valor or 0 for campo, valor in totales.items()}),
+        'por_dia': [_redondear(fila) for fila in horas.values('fecha').annotate(**sumas).order_by('fecha')],
+        'por_plato': [_redondear(fila) for fila in (
+            platos.values('plato_id').annotate(plato_nombre=Max('plato_nombre'), **sumas).order_by('-ingresos')
+        )],
+        'por_mesero': [_redondear(fila) for fila in meseros.values('mesero_id').annotate(**sumas).order_by('-ingresos')],
+        'por_hora': [_redondear(fila) for fila in horas.values('hora').annotate(**sumas).order_by('hora')],
+    }
+
+
+def _redondear(fila):
+    # SQLite suma los decimales como números de punto flotante
+    for campo in ('ingresos', 'descuento'):
+        fila[campo] = Decimal(str(fila[campo] or 0)).quantize(CENTAVOS, rounding=ROUND_HALF_UP)
+    return fila
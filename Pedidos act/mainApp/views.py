@@ -1,37 +1,177 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
-from .models import Pedidos, Mesas, Plato, DetallePedido
+from django.conf import settings
+from django.urls import reverse
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Count, Max, Q, Subquery
+from django.utils.cache import get_conditional_response, patch_cache_control, add_never_cache_headers
+from django.utils.http import http_date, quote_etag
+from .models import Pedidos, Mesas, Plato, DetallePedido, Tarea, GeneracionCache
 from django.contrib.auth.models import User
-from .services import MenuAPIService
+from .services import MenuAPIService, AsyncMenuAPIService
+from .coalescedor import CoalescedorValidacion
+from . import tareas, stock_local, eventos, referencia, mesas, estados, ventas, exportacion, cuentas, metricas
+from .bloqueos import es_bloqueo, reintentar_si_bloqueada
+from .pedidos import PedidoError, parsear_lineas, registrar_pedido, actualizar_detalles
 from django.utils import timezone
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+import hashlib
 import json
 
-# Instancia del servicio de API
+# Instancias del servicio de API (síncrona y async para las vistas servidas por ASGI)
 menu_api = MenuAPIService()
+menu_api_async = AsyncMenuAPIService()
+validador_stock = CoalescedorValidacion(menu_api_async)
+
+def _codificar_cursor(pedido):
+    """
+    Serializa la posición (fecha_creacion, id) de un pedido para la paginación por cursor
+    """
+    return f"{pedido.fecha_creacion.isoformat()}|{pedido.id}"
+
+
+def _decodificar_cursor(cursor):
+    """
+    Retorna (fecha_creacion, id) a partir del cursor recibido, o None si no es válido
+    """
+    try:
+        fecha_txt, id_txt = cursor.rsplit('|', 1)
+        fecha = datetime.fromisoformat(fecha_txt)
+        if timezone.is_naive(fecha):
+            return None
+        return fecha, int(id_txt)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _generaciones_referencia():
+    """
+    Subconsultas con la generación vigente de menú, meseros y mesas: los platos, el mesero
+    y la mesa que muestran las páginas cambian sin tocar la fecha_actualizacion del pedido
+    """
+    return {
+        f'generacion_{clave}': Subquery(GeneracionCache.objects.filter(clave=clave).values('generacion')[:1])
+        for clave in GeneracionCache.CLAVES
+    }
+
+
+def _get_condicional(request, version, renderizar):
+    """
+    Responde 304 si la copia del cliente (If-None-Match / If-Modified-Since) sigue vigente;
+    si no, renderiza la página y le agrega ETag y Last-Modified
+
+    Args:
+        version: Tupla leída con una sola consulta, con la última modificación (o None) primero;
+                 None si el recurso no existe
+        renderizar: Función sin argumentos que arma la respuesta completa
+    """
+    if version is None:
+        return renderizar()  # La vista responde el 404
+
+    if len(messages.get_messages(request)):
+        # Los mensajes flash se muestran una sola vez: esta respuesta no debe reutilizarse
+        response = renderizar()
+        add_never_cache_headers(response)
+        return response
+
+    etag = quote_etag(hashlib.md5(repr(version).encode()).hexdigest())
+    ultima_modificacion = int(version[0].timestamp()) if version[0] else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=ultima_modificacion)
+    if response is None:
+        response = renderizar()
+    response['ETag'] = etag
+    if ultima_modificacion:
+        response['Last-Modified'] = http_date(ultima_modificacion)
+    # El navegador puede guardar la página pero debe revalidarla en cada uso
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
 
 # Página principal: lista de pedidos y mesas disponibles
 def home(request):
-    pedidos = Pedidos.objects.all()
-    mesas_disponibles = Mesas.objects.filter(ocupada=False)
-    meseros = User.objects.filter(groups__name='Meseros')
-    platos = Plato.objects.all().order_by('nombre')  # Todos los platos ordenados
+    """
+    Tablero de pedidos paginado por cursor sobre (fecha_creacion, id).
+
+    Filtros por GET:
+        estado: un estado de ESTADO_CHOICES, 'todos' o vacío (solo estados activos)
+        mesero: ID del mesero
+        cursor: posición del último pedido de la página anterior
+    """
+    por_pagina = getattr(settings, 'PEDIDOS_POR_PAGINA', 25)
+    filtro_estado = request.GET.get('estado', '')
+    filtro_mesero = request.GET.get('mesero', '')
+
+    pedidos = (
+        Pedidos.objects
+        .select_related('mesa', 'mesero')
+        .defer('notas_cocina')
+        .order_by('-fecha_creacion', '-id')
+    )
+
+    if filtro_estado == 'todos':
+        pass
+    elif filtro_estado in dict(Pedidos.ESTADO_CHOICES):
+        pedidos = pedidos.filter(estado=filtro_estado)
+    else:
+        filtro_estado = ''
+        pedidos = pedidos.filter(estado__in=Pedidos.ESTADOS_ACTIVOS)
+
+    if filtro_mesero.isdigit():
+        pedidos = pedidos.filter(mesero_id=filtro_mesero)
+    else:
+        filtro_mesero = ''
+
+    posicion = _decodificar_cursor(request.GET.get('cursor'))
+    if posicion:
+        fecha, pedido_id = posicion
+        pedidos = pedidos.filter(
+            Q(fecha_creacion__lt=fecha) | Q(fecha_creacion=fecha, id__lt=pedido_id)
+        )
+
+    # Se pide un registro extra solo para saber si existe una página siguiente
+    pedidos = list(pedidos[:por_pagina + 1])
+    siguiente_cursor = None
+    if len(pedidos) > por_pagina:
+        pedidos = pedidos[:por_pagina]
+        siguiente_cursor = _codificar_cursor(pedidos[-1])
+
+    # Menú, meseros y mesas salen de la caché de referencia (una consulta si nada cambió);
+    # la ocupación de las mesas se lee aparte porque cambia con cada pedido
+    datos = referencia.obtener('menu', 'personal', 'mesas')
+    mesas_disponibles = mesas.con_ocupacion(datos['mesas'])
+    meseros = datos['personal']
+    platos = datos['menu']['platos']  # Todos los platos ordenados
     
     # Contar platos con y sin ID de M1
-    platos_con_id_m1 = platos.filter(plato_id_m1__isnull=False).count()
-    platos_sin_id_m1 = platos.filter(plato_id_m1__isnull=True).count()
+    platos_con_id_m1 = datos['menu']['con_id_m1']
+    platos_sin_id_m1 = datos['menu']['sin_id_m1']
+    
+    # Platos agotados según la copia local de stock de M1
+    ids_agotados = stock_local.ids_agotados()
     
     return render(request, 'home.html', {
-        'pedidos': pedidos, 
-        'Mesas': mesas_disponibles, 
+        'pedidos': pedidos,
+        'Mesas': mesas_disponibles,
         'Meseros': meseros,
         'platos': platos,
         'platos_con_id_m1': platos_con_id_m1,
-        'platos_sin_id_m1': platos_sin_id_m1
+        'platos_sin_id_m1': platos_sin_id_m1,
+        'platos_agotados': ids_agotados,
+        'estados': Pedidos.ESTADO_CHOICES,
+        'filtro_estado': filtro_estado,
+        'filtro_mesero': filtro_mesero,
+        'eventos_sse': getattr(settings, 'EVENTOS_SSE_HABILITADO', False),
+        'cursor_actual': request.GET.get('cursor', '') if posicion else '',
+        'siguiente_cursor': siguiente_cursor,
     })
 
 # Crear nuevo pedido
+@reintentar_si_bloqueada
 def crear_pedido(request):
     if request.method == 'POST':
         nombre = request.POST.get('nombre')
@@ -45,38 +185,25 @@ def crear_pedido(request):
         
         if nombre and mesa_id and mesero_id and platos_ids:
             try:
-                mesa = Mesas.objects.get(id=mesa_id)
-                mesero = User.objects.get(id=mesero_id)
-                
-                # Marcar mesa como ocupada
-                mesa.ocupada = True
-                mesa.save()
-
-                # Crear el pedido
-                pedido = Pedidos.objects.create(
-                    nombre=nombre, 
-                    mesa=mesa, 
-                    mesero=mesero,
-                    notas_cocina=notas_cocina,
-                    estado='pendiente'
-                )
-                
-                # Crear los detalles del pedido
-                for i, plato_id in enumerate(platos_ids):
-                    if plato_id:
-                        plato = Plato.objects.get(id=plato_id)
-                        cantidad = int(cantidades[i]) if i < len(cantidades) else 1
-                        
-                        DetallePedido.objects.create(
-                            pedido=pedido,
-                            plato=plato,
-                            cantidad=cantidad
-                        )
-                
+                lineas = parsear_lineas(platos_ids, cantidades)
+                with transaction.atomic():
+                    pedido = registrar_pedido(
+                        nombre=nombre,
+                        mesa_id=mesa_id,
+                        mesero_id=mesero_id,
+                        lineas=lineas,
+                        notas_cocina=notas_cocina,
+                    )
+                    eventos.publicar('creado', pedido)
+
                 messages.success(request, f'✅ ¡Pedido #{pedido.id} creado exitosamente!')
                 return redirect('detalle_pedido', id=pedido.id)
-                
+
+            except PedidoError as e:
+                messages.error(request, f'❌ {str(e)}')
             except Exception as e:
+                if es_bloqueo(e):
+                    raise  # Lo reintenta @reintentar_si_bloqueada
                 messages.error(request, f'❌ Error al crear pedido: {str(e)}')
         else:
             messages.error(request, '❌ Todos los campos son obligatorios.')
@@ -85,19 +212,34 @@ def crear_pedido(request):
 
 # Ver detalle del pedido
 def detalle_pedido(request, id):
-    pedido = get_object_or_404(Pedidos, id=id)
-    detalles = pedido.detalles.all()
-    
-    return render(request, 'detalle_pedido.html', {
-        'pedido': pedido,
-        'detalles': detalles
-    })
+    # Las ediciones de detalles actualizan fecha_actualizacion (ver Pedidos.recalcular_totales)
+    generaciones = _generaciones_referencia()
+    version = (
+        Pedidos.objects.filter(id=id)
+        .annotate(**generaciones)
+        .values_list('fecha_actualizacion', *generaciones)
+        .first()
+    )
+
+    def renderizar():
+        pedido = get_object_or_404(Pedidos.objects.select_related('mesa', 'mesero'), id=id)
+        detalles = pedido.detalles.select_related('plato')
+
+        return render(request, 'detalle_pedido.html', {
+            'pedido': pedido,
+            'detalles': detalles,
+            'eventos_sse': getattr(settings, 'EVENTOS_SSE_HABILITADO', False),
+        })
+
+    return _get_condicional(request, version, renderizar)
 
 # Editar pedido
+@reintentar_si_bloqueada
 def editar_pedido(request, id):
     pedido = get_object_or_404(Pedidos, id=id)
-    mesas_disponibles = Mesas.objects.filter(ocupada=False) | Mesas.objects.filter(id=pedido.mesa.id)
-    platos = Plato.objects.all()
+    datos = referencia.obtener('menu', 'mesas')
+    mesas_disponibles = mesas.con_ocupacion(datos['mesas'], incluir=pedido.mesa_id)
+    platos = datos['menu']['platos']
     detalles = pedido.detalles.all()
 
     if request.method == 'POST':
@@ -112,45 +254,58 @@ def editar_pedido(request, id):
 
         if nombre and mesa_id:
             try:
-                mesa_actual = pedido.mesa
-                nueva_mesa = Mesas.objects.get(id=mesa_id)
-
-                # Si cambia la mesa, liberar la anterior y ocupar la nueva
-                if mesa_actual.id != nueva_mesa.id:
-                    mesa_actual.ocupada = False
-                    mesa_actual.save()
-                    nueva_mesa.ocupada = True
-                    nueva_mesa.save()
-
-                # Actualizar datos básicos del pedido
-                pedido.nombre = nombre
-                pedido.mesa = nueva_mesa
-                pedido.notas_cocina = notas_cocina
-                if estado:
-                    pedido.estado = estado
-                pedido.save()
-
-                #  SOLO si el formulario trae platos, actualizamos los detalles
-                if platos_ids:
-                    # Eliminar detalles antiguos
-                    pedido.detalles.all().delete()
-
-                    # Crear nuevos detalles
-                    for i, plato_id in enumerate(platos_ids):
-                        if plato_id:
-                            plato = Plato.objects.get(id=plato_id)
-                            cantidad = int(cantidades[i]) if i < len(cantidades) else 1
-
-                            DetallePedido.objects.create(
-                                pedido=pedido,
-                                plato=plato,
-                                cantidad=cantidad
-                            )
-
-                messages.success(request, '✅ ¡Pedido actualizado exitosamente!')
+                with transaction.atomic():
+                    mesa_anterior_id = pedido.mesa_id
+                    nueva_mesa = Mesas.objects.get(id=mesa_id)
+
+                    # Si cambia la mesa, ocupar la nueva solo si sigue libre (el pedido abre su cuenta)
+                    if mesa_anterior_id != nueva_mesa.id:
+                        ocupacion = timezone.now()
+                        if not mesas.ocupar(nueva_mesa.id, desde=ocupacion):
+                            raise PedidoError(f'La mesa {nueva_mesa.numero} ya está ocupada')
+                        pedido.ocupacion_mesa = ocupacion
+
+                    # Actualizar datos básicos del pedido
+                    pedido.nombre = nombre
+                    pedido.mesa = nueva_mesa
+                    pedido.notas_cocina = notas_cocina
+                    pedido.save(update_fields=['nombre', 'mesa', 'notas_cocina', 'ocupacion_mesa', 'fecha_actualizacion'])
+
+                    # El estado solo cambia por una transición válida de la tabla
+                    if estado and estado != pedido.estado:
+                        try:
+                            aplicada = estados.transicionar(pedido, estado, manual=True)
+                        except estados.TransicionInvalida as e:
+                            raise PedidoError(str(e))
+                        if not aplicada:
+                            raise PedidoError(estados.mensaje_rechazo(pedido, estado))
+
+                    #  SOLO si el formulario trae platos, actualizamos los detalles
+                    cambios = None
+                    if platos_ids:
+                        cambios = actualizar_detalles(pedido, parsear_lineas(platos_ids, cantidades))
+
+                    # La mesa anterior se libera si no le quedan otros pedidos activos
+                    if mesa_anterior_id != nueva_mesa.id:
+                        mesas.liberar(mesa_anterior_id, excluir_pedido=pedido.id)
+
+                    eventos.publicar('actualizado', pedido)
+
+                if cambios:
+                    messages.success(
+                        request,
+                        f"✅ ¡Pedido actualizado exitosamente! Platos: {len(cambios['creados'])} agregados, "
+                        f"{len(cambios['actualizados'])} modificados, {len(cambios['eliminados'])} eliminados."
+                    )
+                else:
+                    messages.success(request, '✅ ¡Pedido actualizado exitosamente!')
                 return redirect('detalle_pedido', id=pedido.id)
 
+            except PedidoError as e:
+                messages.error(request, f'❌ {str(e)}')
             except Exception as e:
+                if es_bloqueo(e):
+                    raise  # Lo reintenta @reintentar_si_bloqueada
                 messages.error(request, f'❌ Error al actualizar: {str(e)}')
         else:
             messages.error(request, '❌ Todos los campos son obligatorios.')
@@ -159,18 +314,21 @@ def editar_pedido(request, id):
         'pedido': pedido,
         'Mesas': mesas_disponibles,
         'platos': platos,
-        'detalles': detalles
+        'detalles': detalles,
+        'estados_disponibles': estados.destinos_manuales(pedido.estado),
     })
 
 
 # Eliminar pedido
+@reintentar_si_bloqueada
 def eliminar_pedido(request, id):
     pedido = get_object_or_404(Pedidos, id=id)
     if request.method == 'POST':
-        mesa = pedido.mesa
-        mesa.ocupada = False
-        mesa.save()
-        pedido.delete()
+        # Un pedido entregado se descuenta de los acumulados de ventas en la misma transacción
+        entregado = [pedido.id] if pedido.estado == 'entregado' else []
+        with transaction.atomic(), ventas.ajustar_entregas(entregado):
+            eventos.publicar('eliminado', pedido)
+            pedido.delete()  # La señal liberar_mesa libera la mesa si no le quedan pedidos activos
         messages.success(request, '🗑️ Pedido eliminado y Mesa liberada.')
         return redirect('home')
     
@@ -178,12 +336,63 @@ def eliminar_pedido(request, id):
 
 # Mostrar pedidos por mesa
 def pedidos_por_mesa(request, mesa_id):
+    # La cantidad detecta los pedidos que salen de la lista (entregados, borrados, cambiados de mesa)
+    abiertos = ~Q(pedidos__estado='entregado')
+    generaciones = _generaciones_referencia()
+    version = (
+        Mesas.objects.filter(id=mesa_id)
+        .annotate(
+            ultima=Max('pedidos__fecha_actualizacion', filter=abiertos),
+            cantidad=Count('pedidos', filter=abiertos),
+            **generaciones,
+        )
+        .values_list('ultima', 'cantidad', *generaciones)
+        .first()
+    )
+
+    def renderizar():
+        mesa = get_object_or_404(Mesas, id=mesa_id)
+        pedidos = Pedidos.objects.filter(mesa=mesa).exclude(estado='entregado')
+
+        return render(request, 'pedidos_por_mesa.html', {
+            'mesa': mesa,
+            'pedidos': pedidos
+        })
+
+    return _get_condicional(request, version, renderizar)
+
+# Cuenta de la mesa: totales, descuento y división entre personas
+@reintentar_si_bloqueada
+def resumen_cuenta(request, mesa_id):
     mesa = get_object_or_404(Mesas, id=mesa_id)
-    pedidos = Pedidos.objects.filter(mesa=mesa).exclude(estado='entregado')
+    personas = 1
+
+    if request.method == 'POST' and request.POST.get('aplicar_descuento'):
+        try:
+            porcentaje = Decimal(request.POST.get('descuento_porcentaje', ''))
+            if not 0 <= porcentaje <= 100:
+                raise InvalidOperation
+        except InvalidOperation:
+            messages.error(request, '❌ El descuento debe ser un porcentaje entre 0 y 100.')
+        else:
+            actualizados = cuentas.aplicar_descuento(mesa.id, porcentaje.quantize(Decimal('0.01')))
+            messages.success(request, f'✅ Descuento de {porcentaje}% aplicado a {actualizados} pedido(s).')
+        return redirect('resumen_cuenta', mesa_id=mesa.id)
 
-    return render(request, 'pedidos_por_mesa.html', {
+    if request.method == 'POST' and request.POST.get('dividir_cuenta'):
+        try:
+            personas = int(request.POST.get('num_personas', ''))
+            if personas < 1:
+                raise ValueError
+        except ValueError:
+            messages.error(request, '❌ La cantidad de personas debe ser un entero mayor que cero.')
+            personas = 1
+
+    cuenta = cuentas.resumen(mesa.id, personas)
+    return render(request, 'resumen_cuenta.html', {
         'mesa': mesa,
-        'pedidos': pedidos
+        'division_personas': personas,
+        **cuenta,
     })
 
 # ============================================
@@ -191,24 +400,29 @@ def pedidos_por_mesa(request, mesa_id):
 # ============================================
 
 @require_POST
-def validar_stock_pedido(request, id):
+async def validar_stock_pedido(request, id):
     """
     Valida el stock del pedido con el módulo M1
     """
-    pedido = get_object_or_404(Pedidos, id=id)
+    pedido = await aget_object_or_404(Pedidos, id=id)
+    
+    if not estados.permitida(pedido.estado, 'validando_stock'):
+        return JsonResponse({
+            'success': False,
+            'message': estados.mensaje_rechazo(pedido, 'validando_stock')
+        }, status=400)
+    
+    detalles = [detalle async for detalle in pedido.detalles.select_related('plato')]
     
     # Verificar que tenga platos
-    if not pedido.detalles.exists():
+    if not detalles:
         return JsonResponse({
             'success': False,
             'message': 'El pedido no tiene platos asignados'
         }, status=400)
     
     # Verificar que los platos tengan ID de M1
-    platos_sin_id = []
-    for detalle in pedido.detalles.all():
-        if not detalle.plato.plato_id_m1:
-            platos_sin_id.append(detalle.plato.nombre)
+    platos_sin_id = [detalle.plato.nombre for detalle in detalles if not detalle.plato.plato_id_m1]
     
     if platos_sin_id:
         return JsonResponse({
@@ -217,7 +431,7 @@ def validar_stock_pedido(request, id):
         }, status=400)
     
     # Preparar lista de platos para M1
-    platos = pedido.get_platos_para_m1()
+    platos = Pedidos.platos_para_m1(detalles)
     
     if not platos:
         return JsonResponse({
@@ -225,19 +439,33 @@ def validar_stock_pedido(request, id):
             'message': 'No hay platos válidos para enviar a M1'
         }, status=400)
     
+    # Descartar platos agotados con la copia local antes de ir a M1
+    sin_stock = set(await sync_to_async(stock_local.agotados)(platos))
+    if sin_stock:
+        nombres = [detalle.plato.nombre for detalle in detalles if detalle.plato.plato_id_m1 in sin_stock]
+        return JsonResponse({
+            'success': False,
+            'message': f'Sin stock suficiente: {", ".join(nombres)}'
+        }, status=400)
+    
     # Llamar a la API de M1
-    resultado = menu_api.validar_stock(platos)
+    resultado = await validador_stock.validar_stock(platos)
     
     if resultado['success']:
-        # Actualizar estado del pedido
-        pedido.estado = 'validando_stock'
-        pedido.stock_validado = True
-        
         # Guardar ID de reserva si M1 lo proporciona
+        campos = {}
         if resultado['data'] and 'reserva_id' in resultado['data']:
-            pedido.reserva_stock_id = resultado['data']['reserva_id']
+            campos['reserva_stock_id'] = resultado['data']['reserva_id']
+        
+        # Actualizar estado del pedido (falla si otro usuario lo cambió mientras se validaba)
+        if not await estados.atransicionar(pedido, 'validando_stock', **campos):
+            await pedido.arefresh_from_db(fields=['estado'])
+            return JsonResponse({
+                'success': False,
+                'message': estados.mensaje_rechazo(pedido, 'validando_stock')
+            }, status=409)
         
-        pedido.save()
+        await eventos.apublicar('stock_validado', pedido)
         
         return JsonResponse({
             'success': True,
@@ -251,11 +479,11 @@ def validar_stock_pedido(request, id):
         }, status=400)
 
 @require_POST
-def enviar_a_cocina(request, id):
+async def enviar_a_cocina(request, id):
     """
     Confirma el pedido y consume el stock definitivamente
     """
-    pedido = get_object_or_404(Pedidos, id=id)
+    pedido = await aget_object_or_404(Pedidos, id=id)
     
     # Verificar que el stock esté validado
     if not pedido.stock_validado:
@@ -271,8 +499,14 @@ def enviar_a_cocina(request, id):
             'message': 'El stock ya fue consumido para este pedido'
         }, status=400)
     
+    if not estados.permitida(pedido.estado, 'enviado_cocina'):
+        return JsonResponse({
+            'success': False,
+            'message': estados.mensaje_rechazo(pedido, 'enviado_cocina')
+        }, status=400)
+    
     # Preparar lista de platos
-    platos = pedido.get_platos_para_m1()
+    platos = await pedido.aget_platos_para_m1()
     
     if not platos:
         return JsonResponse({
@@ -280,41 +514,37 @@ def enviar_a_cocina(request, id):
             'message': 'No hay platos válidos para enviar'
         }, status=400)
     
-    # Consumir stock en M1
-    resultado = menu_api.consumir_stock(pedido.id, platos)
+    # El consumo en M1 lo hace el trabajador (manage.py run_worker); si ya hay
+    # una tarea en curso para el pedido se reutiliza en vez de duplicarla
+    tarea, _ = await sync_to_async(tareas.encolar_para_pedido)('consumir_stock', pedido, {'pedido_id': pedido.id})
     
-    if resultado['success']:
-        # Actualizar pedido
-        pedido.estado = 'enviado_cocina'
-        pedido.stock_consumido = True
-        pedido.timestamp_envio_cocina = timezone.now()
-        pedido.save()
-        
-        return JsonResponse({
-            'success': True,
-            'message': 'Pedido enviado a cocina correctamente',
-            'data': resultado['data']
-        })
-    else:
-        return JsonResponse({
-            'success': False,
-            'message': resultado['message']
-        }, status=400)
+    return JsonResponse({
+        'success': True,
+        'message': 'Pedido en cola para envío a cocina',
+        'tarea_id': tarea.id,
+        'estado_url': reverse('estado_tarea', args=[tarea.id])
+    }, status=202)
 
 @require_POST
-def cancelar_pedido(request, id):
+async def cancelar_pedido(request, id):
     """
     Cancela un pedido y libera la reserva de stock
     """
-    pedido = get_object_or_404(Pedidos, id=id)
+    pedido = await aget_object_or_404(Pedidos, id=id)
+    
+    if not estados.permitida(pedido.estado, 'cancelado'):
+        return JsonResponse({
+            'success': False,
+            'message': estados.mensaje_rechazo(pedido, 'cancelado')
+        }, status=400)
     
     # Solo cancelar stock si está validado pero no consumido
     if pedido.stock_validado and not pedido.stock_consumido:
-        platos = pedido.get_platos_para_m1()
+        platos = await pedido.aget_platos_para_m1()
         
         if platos:
             # Cancelar reserva en M1
-            resultado = menu_api.cancelar_reserva(platos)
+            resultado = await menu_api_async.cancelar_reserva(platos)
             
             if not resultado['success']:
                 return JsonResponse({
@@ -323,12 +553,15 @@ def cancelar_pedido(request, id):
                 }, status=400)
     
     # Actualizar estado y liberar mesa
-    pedido.estado = 'cancelado'
-    pedido.save()
+    if not await estados.atransicionar(pedido, 'cancelado'):
+        await pedido.arefresh_from_db(fields=['estado'])
+        return JsonResponse({
+            'success': False,
+            'message': estados.mensaje_rechazo(pedido, 'cancelado')
+        }, status=409)
     
-    mesa = pedido.mesa
-    mesa.ocupada = False
-    mesa.save()
+    await mesas.aliberar(pedido.mesa_id, excluir_pedido=pedido.id)
+    await eventos.apublicar('cancelado', pedido)
     
     return JsonResponse({
         'success': True,
@@ -340,6 +573,7 @@ def cancelar_pedido(request, id):
 # ============================================
 
 @require_POST
+@reintentar_si_bloqueada
 def cambiar_estado_pedido(request, id):
     """
     Cambia el estado del pedido manualmente
@@ -347,20 +581,238 @@ def cambiar_estado_pedido(request, id):
     pedido = get_object_or_404(Pedidos, id=id)
     nuevo_estado = request.POST.get('estado')
     
-    if nuevo_estado not in dict(Pedidos.ESTADO_CHOICES):
+    # Un único UPDATE condicionado al estado actual; los timestamps los fija la tabla de transiciones
+    try:
+        with transaction.atomic():
+            aplicada = estados.transicionar(pedido, nuevo_estado, manual=True)
+            if aplicada:
+                eventos.publicar(nuevo_estado if nuevo_estado in eventos.TIPOS_EVENTO else 'actualizado', pedido)
+    except estados.TransicionInvalida as e:
         return JsonResponse({
             'success': False,
-            'message': 'Estado no válido'
+            'message': str(e)
         }, status=400)
     
-    # Registrar timestamp de entrega
-    if nuevo_estado == 'entregado' and not pedido.timestamp_entrega:
-        pedido.timestamp_entrega = timezone.now()
-    
-    pedido.estado = nuevo_estado
-    pedido.save()
+    if not aplicada:
+        pedido.refresh_from_db(fields=['estado'])
+        return JsonResponse({
+            'success': False,
+            'message': estados.mensaje_rechazo(pedido, nuevo_estado)
+        }, status=409)
     
     return JsonResponse({
         'success': True,
         'message': f'Estado actualizado a: {pedido.get_estado_display()}'
-    })
\ No newline at end of file
+    })
+
+
+@require_POST
+@reintentar_si_bloqueada
+def cambiar_estado_lote(request):
+    """
+    Cambia el estado de varios pedidos a la vez (ej: marcar listos o entregados al cierre)
+
+    Recibe 'pedidos[]' con los IDs y 'estado' con el destino; retorna el resultado por pedido.
+    """
+    nuevo_estado = request.POST.get('estado')
+    maximo = getattr(settings, 'PEDIDOS_LOTE_MAXIMO', 200)
+    
+    try:
+        pedido_ids = [int(pedido_id) for pedido_id in request.POST.getlist('pedidos[]') if pedido_id]
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'message': 'IDs de pedido con formato inválido'
+        }, status=400)
+    
+    if not pedido_ids:
+        return JsonResponse({
+            'success': False,
+            'message': 'No se indicaron pedidos'
+        }, status=400)
+    
+    if len(pedido_ids) > maximo:
+        return JsonResponse({
+            'success': False,
+            'message': f'Se pueden actualizar hasta {maximo} pedidos por solicitud'
+        }, status=400)
+    
+    try:
+        with transaction.atomic():
+            aplicados, resultados = estados.transicionar_lote(pedido_ids, nuevo_estado, manual=True)
+            if aplicados:
+                eventos.publicar_lote(nuevo_estado if nuevo_estado in eventos.TIPOS_EVENTO else 'actualizado', aplicados)
+    except estados.TransicionInvalida as e:
+        return JsonResponse({
+            'success': False,
+            'message': str(e)
+        }, status=400)
+    
+    return JsonResponse({
+        'success': len(aplicados) == len(resultados),
+        'message': f'{len(aplicados)} de {len(resultados)} pedidos actualizados a: {dict(Pedidos.ESTADO_CHOICES)[nuevo_estado]}',
+        'data': {str(pedido_id): resultado for pedido_id, resultado in resultados.items()}
+    })
+
+
+def estado_tarea(request, id):
+    """
+    Estado de una tarea en segundo plano, consultado periódicamente por la interfaz
+    """
+    tarea = get_object_or_404(Tarea, id=id)
+    return JsonResponse({
+        'success': tarea.estado == 'completada',
+        'estado': tarea.estado,
+        'intentos': tarea.intentos,
+        'message': tarea.ultimo_error or tarea.get_estado_display(),
+        'data': tarea.resultado,
+    })
+
+
+# ============================================
+# ✅ REPORTES
+# ============================================
+
+def reporte_ventas(request):
+    """
+    Ventas entre dos fechas (por defecto, el mes en curso) leídas de los acumulados de ventas.py
+
+    Con ?formato=json retorna los mismos datos como JSON.
+    """
+    hoy = timezone.localdate()
+    try:
+        desde = datetime.strptime(request.GET['desde'], '%Y-%m-%d').date() if request.GET.get('desde') else hoy.replace(day=1)
+        hasta = datetime.strptime(request.GET['hasta'], '%Y-%m-%d').date() if request.GET.get('hasta') else hoy
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'message': 'Las fechas deben tener el formato AAAA-MM-DD'
+        }, status=400)
+
+    datos = ventas.resumen(desde, hasta)
+    nombres = {usuario.id: usuario.username for usuario in User.objects.filter(
+        id__in=[fila['mesero_id'] for fila in datos['por_mesero']]
+    ).only('id', 'username')}
+    for fila in datos['por_mesero']:
+        fila['mesero'] = nombres.get(fila['mesero_id'], 'Sin mesero')
+
+    if request.GET.get('formato') == 'json':
+        return JsonResponse({
+            'success': True,
+            'message': f'Ventas del {desde} al {hasta}',
+            'data': datos
+        })
+
+    return render(request, 'reporte_ventas.html', {
+        'desde': desde,
+        'hasta': hasta,
+        **datos,
+    })
+
+
+def exportar_pedidos(request):
+    """
+    Descarga completa de pedidos (incluidos los archivados) en CSV o JSONL, generada por streaming
+
+    Filtros por GET:
+        desde, hasta: fechas de creación AAAA-MM-DD inclusive
+        estado: uno o varios estados separados por coma
+        nivel: 'pedidos' (por defecto) o 'lineas' (una fila por plato)
+        formato: 'csv' (por defecto) o 'jsonl'
+    """
+    formato = request.GET.get('formato', 'csv')
+    nivel = request.GET.get('nivel', 'pedidos')
+    estados_filtro = [estado for estado in request.GET.get('estado', '').split(',') if estado]
+    try:
+        desde = datetime.strptime(request.GET['desde'], '%Y-%m-%d').date() if request.GET.get('desde') else None
+        hasta = datetime.strptime(request.GET['hasta'], '%Y-%m-%d').date() if request.GET.get('hasta') else None
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'message': 'Las fechas deben tener el formato AAAA-MM-DD'
+        }, status=400)
+
+    try:
+        lineas = exportacion.serializar(
+            formato, nivel, exportacion.filas(nivel, desde=desde, hasta=hasta, estados=estados_filtro)
+        )
+    except exportacion.ExportacionError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    if getattr(settings, 'SERVIDOR_ASGI', False):
+        # Bajo ASGI un iterador síncrono se consumiría entero antes de enviar nada
+        lineas = exportacion.aiterar(lineas)
+
+    nombre = f"pedidos-{nivel}-{desde or 'inicio'}-{hasta or timezone.localdate()}.{formato}"
+    respuesta = StreamingHttpResponse(
+        lineas,
+        content_type='text/csv; charset=utf-8' if formato == 'csv' else 'application/x-ndjson; charset=utf-8'
+    )
+    respuesta['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    respuesta['Cache-Control'] = 'no-store'
+    return respuesta
+
+
+# ============================================
+# ✅ EVENTOS EN TIEMPO REAL (SSE)
+# ============================================
+
+async def eventos_pedidos(request):
+    """
+    Flujo Server-Sent Events con los cambios de pedidos
+
+    Con EVENTOS_SSE_HABILITADO en False responde 204, que le indica al navegador
+    que no reconecte. Bajo ASGI los eventos llegan por el difusor del proceso;
+    bajo WSGI, por un generador síncrono con duración máxima (eventos.flujo_sincrono).
+
+    Filtros por GET:
+        pedido, mesa, mesero: IDs
+        estado: uno o varios estados separados por coma
+    """
+    if not getattr(settings, 'EVENTOS_SSE_HABILITADO', False):
+        return HttpResponse(status=204)
+
+    def entero(nombre):
+        valor = request.GET.get(nombre, '')
+        return int(valor) if valor.isdigit() else None
+
+    ultimo_id = request.headers.get('Last-Event-ID') or request.GET.get('desde', '')
+    suscripcion = eventos.Suscripcion(
+        pedido=entero('pedido'),
+        mesa=entero('mesa'),
+        mesero=entero('mesero'),
+        estados=[estado for estado in request.GET.get('estado', '').split(',') if estado],
+        ultimo_id=int(ultimo_id) if ultimo_id.isdigit() else 0,
+    )
+
+    # Bajo WSGI un iterador async se consumiría entero antes de enviar nada
+    flujo = eventos.flujo if getattr(settings, 'SERVIDOR_ASGI', False) else eventos.flujo_sincrono
+    response = StreamingHttpResponse(flujo(suscripcion), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# ============================================
+# ✅ MÉTRICAS (PROMETHEUS)
+# ============================================
+
+def metricas_prometheus(request):
+    """
+    Métricas en formato de texto de Prometheus
+
+    Los histogramas de vistas y de M1 se suman entre procesos (ver mainApp.metricas);
+    los pedidos por estado y las mesas ocupadas se leen de la base en cada consulta.
+    """
+    por_estado = dict.fromkeys(dict(Pedidos.ESTADO_CHOICES), 0)
+    por_estado.update(Pedidos.objects.values_list('estado').annotate(cantidad=Count('id')).order_by())
+    ocupacion = Mesas.objects.aggregate(total=Count('id'), ocupadas=Count('id', filter=Q(ocupada=True)))
+
+    texto = metricas.exponer({
+        'pedidos_por_estado': (
+            'Pedidos actuales en cada estado (sin los archivados)',
+            [({'estado': estado}, cantidad) for estado, cantidad in por_estado.items()],
+        ),
+        'pedidos_mesas_ocupadas': ('Mesas ocupadas', [({}, ocupacion['ocupadas'])]),
+        'pedidos_mesas_total': ('Mesas registradas', [({}, ocupacion['total'])]),
+    })
+    return HttpResponse(texto, content_type='text/plain; version=0.0.4; charset=utf-8')